@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+## Local stand-in for archive.org's advancedsearch.php, to measure `ArchiveOrgApi` offline.
+##
+##   $ python3 benchmarks/archive_stub.py 8042
+##
+## Then point the backend at it:
+##   ArchiveOrgApi(url_prefix='http://127.0.0.1:8042/advancedsearch.php',
+##                 scrape_url_prefix='http://127.0.0.1:8042/services/search/v1/scrape')
+
+import os
+import re
+import sys
+import gzip
+import json
+import base64
+import time
+import random
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+if bench_path not in sys.path:
+    sys.path.append(bench_path)
+
+from synth_calibre import WORDS, FIRST_NAMES, LAST_NAMES, PUBLISHERS, TAGS, SERIES
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+SEARCH_PATH = '/advancedsearch.php'
+SCRAPE_PATH = '/services/search/v1/scrape'
+
+## NB: `field:((TERMS OR TERM'S) AND PREFIX* AND ...)`, as generated by `recall_to_lucene()`, or `field:TERM`
+CLAUSE_RX = re.compile(r"(\w+):(?:\(((?:[^()]|\([^()]*\))*)\)|([^\s()]+))")
+
+DEFAULT_ROWS = 50
+
+
+
+## ------------------------------------------------------------------------
+## CORPUS
+
+def make_corpus(nb_docs, seed=1):
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(nb_docs):
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6))).title()
+        creators = [rnd.choice(FIRST_NAMES) + ' ' + rnd.choice(LAST_NAMES)
+                    for _ in range(rnd.randint(1, 2))]
+        doc = {
+            'identifier': 'stub_%07d' % i,
+            'title': title,
+            # NB: like the real API, single values are returned as strings
+            'creator': creators[0] if len(creators) == 1 else creators,
+            'publisher': rnd.choice(PUBLISHERS),
+            'subject': rnd.sample(TAGS, rnd.randint(1, 3)),
+            'collection': [rnd.choice(SERIES)],
+            'publicdate': '%04d-01-01T00:00:00Z' % rnd.choice([1850, 1950, 1999, 2005, 2020]),
+            'mediatype': 'texts',
+        }
+        docs.append(doc)
+    return docs
+
+
+def field_words(doc, field):
+    v = doc.get(field)
+    if v is None:
+        return set()
+    if isinstance(v, list):
+        v = ' '.join(v)
+    return set(re.findall(r"[\w']+", v.upper()))
+
+
+def term_matches(words, term):
+    if term.endswith('*'):
+        return any(w.startswith(term[:-1]) for w in words)
+    return term in words
+
+
+def doc_matches(doc, q):
+    clauses = CLAUSE_RX.findall(q)
+    if not clauses:
+        return True
+    for field, terms, term in clauses:
+        terms = terms or term
+        words = field_words(doc, field)
+        # NB: each AND-ed part being a term or a parenthesized OR of terms
+        if all(any(term_matches(words, t.upper()) for t in part.strip('()').split(' OR '))
+               for part in terms.split(' AND ')):
+            return True
+    return False
+
+
+
+## ------------------------------------------------------------------------
+## SERVER
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    # NB: keep-alive
+    protocol_version = 'HTTP/1.1'
+    # NB: headers and body are written separately, avoid waiting for a delayed ACK in between
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        stub = self.server.stub
+        with stub['lock']:
+            stub['stats']['connections'] += 1
+        # NB: stands for the TCP + TLS handshake of the real thing
+        if stub['connect_latency']:
+            time.sleep(stub['connect_latency'])
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub['lock']:
+            stub['stats']['requests'] += 1
+            nb_requests = stub['stats']['requests']
+
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in (SEARCH_PATH, SCRAPE_PATH):
+            return self.respond(404, {'error': 'not found'})
+
+        if stub['fail_every'] and nb_requests % stub['fail_every'] == 0:
+            with stub['lock']:
+                stub['stats']['failures'] += 1
+            return self.respond(503, {'error': 'injected failure'}, headers={'Retry-After': '0'})
+
+        if stub['latency']:
+            time.sleep(stub['latency'])
+
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == SCRAPE_PATH:
+            return self.do_scrape(params)
+
+        q = params.get('q', [''])[0]
+        fields = [f for f in params.get('fl[]', []) if f] or None
+        rows = int(params.get('rows', [DEFAULT_ROWS])[0])
+        page = int(params.get('page', [1])[0])
+
+        matches = [d for d in stub['docs'] if doc_matches(d, q)]
+        start = (page - 1) * rows
+        docs = matches[start:start + rows]
+        if fields is not None:
+            docs = [{k: v for k, v in d.items() if k in fields} for d in docs]
+
+        self.respond(200, {
+            'responseHeader': {'status': 0, 'params': {'query': q, 'rows': rows}},
+            'response': {'numFound': len(matches), 'start': start, 'docs': docs},
+        })
+
+    def do_scrape(self, params):
+        q = params.get('q', [''])[0]
+        fields = [f for f in params.get('fields', [''])[0].split(',') if f]
+        count = int(params.get('count', [DEFAULT_ROWS])[0])
+        # NB: opaque to the client
+        cursor = params.get('cursor', [None])[0]
+        start = int(base64.urlsafe_b64decode(cursor)) if cursor else 0
+
+        matches = [d for d in self.server.stub['docs'] if doc_matches(d, q)]
+        docs = [{k: v for k, v in d.items() if k in fields or k == 'identifier'}
+                for d in matches[start:start + count]]
+        payload = {'items': docs, 'count': len(docs), 'total': len(matches)}
+        if start + count < len(matches):
+            payload['cursor'] = base64.urlsafe_b64encode(str(start + count).encode()).decode()
+        self.respond(200, payload)
+
+    def respond(self, status, payload, headers={}):
+        body = json.dumps(payload).encode('utf-8')
+        is_gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if is_gzipped:
+            body = gzip.compress(body)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if is_gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+        stub = self.server.stub
+        with stub['lock']:
+            stub['stats']['bytes_sent'] += len(body)
+
+
+def start_stub_server(port=0, nb_docs=1000, latency=0, connect_latency=0, fail_every=0, docs=None):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.stub = {
+        'docs': docs if docs is not None else make_corpus(nb_docs),
+        'latency': latency,
+        'connect_latency': connect_latency,
+        'fail_every': fail_every,
+        'lock': threading.Lock(),
+        'stats': {'connections': 0, 'requests': 0, 'failures': 0, 'bytes_sent': 0},
+    }
+    server.url_prefix = 'http://127.0.0.1:%d%s' % (server.server_address[1], SEARCH_PATH)
+    server.scrape_url_prefix = 'http://127.0.0.1:%d%s' % (server.server_address[1], SCRAPE_PATH)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def reset_stats(server):
+    with server.stub['lock']:
+        for k in server.stub['stats']:
+            server.stub['stats'][k] = 0
+
+
+
+## ------------------------------------------------------------------------
+## SCRIPT
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8042
+    server = start_stub_server(port=port)
+    print('serving ' + server.url_prefix + ' and ' + server.scrape_url_prefix)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
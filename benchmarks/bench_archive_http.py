@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+## archive.org backend: one-shot `requests.get()` vs pooled keep-alive session vs on-disk response cache,
+## against the local stub.
+##
+##   $ python3 benchmarks/bench_archive_http.py [CONNECT_LATENCY_MS] [LATENCY_MS]
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from archive_stub import start_stub_server, reset_stats
+
+import dynix_ng.library.backend.archive as archive
+from dynix_ng.library.backend.archive import ArchiveOrgApi
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+## NB: a TLS handshake to archive.org is typically 2-3 RTTs, i.e. ~100ms+
+CONNECT_LATENCY = 0.05
+LATENCY = 0.005
+
+NB_SEARCHES = 20
+
+QUERIES = ['WAR', 'GONE WIND', 'COMPUT?', 'CAT']
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def search(backend, user_query):
+    # NB: same requests as the UI: a count, then the 1st page of results
+    query_terms = recall.user_query_to_recall(user_query)
+    where = recall.recall_to_db_dialect(backend, ['title'], query_terms)
+    backend.item_list(fetch_format='count', where=where)
+    backend.item_list(fetch_mode='all', fetch_format='k_v', where=where,
+                      limit=8, summary=True)
+
+
+class OneShotArchiveOrgApi(ArchiveOrgApi):
+    # NB: behaviour before pooling: a new connection per request
+    def search_raw(self, q, **kwargs):
+        return archive.search_raw(q, url_prefix=self.url_prefix, timeout=self.timeout, **kwargs)
+
+
+def bench(server, backend):
+    reset_stats(server)
+    timings = []
+    for i in range(NB_SEARCHES):
+        start = time.perf_counter()
+        search(backend, QUERIES[i % len(QUERIES)])
+        timings.append(time.perf_counter() - start)
+    stats = dict(server.stub['stats'])
+    return (timings, stats)
+
+
+def report(label, timings, stats):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print('%-10s median=%7.1fms  p95=%7.1fms  requests=%3d  connections=%3d  failures=%2d  bytes=%d'
+          % (label, statistics.median(timings) * 1000, p95 * 1000,
+             stats['requests'], stats['connections'], stats['failures'], stats['bytes_sent']))
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(connect_latency=CONNECT_LATENCY, latency=LATENCY):
+    print('%d searches (count + 1st page), connect latency=%dms, server latency=%dms'
+          % (NB_SEARCHES, connect_latency * 1000, latency * 1000))
+
+    server = start_stub_server(latency=latency, connect_latency=connect_latency)
+    report('one-shot', *bench(server, OneShotArchiveOrgApi(url_prefix=server.url_prefix)))
+    report('pooled', *bench(server, ArchiveOrgApi(url_prefix=server.url_prefix, cache=False)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_path = os.path.join(tmp_dir, 'responses.db')
+        backend = ArchiveOrgApi(url_prefix=server.url_prefix, cache_path=cache_path)
+        report('cached', *bench(server, backend))
+        backend.close()
+        # NB: new process, same cache file
+        backend = ArchiveOrgApi(url_prefix=server.url_prefix, cache_path=cache_path)
+        report('restarted', *bench(server, backend))
+        print('cache: %r' % backend.cache.stats())
+        backend.close()
+    server.shutdown()
+
+    # NB: every 3rd request answered w/ a 503, retried transparently
+    server = start_stub_server(latency=latency, connect_latency=connect_latency, fail_every=3)
+    report('flaky', *bench(server, ArchiveOrgApi(url_prefix=server.url_prefix, backoff_factor=0,
+                                                 cache=False)))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    args = [int(a) / 1000 for a in sys.argv[1:3]]
+    main(*args)
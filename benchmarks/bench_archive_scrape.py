@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+## archive.org backend: streaming all the results of a search through the scrape API cursor,
+## w/ and w/o read-ahead, against the local stub.
+##
+##   $ python3 benchmarks/bench_archive_scrape.py [NB_DOCS] [LATENCY_MS]
+
+import os
+import sys
+import time
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from archive_stub import start_stub_server, doc_matches
+
+from dynix_ng.library.backend.archive import ArchiveOrgApi
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+NB_DOCS = 5000
+LATENCY = 0.05
+
+## NB: time spent displaying each page of results
+CONSUMER_DELAY = 0.05
+
+USER_QUERY = 'A?'
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def stream_sequential(backend, where):
+    # NB: same as `item_stream()`, w/o read-ahead
+    cursor = None
+    while True:
+        raw_res = backend.scrape_raw(where, returned_fields=backend.SUMMARY_RETURNED_FIELDS,
+                                     cursor=cursor)
+        for raw_item in raw_res['items']:
+            yield backend.normalize_item(raw_item)
+        cursor = raw_res.get('cursor')
+        if cursor is None or not raw_res['items']:
+            return
+
+
+def consume(stream, page_size):
+    start = time.perf_counter()
+    first_item_time = None
+    item_ids = []
+    for item in stream:
+        if first_item_time is None:
+            first_item_time = time.perf_counter() - start
+        item_ids.append(item['item_id'])
+        if len(item_ids) % page_size == 0:
+            time.sleep(CONSUMER_DELAY)
+    return (item_ids, first_item_time, time.perf_counter() - start)
+
+
+def report(label, item_ids, first_item_time, total_time):
+    print('%-12s items=%6d  first item=%7.1fms  total=%8.1fms'
+          % (label, len(item_ids), first_item_time * 1000, total_time * 1000))
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(nb_docs=NB_DOCS, latency=LATENCY):
+    server = start_stub_server(nb_docs=nb_docs, latency=latency)
+    backend = ArchiveOrgApi(url_prefix=server.url_prefix, scrape_url_prefix=server.scrape_url_prefix,
+                            cache=False)
+
+    where = recall.recall_to_db_dialect(backend, ['title'], recall.user_query_to_recall(USER_QUERY))
+    expected = [d['identifier'] for d in server.stub['docs'] if doc_matches(d, where)]
+    print('%s: %d matches out of %d, server latency=%dms, display=%dms/page'
+          % (where, len(expected), nb_docs, latency * 1000, CONSUMER_DELAY * 1000))
+
+    (item_ids, *timings) = consume(stream_sequential(backend, where), 100)
+    assert item_ids == expected
+    report('sequential', item_ids, *timings)
+
+    (item_ids, *timings) = consume(backend.item_stream(where, summary=True), 100)
+    assert item_ids == expected
+    report('read-ahead', item_ids, *timings)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    nb_docs = int(sys.argv[1]) if len(sys.argv) > 1 else NB_DOCS
+    latency = int(sys.argv[2]) / 1000 if len(sys.argv) > 2 else LATENCY
+    main(nb_docs, latency)
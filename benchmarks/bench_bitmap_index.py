@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+## Recall counts: REGEXP path vs in-memory bitmap index, on synthetic libraries.
+##
+##   $ python3 benchmarks/bench_bitmap_index.py 10000 100000 1000000
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+from dynix_ng.library.backend.calibre import CalibreDb
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+SIZES = [10000, 100000, 1000000]
+
+REPEAT = 3
+
+QUERIES = [
+    ('title', 'WAR'),
+    ('title', 'GONE WIND'),
+    ('title', 'CATS'),
+    ('word', 'COMPUT?'),
+    ('word', 'MARK TWAIN'),
+]
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def timed(fn, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        timings.append(time.perf_counter() - start)
+    return (res, statistics.median(timings))
+
+
+def regexp_count(db, columns, query_terms):
+    where = recall.recall_to_sql(columns, query_terms, db.BACKEND_DIALECT)
+    return db.item_list(fetch_format='count', where=where)
+
+
+def bitmap_count(db, columns, query_terms):
+    return len(db.bitmap_index.recall_matches(columns, query_terms))
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def bench(nb_books, tmp_dir):
+    db_path = os.path.join(tmp_dir, 'metadata-' + str(nb_books) + '.db')
+    generate(db_path, nb_books)
+
+    start = time.perf_counter()
+    db = CalibreDb(db_path, fts_index=False, bitmap_index=True)
+    db.sync_indices()
+    build_time = time.perf_counter() - start
+
+    print('## ' + str(nb_books) + ' books')
+    print('bitmap index: built in %.2fs, %.1f MiB' % (build_time, db.bitmap_index.nbytes() / 2**20))
+    print('%-8s %-12s %10s %12s %12s %8s' % ('TYPE', 'QUERY', 'HITS', 'REGEXP (ms)', 'BITMAP (ms)', 'SPEEDUP'))
+    for (search_type, user_query) in QUERIES:
+        columns = db.search_type_corresponding_fields(search_type)
+        query_terms = recall.user_query_to_recall(user_query)
+        (rx_hits, rx_time) = timed(lambda: regexp_count(db, columns, query_terms))
+        (bm_hits, bm_time) = timed(lambda: bitmap_count(db, columns, query_terms))
+        assert rx_hits == bm_hits, (user_query, rx_hits, bm_hits)
+        print('%-8s %-12s %10d %12.2f %12.3f %7.0fx' % (search_type, user_query, bm_hits,
+                                                        rx_time * 1000, bm_time * 1000, rx_time / bm_time))
+    print()
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or SIZES
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for nb_books in sizes:
+            bench(nb_books, tmp_dir)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+## Adding words to a broad search: matching the new term over the whole catalog then intersecting,
+## vs only testing it against the current matches, on synthetic libraries.
+##
+##   $ python3 benchmarks/bench_narrowing.py 10000 100000
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+from dynix_ng.library.backend.calibre import CalibreDb
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+SIZES = [10000, 100000]
+
+REPEAT = 3
+
+## NB: (broad search, word added)
+QUERIES = [
+    ('THE', 'WAR'),
+    ('A?', 'GONE'),
+    ('THE', 'CATS'),
+]
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def timed(fn, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = fn()
+        timings.append(time.perf_counter() - start)
+    return (res, statistics.median(timings))
+
+
+def whole_catalog(db, matches, term):
+    return matches & db.term_item_ids('title', term)
+
+
+def within_matches(db, matches, term):
+    return db.term_item_ids('title', term, within=matches)
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(sizes):
+    for nb_books in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'metadata.db')
+            generate(db_path, nb_books)
+            for fts_index in (False, True):
+                db = CalibreDb(db_path, fts_index=fts_index, token_index=False)
+                db.sync_indices()
+                print('%d books, %s' % (nb_books, 'FTS5' if db.fts_index else 'REGEXP'))
+                for (broad, term) in QUERIES:
+                    matches = db.term_item_ids('title', broad)
+                    (res_whole, t_whole) = timed(lambda: whole_catalog(db, matches, term))
+                    (res_within, t_within) = timed(lambda: within_matches(db, matches, term))
+                    assert res_whole == res_within
+                    print('  %-6s + %-6s %6d -> %5d  whole catalog=%8.2fms  within matches=%8.2fms'
+                          % (broad, term, len(matches), len(res_within), t_whole * 1000, t_within * 1000))
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or SIZES
+    main(sizes)
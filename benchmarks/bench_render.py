@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+## Terminal output and wakeups of the UI while idle, per screen.
+## ncurses doesn't expose what it writes, so the app gets run in a pseudo-terminal and its output counted.
+## Wakeups are the voluntary context switches of the process (Linux only).
+##
+##   $ pip install pexpect
+##   $ python3 benchmarks/bench_render.py [PATH_TO_DYNIX_NG_INIT_PY ...]
+##
+## Several paths can be passed to compare w/ another checkout.
+
+import os
+import sys
+import time
+
+import pexpect
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_APP_PATH = os.path.abspath(bench_path + '/../dynix_ng/__init__.py')
+
+IDLE_DURATION = 5
+
+TERM_SIZE = (24, 80)
+
+## NB: (label, keys to send to get there)
+SCENARIO = [
+    ('welcome', None),
+    ('search', '3\r'),
+    ('counter', 'cat\r'),
+]
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def drain(app, duration):
+    nb_bytes = 0
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            nb_bytes += len(app.read_nonblocking(100000, timeout=0.1))
+        except pexpect.TIMEOUT:
+            pass
+    return nb_bytes
+
+
+def nb_context_switches(pid):
+    # NB: summed over all threads
+    nb = 0
+    try:
+        for tid in os.listdir('/proc/%d/task' % pid):
+            with open('/proc/%d/task/%s/status' % (pid, tid)) as f:
+                for line in f:
+                    if line.startswith('voluntary_ctxt_switches:'):
+                        nb += int(line.split()[1])
+    except OSError:
+        return None
+    return nb
+
+
+def bench(app_path):
+    env = dict(os.environ, TERM='xterm')
+    app = pexpect.spawn(sys.executable, [app_path], env=env, dimensions=TERM_SIZE, timeout=10)
+    res = []
+    try:
+        for label, keys in SCENARIO:
+            if keys is not None:
+                app.send(keys)
+            # NB: let the screen settle
+            drain(app, 2)
+            nb_switches = nb_context_switches(app.pid)
+            nb_bytes = drain(app, IDLE_DURATION)
+            if nb_switches is not None:
+                nb_switches = nb_context_switches(app.pid) - nb_switches
+            res.append((label, nb_bytes, nb_switches))
+    finally:
+        app.terminate(force=True)
+    return res
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(app_paths):
+    print('idle over %ds, %dx%d terminal' % (IDLE_DURATION, *TERM_SIZE))
+    for app_path in app_paths:
+        print(app_path)
+        for label, nb_bytes, nb_switches in bench(app_path):
+            print('  %-10s %6d bytes  %6.1f bytes/s  %5s wakeups'
+                  % (label, nb_bytes, nb_bytes / IDLE_DURATION, nb_switches if nb_switches is not None else '?'))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [DEFAULT_APP_PATH])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+## Search latencies on synthetic Calibre libraries, per backend index and query shape:
+##  - `recall_to_sql`: translation of the query terms to a SQL filter
+##  - `count`: `CalibreDb.item_list()` count of the matches
+##  - `detailed`: `CalibreDb.item_list()` 1st page of full records
+##  - `incremental`: `DynixSearch.query_count_incremental()`, i.e. the running count of the search screen
+##
+##   $ python3 benchmarks/bench_search.py [NB_BOOKS ...]
+##
+## Peak memory is the one of the Python heap during a single run (`tracemalloc`), SQLite's page cache
+## not included. Process peak RSS gets reported after each library.
+
+import os
+import sys
+import math
+import time
+import resource
+import tempfile
+import tracemalloc
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+from dynix_ng.library.backend.calibre import CalibreDb
+import dynix_ng.library.index.bitmap as bitmap
+import dynix_ng.ui.session as session
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+SIZES = [10000, 100000]
+
+REPEAT = 50
+
+PAGE_SIZE = 8
+
+## NB: (search type, query shape, user query)
+QUERIES = [
+    ('title', 'single word', 'WAR'),
+    ('title', 'multi-word', 'GONE WIND'),
+    ('title', 'wildcard', 'COMPUT?'),
+    ('title', 'short stem', 'S?'),
+    ('title', 'plural', 'CATS'),
+    ('word', 'single word', 'TWAIN'),
+    ('word', 'multi-word', 'MARK TWAIN'),
+    ('word', 'wildcard', 'SCIEN?'),
+    ('word', 'short stem', 'S?'),
+    ('word', 'plural', 'STARS'),
+]
+
+OPS = ['recall_to_sql', 'count', 'detailed', 'incremental']
+
+
+
+## ------------------------------------------------------------------------
+## OPS
+
+def backends(db_path):
+    res = [('REGEXP', CalibreDb(db_path, fts_index=False, token_index=False)),
+           ('FTS5', CalibreDb(db_path, token_index=False)),
+           ('tokens', CalibreDb(db_path, fts_index=False))]
+    if bitmap.is_available():
+        res.append(('bitmap', CalibreDb(db_path, fts_index=False, token_index=False, bitmap_index=True)))
+    # NB: or searches would use REGEXP until the sidecars are built
+    for (_, db) in res:
+        db.sync_indices()
+    return res
+
+
+def make_op(op, db, search_type, user_query):
+    fields = db.search_type_corresponding_fields(search_type)
+    query_terms = recall.user_query_to_recall(user_query)
+    where = recall.recall_to_db_dialect(db, fields, query_terms)
+
+    if op == 'recall_to_sql':
+        return lambda: recall.recall_to_sql(fields, query_terms, db.BACKEND_DIALECT)
+    elif op == 'count':
+        return lambda: db.item_list(fetch_mode='first', fetch_format='count', where=where)
+    elif op == 'detailed':
+        return lambda: len(db.item_list(fetch_mode='all', fetch_format='k_v', where=where,
+                                        detailed=True, limit=PAGE_SIZE))
+
+    def incremental():
+        # NB: from scratch, w/o matches cached by previous runs
+        session.SEARCH_CACHE.clear()
+        search = session.DynixSearch(user_query, db, search_type)
+        search.query_count_incremental()
+        return search.results_total_count
+    return incremental
+
+
+
+## ------------------------------------------------------------------------
+## MEASURE
+
+def timed(fn, repeat=REPEAT):
+    # NB: 1st run is a warm-up (SQLite page cache, FTS5 sidecar...)
+    res = fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return (res, timings)
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def pct(values, p):
+    # NB: nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p) - 1)] * 1000
+
+
+def peak_rss_mib():
+    # NB: KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(sizes):
+    print('%d runs per measure, latencies in ms' % REPEAT)
+    for nb_books in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'metadata.db')
+            start = time.perf_counter()
+            generate(db_path, nb_books)
+            print('%d books, %.1f MiB, generated in %.1fs'
+                  % (nb_books, os.path.getsize(db_path) / 2**20, time.perf_counter() - start))
+            # NB: the sidecars go to the user's cache dir
+            os.environ['XDG_CACHE_HOME'] = tmp_dir
+
+            print('  %-7s %-6s %-12s %-16s %-14s %7s %9s %9s %9s %10s'
+                  % ('index', 'type', 'shape', 'query', 'op', 'res', 'p50', 'p95', 'p99', 'peak KiB'))
+            for (label, db) in backends(db_path):
+                for (search_type, shape, user_query) in QUERIES:
+                    for op in OPS:
+                        fn = make_op(op, db, search_type, user_query)
+                        (res, timings) = timed(fn)
+                        peak = peak_memory(fn)
+                        if op == 'recall_to_sql':
+                            res = ''
+                        print('  %-7s %-6s %-12s %-16s %-14s %7s %9.3f %9.3f %9.3f %10.1f'
+                              % (label, search_type, shape, user_query, op, res,
+                                 pct(timings, 0.5), pct(timings, 0.95), pct(timings, 0.99), peak / 1024))
+                db.close()
+            print('  peak RSS: %.1f MiB' % peak_rss_mib())
+
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in sys.argv[1:]] or SIZES
+    main(sizes)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+## Concurrent queries on `CalibreDb`: a single connection (i.e. queries serialized, as before the pool)
+## vs a pool of read-only connections, on a synthetic library.
+##
+## Each thread loops over either a long scan (REGEXP count over authors) or a short lookup
+## (1st page of results + a full record), like sessions browsing while others search.
+##
+##   $ python3 benchmarks/bench_sqlite_pool.py [NB_BOOKS]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+from dynix_ng.library.backend.calibre import CalibreDb
+from dynix_ng.utils.sqlite_pool import POOL_SIZE
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+NB_BOOKS = 50000
+
+DURATION = 5
+
+## NB: (nb of threads doing long scans, nb of threads doing short lookups)
+MIXES = [(0, 4), (2, 4), (4, 0)]
+
+LONG_QUERIES = [['TWAIN', 'DICK?'], ['LEO'], ['ANN', 'O?']]
+SHORT_QUERIES = [['HOUSE'], ['CAT'], ['WAR'], ['GONE', 'WIND']]
+
+
+
+## ------------------------------------------------------------------------
+## WORKLOAD
+
+def long_scan(db, rnd):
+    where = recall.recall_to_sql(['author'], rnd.choice(LONG_QUERIES), db.BACKEND_DIALECT)
+    db.item_list(fetch_mode='first', fetch_format='count', where=where)
+
+
+def short_lookup(db, rnd):
+    where = recall.recall_to_db_dialect(db, ['title'], rnd.choice(SHORT_QUERIES))
+    items = db.item_list(fetch_mode='all', fetch_format='k_v', where=where, limit=8, summary=True)
+    if items:
+        db.item_record(next(iter(items)))
+
+
+def worker(db, fn, seed, end, timings):
+    rnd = random.Random(seed)
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        fn(db, rnd)
+        timings.append(time.perf_counter() - start)
+
+
+def run(db, nb_long, nb_short):
+    end = time.perf_counter() + DURATION
+    timings = {'long': [], 'short': []}
+    threads = [threading.Thread(target=worker, args=(db, long_scan, i, end, timings['long']))
+               for i in range(nb_long)]
+    threads += [threading.Thread(target=worker, args=(db, short_lookup, 100 + i, end, timings['short']))
+                for i in range(nb_short)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return timings
+
+
+def pct(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def report(label, timings):
+    for kind in ('long', 'short'):
+        values = timings[kind]
+        if not values:
+            continue
+        print('    %-10s %-5s %7.1f q/s  p50=%8.1fms  p95=%8.1fms'
+              % (label, kind, len(values) / DURATION, pct(values, 0.5), pct(values, 0.95)))
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(nb_books=NB_BOOKS):
+    print('%d books, %d cores, %ds per run' % (nb_books, os.cpu_count() or 1, DURATION))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'metadata.db')
+        generate(db_path, nb_books)
+        # NB: the FTS5 sidecar goes to the user's cache dir
+        os.environ['XDG_CACHE_HOME'] = tmp_dir
+        dbs = [('1 cnnx', CalibreDb(db_path, pool_size=1)),
+               ('pool of %d' % POOL_SIZE, CalibreDb(db_path))]
+        for (_, db) in dbs:
+            db.sync_indices()
+        for (nb_long, nb_short) in MIXES:
+            print('  %d long scan threads, %d short lookup threads' % (nb_long, nb_short))
+            for (label, db) in dbs:
+                report(label, run(db, nb_long, nb_short))
+        for (_, db) in dbs:
+            db.close()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
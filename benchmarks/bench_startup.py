@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+## Startup time of the app in a pseudo-terminal: from launching the process to the welcome screen being
+## displayed (time to first frame), then from submitting a 1st search to its counter screen.
+## Runs w/ a synthetic Calibre library and w/o any library (e.g. misconfigured kiosk).
+##
+##   $ pip install pexpect
+##   $ python3 benchmarks/bench_startup.py [PATH_TO_DYNIX_NG_INIT_PY ...]
+##
+## Several paths can be passed to compare w/ another checkout.
+
+import os
+import sys
+import math
+import time
+import tempfile
+
+import pexpect
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+DEFAULT_APP_PATH = os.path.abspath(bench_path + '/../dynix_ng/__init__.py')
+
+NB_BOOKS = 10000
+
+REPEAT = 10
+
+TERM_SIZE = (24, 80)
+
+TIMEOUT = 30
+
+## NB: as a user would, after reading the menu
+THINK_TIME = 0.5
+
+WELCOME_MARKER = 'Enter your selection'
+SEARCH_SCREEN_MARKER = 'HUCKLEBERRY'
+SEARCH_MARKERS = ['Running Total', 'Your search:', 'Search failed']
+
+
+
+## ------------------------------------------------------------------------
+## BENCH
+
+def run(app_path, home):
+    # NB: returns (time to 1st frame, time to 1st search), None for the steps that failed
+    env = dict(os.environ, TERM='xterm', HOME=home, XDG_CACHE_HOME=os.path.join(home, '.cache'))
+    first_frame = None
+    start = time.perf_counter()
+    app = pexpect.spawn(sys.executable, [app_path], env=env, dimensions=TERM_SIZE, timeout=TIMEOUT)
+    try:
+        app.expect_exact(WELCOME_MARKER)
+        first_frame = time.perf_counter() - start
+        time.sleep(THINK_TIME)
+        app.send('3\r')
+        # NB: curses only sends what changed, so markers must be new text at their position
+        app.expect_exact(SEARCH_SCREEN_MARKER)
+        start = time.perf_counter()
+        app.send('cat\r')
+        app.expect_exact(SEARCH_MARKERS)
+        return (first_frame, time.perf_counter() - start)
+    except (pexpect.EOF, pexpect.TIMEOUT):
+        # NB: e.g. crashed at startup
+        return (first_frame, None)
+    finally:
+        app.terminate(force=True)
+
+
+def pct(values, p):
+    # NB: nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p) - 1)] * 1000
+
+
+def report(label, values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return '%s: failed' % label
+    return '%s p50=%7.1fms p95=%7.1fms' % (label, pct(values, 0.5), pct(values, 0.95))
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def main(app_paths):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        library_home = os.path.join(tmp_dir, 'library')
+        os.makedirs(os.path.join(library_home, 'Calibre Library'))
+        generate(os.path.join(library_home, 'Calibre Library', 'metadata.db'), NB_BOOKS)
+        empty_home = os.path.join(tmp_dir, 'empty')
+        os.makedirs(empty_home)
+
+        print('%d runs, %d books, %dms think time before the 1st search' % (REPEAT, NB_BOOKS, THINK_TIME * 1000))
+        for app_path in app_paths:
+            print(app_path)
+            for (label, home) in (('library', library_home), ('no library', empty_home)):
+                # NB: 1st run builds the FTS5 sidecar
+                run(app_path, home)
+                res = [run(app_path, home) for _ in range(REPEAT)]
+                print('  %-10s  %s  %s' % (label, report('1st frame', [r[0] for r in res]),
+                                           report('1st search', [r[1] for r in res])))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [DEFAULT_APP_PATH])
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+## Load test of the telnet server: concurrent sessions on loopback, each looping over
+## main menu -> TITLE Keyword Search -> query -> results -> Start Over.
+##
+##   $ python3 benchmarks/bench_telnet.py [NB_SESSIONS ...]
+##
+## The server runs in its own process (`dynix_ng/__init__.py --telnet`), against the user's Calibre library
+## (see benchmarks/synth_calibre.py to generate one).
+## Latencies are from sending a line to the expected screen being displayed.
+
+import os
+import re
+import sys
+import time
+import random
+import socket
+import asyncio
+import subprocess
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+APP_PATH = os.path.abspath(bench_path + '/../dynix_ng/__init__.py')
+
+HOST = '127.0.0.1'
+PORT = 2399
+
+NB_SESSIONS = [1, 10, 50, 100]
+DURATION = 10
+
+## NB: delay between steps, i.e. a fast typist
+THINK_TIME = 0.1
+
+STEP_TIMEOUT = 10
+
+QUERIES = ['HOUSE QUEEN', 'CAT', 'GONE WIND', 'COMPUT?', 'STAR SEA', 'WAR KING']
+
+LINES = 24
+COLS = 80
+
+## NB: report 80x24 right away, so that the server doesn't wait for it
+NAWS = bytes([255, 251, 31, 255, 250, 31, 0, COLS, 0, LINES, 255, 240])
+
+
+
+## ------------------------------------------------------------------------
+## CLIENT
+
+## NB: only understands what `VirtualTerminal` emits: cursor moves, SGR and clear
+
+ESCAPE_RX = re.compile(r'\x1b\[([0-9;]*)([A-Za-z])')
+TELNET_RX = re.compile(rb'\xff[\xfb-\xfe].|\xff\xfa.*?\xff\xf0', re.DOTALL)
+
+
+class ScreenClient():
+
+    def __init__(self):
+        self.grid = [[' '] * COLS for _ in range(LINES)]
+        self.y = 0
+        self.x = 0
+        self.pending = b''
+        self.nb_bytes = 0
+
+    def feed(self, data):
+        self.nb_bytes += len(data)
+        data = TELNET_RX.sub(b'', self.pending + data)
+        # NB: incomplete escape or utf-8 sequence at the end
+        cut = data.rfind(b'\x1b')
+        if cut >= 0 and not ESCAPE_RX.match(data[cut:].decode('utf-8', 'ignore')):
+            (data, self.pending) = (data[:cut], data[cut:])
+        else:
+            self.pending = b''
+        text = data.decode('utf-8', 'replace')
+        pos = 0
+        for m in ESCAPE_RX.finditer(text):
+            self.put(text[pos:m.start()])
+            (params, cmd) = m.groups()
+            if cmd == 'H':
+                (y, x) = (params.split(';') + ['1', '1'])[:2] if params else ('1', '1')
+                self.y = int(y or 1) - 1
+                self.x = int(x or 1) - 1
+            elif cmd == 'J':
+                self.grid = [[' '] * COLS for _ in range(LINES)]
+            pos = m.end()
+        self.put(text[pos:])
+
+    def put(self, s):
+        for ch in s:
+            if 0 <= self.y < LINES and 0 <= self.x < COLS:
+                self.grid[self.y][self.x] = ch
+            self.x += 1
+
+    def contains(self, marker):
+        return any(marker in ''.join(row) for row in self.grid)
+
+
+async def expect(reader, client, markers):
+    # NB: returns the marker found
+    deadline = time.perf_counter() + STEP_TIMEOUT
+    while True:
+        for marker in markers:
+            if client.contains(marker):
+                return marker
+        data = await asyncio.wait_for(reader.read(65536), deadline - time.perf_counter())
+        if not data:
+            raise ConnectionResetError()
+        client.feed(data)
+
+
+async def step(reader, writer, client, line, markers, latencies):
+    writer.write(line.encode() + b'\r\n')
+    start = time.perf_counter()
+    marker = await expect(reader, client, markers)
+    latencies.append(time.perf_counter() - start)
+    await asyncio.sleep(THINK_TIME)
+    return marker
+
+
+async def session(i, end, res):
+    rnd = random.Random(i)
+    (reader, writer) = await asyncio.open_connection(HOST, PORT)
+    writer.write(NAWS)
+    client = ScreenClient()
+    try:
+        start = time.perf_counter()
+        await expect(reader, client, ['Enter your selection'])
+        res['connect'].append(time.perf_counter() - start)
+        while time.perf_counter() < end:
+            await step(reader, writer, client, '3', ['Enter TITLE keywords'], res['menu'])
+            await step(reader, writer, client, rnd.choice(QUERIES), ['Your search:', 'Running Total'], res['search'])
+            await step(reader, writer, client, 'SO', ['Enter your selection'], res['menu'])
+            res['scenarios'] += 1
+    except (asyncio.TimeoutError, ConnectionError):
+        res['errors'] += 1
+    finally:
+        res['bytes'] += client.nb_bytes
+        writer.close()
+
+
+async def run_clients(nb_sessions, duration):
+    res = {'connect': [], 'menu': [], 'search': [], 'scenarios': 0, 'errors': 0, 'bytes': 0}
+    end = time.perf_counter() + duration
+    await asyncio.gather(*[session(i, end, res) for i in range(nb_sessions)])
+    return res
+
+
+
+## ------------------------------------------------------------------------
+## SERVER PROCESS
+
+def start_server():
+    server = subprocess.Popen([sys.executable, APP_PATH, '--telnet', str(PORT), '--host', HOST],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError(server.stderr.read().decode())
+            time.sleep(0.1)
+    raise RuntimeError('server not listening')
+
+
+def process_stats(pid):
+    # NB: cpu time (s) and peak resident memory (MiB), Linux only
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/%d/status' % pid) as f:
+            hwm = [int(l.split()[1]) for l in f if l.startswith('VmHWM:')][0] / 1024
+        return (cpu, hwm)
+    except (OSError, IndexError):
+        return (None, None)
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def pct(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def main(nb_sessions_list):
+    server = start_server()
+    try:
+        print('%d s per run, think time %dms' % (DURATION, THINK_TIME * 1000))
+        print('%8s %10s %8s %7s %24s %24s %9s %8s %8s'
+              % ('sessions', 'scenarios', 'scen/s', 'errors', 'menu p50/p95/p99 (ms)',
+                 'search p50/p95/p99 (ms)', 'KiB/scen', 'cpu (s)', 'rss MiB'))
+        for nb_sessions in nb_sessions_list:
+            (cpu_before, _) = process_stats(server.pid)
+            res = asyncio.run(run_clients(nb_sessions, DURATION))
+            (cpu_after, hwm) = process_stats(server.pid)
+            cpu = cpu_after - cpu_before if cpu_after is not None else float('nan')
+            print('%8d %10d %8.1f %7d %8.1f/%6.1f/%7.1f %8.1f/%6.1f/%7.1f %9.1f %8.2f %8.1f'
+                  % (nb_sessions, res['scenarios'], res['scenarios'] / DURATION, res['errors'],
+                     pct(res['menu'], 0.5), pct(res['menu'], 0.95), pct(res['menu'], 0.99),
+                     pct(res['search'], 0.5), pct(res['search'], 0.95), pct(res['search'], 0.99),
+                     res['bytes'] / 1024 / max(res['scenarios'], 1), cpu, hwm or float('nan')))
+            # NB: let sessions close
+            time.sleep(1)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(args or NB_SESSIONS)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+## UI latencies w/o a terminal, on a synthetic Calibre library: scripted sessions going through
+## welcome -> TITLE Keyword Search -> search counter -> summary -> item -> Start Over.
+##
+##   $ python3 benchmarks/bench_ui.py [NB_BOOKS] [NB_SESSIONS]
+##
+## Sessions are driven by `HeadlessDriver` (see `dynix_ng/ui/headless.py`) and report:
+##  - frame: time spent drawing a frame, from the start of the update / key press to `doupdate()`
+##  - key echo: from a key press to the character being displayed in the input field
+##  - <Return>: from <Return> being pressed to the 1st frame, and to the next screen being fully displayed
+##    (for searches, that includes waiting for the count)
+##  - bytes: what would be sent to the terminal, per step
+
+import os
+import sys
+import math
+import time
+import tempfile
+
+bench_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(bench_path + '/..')
+if module_path not in sys.path:
+    sys.path.append(module_path)
+
+from synth_calibre import generate
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+NB_BOOKS = 10000
+NB_SESSIONS = 20
+
+## NB: (step, keys typed before <Return>, marker of the screen it leads to)
+## queries are broad enough to stay on the counter screen
+FLOW = [
+    ('menu', '3', 'Enter TITLE keywords'),
+    ('search', '{query}', 'Running Total'),
+    ('display', 'D', 'Your search:'),
+    ('item', '1', 'Call Number:'),
+    ('start over', 'SO', 'Enter your selection'),
+]
+
+QUERIES = ['THE', 'A?', 'OF', 'WAR', 'THE CATS', 'COMPUT?']
+
+
+
+## ------------------------------------------------------------------------
+## SESSION
+
+def run_session(driver, query, res):
+    try:
+        driver.start()
+        driver.wait_for('Enter your selection')
+        for (step, keys, marker) in FLOW:
+            keys = keys.format(query=query)
+            nb_frames = len(driver.frames)
+            for k in keys:
+                frames = driver.press(k)
+                if frames:
+                    res['key echo'].append(frames[0]['latency'])
+            start = time.perf_counter()
+            frames = driver.press('\n')
+            if frames:
+                res[step + ' 1st frame'].append(frames[0]['latency'])
+            driver.wait_for(marker)
+            res[step + ' ready'].append(time.perf_counter() - start)
+            res[step + ' bytes'].append(sum(f['bytes'] for f in driver.frames[nb_frames:]))
+        res['frame'].extend(f['time'] for f in driver.frames)
+    finally:
+        driver.stop()
+
+
+
+## ------------------------------------------------------------------------
+## MAIN
+
+def pct(values, p):
+    # NB: nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * p) - 1)] * 1000
+
+
+def main(nb_books=NB_BOOKS, nb_sessions=NB_SESSIONS):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # NB: the Calibre backend opens `~/Calibre Library/metadata.db` when first used, i.e. by the 1st search
+        os.environ['HOME'] = tmp_dir
+        os.environ['XDG_CACHE_HOME'] = os.path.join(tmp_dir, '.cache')
+        os.makedirs(os.path.join(tmp_dir, 'Calibre Library'))
+        generate(os.path.join(tmp_dir, 'Calibre Library', 'metadata.db'), nb_books)
+
+        import dynix_ng as dynix
+        import dynix_ng.ui.session
+        from dynix_ng.ui.headless import HeadlessDriver
+
+        steps = [step for (step, _, _) in FLOW]
+        res = {'frame': [], 'key echo': []}
+        for step in steps:
+            for k in ('1st frame', 'ready', 'bytes'):
+                res[step + ' ' + k] = []
+
+        for i in range(nb_sessions):
+            # NB: searches from scratch, w/o counts cached by previous sessions
+            dynix_ng.ui.session.SEARCH_CACHE.clear()
+            driver = HeadlessDriver(dynix.session_start, dynix.session_update, dynix.session_process_input,
+                                    dynix.session_end)
+            run_session(driver, QUERIES[i % len(QUERIES)], res)
+
+        print('%d books, %d sessions, latencies in ms' % (nb_books, nb_sessions))
+        print('  %-22s %7s %9s %9s %9s' % ('', 'nb', 'p50', 'p95', 'p99'))
+        for k in ['frame', 'key echo'] + [s + ' ' + k for s in steps for k in ('1st frame', 'ready')]:
+            values = res[k]
+            print('  %-22s %7d %9.3f %9.3f %9.3f' % (k, len(values), pct(values, 0.5), pct(values, 0.95), pct(values, 0.99)))
+        print('  bytes per step: ' + ', '.join('%s=%d' % (s, sum(res[s + ' bytes']) / len(res[s + ' bytes']))
+                                              for s in steps))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
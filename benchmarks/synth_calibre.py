@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+## Synthetic Calibre library, for benchmarks.
+##
+##   $ python3 benchmarks/synth_calibre.py PATH NB_BOOKS [--authors N] [--tags N] [--series N] [--publishers N]
+##                                                       [--vocabulary N] [--seed N]
+##
+## Writes a `metadata.db` w/ Calibre's schema, where names, title words and tags follow Zipf-like
+## distributions (a few prolific authors and very common words, a long tail of rare ones).
+## The fixed lists below are the most frequent values, so that queries such as `MARK TWAIN` or `GONE WIND`
+## always have matches.
+
+import os
+import uuid
+import random
+import argparse
+import itertools
+
+import sqlite3
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: tables and indices of Calibre's `metadata.db`
+## triggers and views are left out as they call SQL functions only Calibre registers (`title_sort()`,
+## `uuid4()`...), as are custom columns
+SCHEMA = '''
+CREATE TABLE books (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL DEFAULT 'Unknown' COLLATE NOCASE,
+                    sort TEXT COLLATE NOCASE,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    pubdate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    series_index REAL NOT NULL DEFAULT 1.0,
+                    author_sort TEXT COLLATE NOCASE,
+                    isbn TEXT DEFAULT "" COLLATE NOCASE,
+                    lccn TEXT DEFAULT "" COLLATE NOCASE,
+                    path TEXT NOT NULL DEFAULT "",
+                    flags INTEGER NOT NULL DEFAULT 1,
+                    uuid TEXT,
+                    has_cover BOOL DEFAULT 0,
+                    last_modified TIMESTAMP NOT NULL DEFAULT "2000-01-01 00:00:00+00:00");
+CREATE TABLE authors (id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT COLLATE NOCASE,
+                      link TEXT NOT NULL DEFAULT "", UNIQUE(name));
+CREATE TABLE publishers (id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT COLLATE NOCASE,
+                         UNIQUE(name));
+CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, UNIQUE (name));
+CREATE TABLE series (id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT COLLATE NOCASE,
+                     UNIQUE (name));
+CREATE TABLE ratings (id INTEGER PRIMARY KEY, rating INTEGER CHECK(rating > -1 AND rating < 11), UNIQUE (rating));
+CREATE TABLE languages (id INTEGER PRIMARY KEY, lang_code TEXT NOT NULL COLLATE NOCASE, UNIQUE(lang_code));
+CREATE TABLE books_authors_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, author INTEGER NOT NULL,
+                                 UNIQUE(book, author));
+CREATE TABLE books_publishers_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, publisher INTEGER NOT NULL,
+                                    UNIQUE(book));
+CREATE TABLE books_tags_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, tag INTEGER NOT NULL,
+                              UNIQUE(book, tag));
+CREATE TABLE books_series_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, series INTEGER NOT NULL,
+                                UNIQUE(book));
+CREATE TABLE books_ratings_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, rating INTEGER NOT NULL,
+                                 UNIQUE(book, rating));
+CREATE TABLE books_languages_link (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, lang_code INTEGER NOT NULL,
+                                   item_order INTEGER NOT NULL DEFAULT 0, UNIQUE(book, lang_code));
+CREATE TABLE books_plugin_data (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, name TEXT NOT NULL,
+                                val TEXT NOT NULL, UNIQUE(book, name));
+CREATE TABLE comments (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, text TEXT NOT NULL COLLATE NOCASE,
+                       UNIQUE(book));
+CREATE TABLE identifiers (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, type TEXT NOT NULL DEFAULT "isbn" COLLATE NOCASE,
+                          val TEXT NOT NULL COLLATE NOCASE, UNIQUE(book, type));
+CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, format TEXT NOT NULL COLLATE NOCASE,
+                   uncompressed_size INTEGER NOT NULL, name TEXT NOT NULL, UNIQUE(book, format));
+CREATE TABLE conversion_options (id INTEGER PRIMARY KEY, format TEXT NOT NULL COLLATE NOCASE, book INTEGER,
+                                 data BLOB NOT NULL, UNIQUE(format, book));
+CREATE TABLE metadata_dirtied (id INTEGER PRIMARY KEY, book INTEGER NOT NULL, UNIQUE(book));
+CREATE TABLE feeds (id INTEGER PRIMARY KEY, title TEXT NOT NULL, script TEXT NOT NULL, UNIQUE(title));
+CREATE TABLE library_id (id INTEGER PRIMARY KEY, uuid TEXT NOT NULL, UNIQUE(uuid));
+CREATE TABLE preferences (id INTEGER PRIMARY KEY, key TEXT NOT NULL, val TEXT NOT NULL, UNIQUE(key));
+
+CREATE INDEX authors_idx ON books (author_sort COLLATE NOCASE);
+CREATE INDEX books_idx ON books (sort COLLATE NOCASE);
+CREATE INDEX books_authors_link_aidx ON books_authors_link (author);
+CREATE INDEX books_authors_link_bidx ON books_authors_link (book);
+CREATE INDEX books_publishers_link_aidx ON books_publishers_link (publisher);
+CREATE INDEX books_publishers_link_bidx ON books_publishers_link (book);
+CREATE INDEX books_tags_link_aidx ON books_tags_link (tag);
+CREATE INDEX books_tags_link_bidx ON books_tags_link (book);
+CREATE INDEX books_series_link_aidx ON books_series_link (series);
+CREATE INDEX books_series_link_bidx ON books_series_link (book);
+CREATE INDEX books_ratings_link_aidx ON books_ratings_link (rating);
+CREATE INDEX books_ratings_link_bidx ON books_ratings_link (book);
+CREATE INDEX books_languages_link_aidx ON books_languages_link (lang_code);
+CREATE INDEX books_languages_link_bidx ON books_languages_link (book);
+CREATE INDEX comments_idx ON comments (book);
+CREATE INDEX conversion_options_idx_a ON conversion_options (format COLLATE NOCASE);
+CREATE INDEX conversion_options_idx_b ON conversion_options (book);
+CREATE INDEX data_idx ON data (book);
+CREATE INDEX formats_idx ON data (format);
+CREATE INDEX languages_idx ON languages (lang_code COLLATE NOCASE);
+CREATE INDEX publishers_idx ON publishers (name COLLATE NOCASE);
+CREATE INDEX series_idx ON series (name COLLATE NOCASE);
+CREATE INDEX tags_idx ON tags (name COLLATE NOCASE);
+'''
+
+## NB: most frequent values, in decreasing frequency
+WORDS = ['the', 'of', 'and', 'a', 'in', 'to', 'war', 'peace', 'gone', 'wind', 'huckleberry', 'finn',
+         'computer', 'computing', 'computation', 'compute', 'cat', 'cats', "cat's", 'hat', 'state',
+         'states', 'time', 'love', 'house', 'night', 'day', 'sea', 'star', 'stars', 'moon', 'garden',
+         'king', 'queen', 'history', 'science', 'world', 'man', 'woman', 'city', 'river', 'road']
+
+FIRST_NAMES = ['Mark', 'Charles', 'Jane', 'Leo', 'Margaret', 'Ann', 'Isaac', 'Ursula', 'John', 'Mary']
+LAST_NAMES = ['Twain', 'Dickens', 'Austen', 'Tolstoy', 'Mitchell', "O'Brien", 'Asimov', 'Le Guin',
+              'Smith', 'Shelley']
+
+PUBLISHERS = ['Penguin', 'Harper & Row', 'Computing Press', 'Gallimard', 'Random House']
+TAGS = ['Fiction', 'History', 'Computers', 'Cats', 'Science Fiction', 'Romance', 'Poetry']
+SERIES = ['Foundation', 'Earthsea', 'Cat Tales', 'Discworld']
+
+## NB: for the long tail of made up words and names
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ber', 'dan', 'gor', 'hil', 'jus', 'kel',
+             'mor', 'nim', 'par', 'quin', 'ros', 'tel', 'val', 'wen', 'xan', 'yor', 'zet']
+
+LANGUAGES = [('eng', 0.85), ('fra', 0.05), ('deu', 0.04), ('spa', 0.03), ('ita', 0.02), ('rus', 0.01)]
+FORMATS = ['EPUB', 'MOBI', 'PDF', 'AZW3']
+
+ARTICLES = ('the', 'a', 'an')
+
+## NB: exponent of the rank-frequency distributions, ~1 for words in natural language
+ZIPF_S = 1.0
+
+VOCABULARY_SIZE = 5000
+
+## NB: rows get inserted by batches of books, to bound memory usage on big libraries
+BATCH_SIZE = 10000
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def zipf_cum_weights(n, s=ZIPF_S):
+    return list(itertools.accumulate(1 / r ** s for r in range(1, n + 1)))
+
+
+def made_up_words(rnd, nb, excluded=()):
+    res = []
+    seen = set(excluded)
+    while len(res) < nb:
+        w = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+        if w not in seen:
+            seen.add(w)
+            res.append(w)
+    return res
+
+
+def title_sort(title):
+    # NB: like Calibre's default, leading articles get moved to the end
+    words = title.split(' ', 1)
+    if len(words) == 2 and words[0].lower() in ARTICLES:
+        return words[1] + ', ' + words[0]
+    return title
+
+
+def author_sort(name):
+    words = name.split(' ')
+    if len(words) == 1:
+        return name
+    return words[-1] + ', ' + ' '.join(words[:-1])
+
+
+def isbn13(rnd):
+    digits = [9, 7, 8] + [rnd.randint(0, 9) for _ in range(9)]
+    check = (10 - sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return ''.join(str(d) for d in digits + [check])
+
+
+def timestamp(rnd, year_min, year_max):
+    return '%04d-%02d-%02d %02d:%02d:%02d+00:00' % (rnd.randint(year_min, year_max), rnd.randint(1, 12),
+                                                   rnd.randint(1, 28), rnd.randint(0, 23),
+                                                   rnd.randint(0, 59), rnd.randint(0, 59))
+
+
+def pubdate(rnd):
+    r = rnd.random()
+    if r < 0.05:
+        # NB: Calibre's "undefined" date
+        return '0101-01-01 00:00:00+00:00'
+    elif r < 0.25:
+        return timestamp(rnd, 1800, 1949)
+    return timestamp(rnd, 1950, 2024)
+
+
+def default_sizes(nb_books):
+    # NB: ratios of a typical personal library, most authors having a single book
+    return {
+        'nb_authors': max(len(FIRST_NAMES) * len(LAST_NAMES), nb_books // 3),
+        'nb_tags': max(len(TAGS), min(2000, nb_books // 50)),
+        'nb_series': max(len(SERIES), nb_books // 20),
+        'nb_publishers': max(len(PUBLISHERS), nb_books // 40),
+    }
+
+
+## ------------------------------------------------------------------------
+## VALUES
+
+def make_vocabulary(rnd, vocabulary_size):
+    return WORDS + made_up_words(rnd, max(0, vocabulary_size - len(WORDS)), WORDS)
+
+
+def make_authors(rnd, nb):
+    names = [f + ' ' + l for f in FIRST_NAMES for l in LAST_NAMES]
+    # NB: well-known ones first, so that they are the most prolific
+    rnd.shuffle(names)
+    seen = set(names)
+    last_names = [w.capitalize() for w in made_up_words(rnd, max(10, nb // 5))]
+    while len(names) < nb:
+        name = rnd.choice(FIRST_NAMES) + ' ' + rnd.choice(last_names)
+        if rnd.random() < 0.3:
+            name = rnd.choice(FIRST_NAMES) + ' ' + rnd.choice('ABCDEFGHJKLMNPRSTW') + '. ' + name.split(' ', 1)[1]
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names[:nb]
+
+
+def make_names(rnd, head, nb, nb_words, prefixes=()):
+    names = list(head)
+    seen = set(names)
+    while len(names) < nb:
+        name = ' '.join(w.capitalize() for w in made_up_words(rnd, rnd.randint(1, nb_words)))
+        if prefixes and rnd.random() < 0.5:
+            name = rnd.choice(prefixes) + ' / ' + name
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names[:nb]
+
+
+## ------------------------------------------------------------------------
+## GENERATOR
+
+def generate(path, nb_books, seed=1, nb_authors=None, nb_tags=None, nb_series=None, nb_publishers=None,
+             vocabulary_size=VOCABULARY_SIZE):
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed)
+
+    sizes = default_sizes(nb_books)
+    nb_authors = nb_authors or sizes['nb_authors']
+    nb_tags = nb_tags or sizes['nb_tags']
+    nb_series = nb_series or sizes['nb_series']
+    nb_publishers = nb_publishers or sizes['nb_publishers']
+
+    vocabulary = make_vocabulary(rnd, vocabulary_size)
+    authors = make_authors(rnd, nb_authors)
+    tags = make_names(rnd, TAGS, nb_tags, 2, prefixes=TAGS)
+    series = make_names(rnd, SERIES, nb_series, 3)
+    publishers = make_names(rnd, PUBLISHERS, nb_publishers, 2)
+
+    cnnx = sqlite3.connect(path)
+    cnnx.executescript(SCHEMA)
+
+    cnnx.executemany('INSERT INTO authors (id, name, sort) VALUES (?, ?, ?)',
+                     [(i, n, author_sort(n)) for i, n in enumerate(authors, start=1)])
+    cnnx.executemany('INSERT INTO publishers (id, name, sort) VALUES (?, ?, ?)',
+                     [(i, n, n) for i, n in enumerate(publishers, start=1)])
+    cnnx.executemany('INSERT INTO tags (id, name) VALUES (?, ?)',
+                     [(i, n) for i, n in enumerate(tags, start=1)])
+    cnnx.executemany('INSERT INTO series (id, name, sort) VALUES (?, ?, ?)',
+                     [(i, n, title_sort(n)) for i, n in enumerate(series, start=1)])
+    cnnx.executemany('INSERT INTO ratings (id, rating) VALUES (?, ?)',
+                     [(i, r) for i, r in enumerate(range(0, 11, 2), start=1)])
+    cnnx.executemany('INSERT INTO languages (id, lang_code) VALUES (?, ?)',
+                     [(i, l) for i, (l, _) in enumerate(LANGUAGES, start=1)])
+    cnnx.execute('INSERT INTO library_id (uuid) VALUES (?)', (str(uuid.UUID(int=rnd.getrandbits(128), version=4)),))
+
+    word_weights = zipf_cum_weights(len(vocabulary))
+    author_ids = range(1, len(authors) + 1)
+    author_weights = zipf_cum_weights(len(authors))
+    tag_ids = range(1, len(tags) + 1)
+    tag_weights = zipf_cum_weights(len(tags))
+    series_ids = range(1, len(series) + 1)
+    series_weights = zipf_cum_weights(len(series))
+    publisher_ids = range(1, len(publishers) + 1)
+    publisher_weights = zipf_cum_weights(len(publishers))
+    language_ids = range(1, len(LANGUAGES) + 1)
+    language_weights = list(itertools.accumulate(w for (_, w) in LANGUAGES))
+    series_counts = {}
+
+    for batch_start in range(1, nb_books + 1, BATCH_SIZE):
+        rows = {k: [] for k in ('books', 'authors', 'publishers', 'tags', 'series', 'ratings', 'languages',
+                                'comments', 'identifiers', 'data')}
+        for b in range(batch_start, min(nb_books, batch_start + BATCH_SIZE - 1) + 1):
+            nb_words = rnd.choices([1, 2, 3, 4, 5, 6, 8], cum_weights=[10, 30, 55, 75, 88, 96, 100])[0]
+            title = ' '.join(rnd.choices(vocabulary, cum_weights=word_weights, k=nb_words)).title()
+
+            # NB: w/o duplicates, link order being Calibre's author order
+            book_author_ids = list(dict.fromkeys(
+                rnd.choices(author_ids, cum_weights=author_weights,
+                            k=rnd.choices([1, 2, 3], cum_weights=[85, 97, 100])[0])))
+            for a in book_author_ids:
+                rows['authors'].append((b, a))
+
+            series_index = 1.0
+            if rnd.random() < 0.2:
+                s = rnd.choices(series_ids, cum_weights=series_weights)[0]
+                series_counts[s] = series_counts.get(s, 0) + 1
+                series_index = float(series_counts[s])
+                rows['series'].append((b, s))
+            if rnd.random() < 0.8:
+                rows['publishers'].append((b, rnd.choices(publisher_ids, cum_weights=publisher_weights)[0]))
+            for t in set(rnd.choices(tag_ids, cum_weights=tag_weights, k=rnd.randint(0, 5))):
+                rows['tags'].append((b, t))
+            if rnd.random() < 0.3:
+                rows['ratings'].append((b, rnd.randint(2, 6)))
+            rows['languages'].append((b, rnd.choices(language_ids, cum_weights=language_weights)[0]))
+
+            if rnd.random() < 0.6:
+                text = ' '.join(rnd.choices(vocabulary, cum_weights=word_weights, k=rnd.randint(8, 80)))
+                rows['comments'].append((b, '<p>' + text.capitalize() + '.</p>'))
+            if rnd.random() < 0.7:
+                rows['identifiers'].append((b, 'isbn', isbn13(rnd)))
+            if rnd.random() < 0.3:
+                rows['identifiers'].append((b, 'amazon', 'B0' + ''.join(rnd.choices('0123456789ABCDEFGHJKLMNPQRSTUVWXYZ', k=8))))
+            if rnd.random() < 0.2:
+                rows['identifiers'].append((b, 'goodreads', str(rnd.randint(1, 60000000))))
+
+            book_authors = ' & '.join(authors[a - 1] for a in book_author_ids)
+            file_name = (title[:42] + ' - ' + authors[book_author_ids[0] - 1])[:84]
+            for fmt in rnd.sample(FORMATS, rnd.choices([1, 2, 3], cum_weights=[60, 90, 100])[0]):
+                rows['data'].append((b, fmt, int(rnd.lognormvariate(13, 1)), file_name))
+
+            added = timestamp(rnd, 2010, 2023)
+            rows['books'].append((
+                b, title, title_sort(title), added, pubdate(rnd), series_index,
+                ' & '.join(author_sort(authors[a - 1]) for a in book_author_ids),
+                book_authors[:42] + '/' + title[:42] + ' (%d)' % b,
+                str(uuid.UUID(int=rnd.getrandbits(128), version=4)),
+                rnd.random() < 0.9,
+                # NB: some books got edited after being added
+                added if rnd.random() < 0.7 else timestamp(rnd, 2024, 2024),
+            ))
+
+        cnnx.executemany('INSERT INTO books (id, title, sort, timestamp, pubdate, series_index, author_sort, path,'
+                         ' uuid, has_cover, last_modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows['books'])
+        cnnx.executemany('INSERT INTO books_authors_link (book, author) VALUES (?, ?)', rows['authors'])
+        cnnx.executemany('INSERT INTO books_publishers_link (book, publisher) VALUES (?, ?)', rows['publishers'])
+        cnnx.executemany('INSERT INTO books_tags_link (book, tag) VALUES (?, ?)', rows['tags'])
+        cnnx.executemany('INSERT INTO books_series_link (book, series) VALUES (?, ?)', rows['series'])
+        cnnx.executemany('INSERT INTO books_ratings_link (book, rating) VALUES (?, ?)', rows['ratings'])
+        cnnx.executemany('INSERT INTO books_languages_link (book, lang_code) VALUES (?, ?)', rows['languages'])
+        cnnx.executemany('INSERT INTO comments (book, text) VALUES (?, ?)', rows['comments'])
+        cnnx.executemany('INSERT INTO identifiers (book, type, val) VALUES (?, ?, ?)', rows['identifiers'])
+        cnnx.executemany('INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)', rows['data'])
+
+    cnnx.commit()
+    cnnx.close()
+
+
+## ------------------------------------------------------------------------
+## SCRIPT
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic Calibre library.')
+    parser.add_argument('path')
+    parser.add_argument('nb_books', type=int)
+    parser.add_argument('--authors', type=int, dest='nb_authors')
+    parser.add_argument('--tags', type=int, dest='nb_tags')
+    parser.add_argument('--series', type=int, dest='nb_series')
+    parser.add_argument('--publishers', type=int, dest='nb_publishers')
+    parser.add_argument('--vocabulary', type=int, dest='vocabulary_size', default=VOCABULARY_SIZE)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(**vars(args))
@@ -8,6 +8,10 @@ import locale
 import time
 import datetime
 
+import argparse
+import signal
+import logging
+
 import curses
 from curses import wrapper
 
@@ -18,15 +22,19 @@ if module_path not in sys.path:
 
 from dynix_ng.ui.session import DynixSession, DynixSearch
 from dynix_ng.ui.screen import WelcomeScreen, SearchScreen, CounterScreen, SummaryScreen, ItemScreen
-from dynix_ng.ui.header import draw_modem_header, draw_dynix_header
+from dynix_ng.ui.render import Renderer
+from dynix_ng.ui.event_loop import EventLoop
 
 from dynix_ng.utils.curses.textpad import CustomTextbox
+from dynix_ng.utils.curses.terminal import CursesTerminal
 from dynix_ng.utils.curses.print import addstr_x_centered
 
-from dynix_ng.library.backend.calibre import CalibreDb
-from dynix_ng.library.backend.archive import ArchiveOrgApi
+from dynix_ng.library.backend.registry import BackendRegistry
+
+from dynix_ng.utils.xdg import user_cache_dir
 
 import dynix_ng.utils.query.recall as recall
+import dynix_ng.utils.profiling as profiling
 
 import dynix_ng.state.memory as global_state
 
@@ -39,10 +47,18 @@ import dynix_ng.state.memory as global_state
 
 
 
-# CONF: CURSES
+# CONF: LOGGING
+
+# NB: in the cache dir, as stderr is the curses screen
+LOG_FILE_NAME = 'dynix.log'
+
 
-HALF_DELAY = 5
-# How many tenths of a second are waited, from 1 to 255
+
+# CONF: TELNET SERVER
+
+# NB: only local clients by default, use `--host 0.0.0.0` to expose it on the network
+TELNET_HOST = '127.0.0.1'
+TELNET_PORT = 2323
 
 
 
@@ -94,6 +110,7 @@ SCREENS = {
     'pub_search_alpha': 'PUBLISHER Alphabetical Search',
     # 'polytek_db': 'Polytechnic Resources Database',
     'title_search_archive.org': 'TITLE Archive.Org search',
+    'title_search_federated': 'TITLE Library + Archive.Org search',
 
     'quit': 'Quit searching',
 }
@@ -111,6 +128,9 @@ SEARCH_SCREENS = [
 
     # Archive.Org
     'title_search_archive.org',
+
+    # Calibre + Archive.Org
+    'title_search_federated',
 ]
 
 
@@ -133,6 +153,7 @@ SCREEN_PROMPTS = {
     'title_search_alpha': SCREEN_PROMPT_SEARCH_TITLE,
     'title_search_keyword': SCREEN_PROMPT_SEARCH_TITLE,
     'title_search_archive.org': SCREEN_PROMPT_SEARCH_TITLE,
+    'title_search_federated': SCREEN_PROMPT_SEARCH_TITLE,
     'search_counter': SCREEN_PROMPT_COUNTER,
     'summary': SCREEN_PROMPT_COUNTER,
     'item_view': SCREEN_PROMPT_ITEM,
@@ -154,6 +175,24 @@ def get_input_length(screen_id):
 # DISPLAY_MODEM_HEADER = True
 DISPLAY_MODEM_HEADER = False
 
+# NB: in-memory token index for large libraries, requires numpy
+CALIBRE_BITMAP_INDEX = False
+
+# NB: max nb of words a truncated term (e.g. "COMPUT?") gets expanded to, the 1st ones alphabetically
+CALIBRE_MAX_EXPANSIONS = 256
+
+# NB: backends get created on first use, those get created in the background once the 1st screen is displayed
+WARM_UP_BACKENDS = ['calibre', 'archive.org']
+
+# NB: hidden commands, from any screen
+# profiling can also be turned on at startup w/ the DYNIX_PROFILE env var, and dumped w/ SIGUSR1
+COMMAND_PROFILING_TOGGLE = '%P'
+COMMAND_PROFILING_DUMP = '%D'
+
+# NB: only spans are per session, cProfile and tracemalloc are process-wide and dumps get written to the server's disk,
+# so by default these commands are only available from the local terminal, not over telnet
+REMOTE_PROFILING_COMMANDS = False
+
 
 
 # GLOBAL VARS
@@ -165,8 +204,25 @@ recall_query = []
 results = None
 
 # backends
-calibreBackend = CalibreDb()
-archiveOrgBackend = ArchiveOrgApi()
+# NB: modules get imported on first use too, e.g. `requests` is slow to import
+backends = BackendRegistry()
+
+def make_calibre_backend():
+    from dynix_ng.library.backend.calibre import CalibreDb
+    return CalibreDb(bitmap_index=CALIBRE_BITMAP_INDEX, max_expansions=CALIBRE_MAX_EXPANSIONS)
+
+def make_archive_org_backend():
+    from dynix_ng.library.backend.archive import ArchiveOrgApi
+    return ArchiveOrgApi()
+
+def make_federated_backend():
+    from dynix_ng.library.backend.federated import FederatedBackend
+    return FederatedBackend({'calibre': backends.get('calibre'),
+                             'archive.org': backends.get('archive.org')})
+
+backends.register('calibre', make_calibre_backend)
+backends.register('archive.org', make_archive_org_backend)
+backends.register('federated', make_federated_backend)
 
 
 
@@ -189,8 +245,9 @@ def screen_change(new_screen_id):
     global SCREEN_PROMPT_WELCOME, SCREEN_PROMPT_SEARCH_TITLE, SCREEN_PROMPT_COUNTER, SCREEN_PROMPT_ITEM
 
     session = global_state.session
+    session.error = None
 
-    global_state.screen_win.clear()
+    global_state.renderer.invalidate_screen()
 
     if not global_state.session.screen_id in static_screens.keys():
         del global_state.session.screen # free memory
@@ -199,7 +256,11 @@ def screen_change(new_screen_id):
     input_prompt = global_state.screen_prompt_list[session.screen_id]
     input_y = len(input_prompt) + 2 + 1
     input_len = get_input_length(new_screen_id)
-    global_state.inputwin = curses.newwin(1, input_len + 1, curses.LINES - 2, input_y)
+    global_state.inputwin = global_state.term.newwin(1, input_len + 1, global_state.term.lines - 2, input_y)
+    # NB: reused across ticks, as creating one re-sends the keypad mode to the terminal
+    global_state.input_box = CustomTextbox(global_state.inputwin)
+    # NB: only read from when the event loop says there are keys pending
+    global_state.inputwin.nodelay(True)
 
     if global_state.session.screen_id in static_screens.keys():
         global_state.session.screen = static_screens[global_state.session.screen_id]
@@ -225,7 +286,7 @@ def search_screen_to_search_type (screen_id):
     elif screen_id == 'pub_search_alpha':
         return 'publisher'
     elif screen_id in ['title_search_alpha', 'title_search_keyword',
-                       'title_search_archive.org']:
+                       'title_search_archive.org', 'title_search_federated']:
         return 'title'
     elif screen_id == 'subject_search':
         return 'subject'
@@ -239,25 +300,26 @@ def search_screen_to_search_type (screen_id):
         return 'bib'
 
 def search_screen_to_backend (screen_id):
-    global calibreBackend
     if screen_id == 'author_search_alpha':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'pub_search_alpha':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id in ['title_search_alpha', 'title_search_keyword']:
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'subject_search':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'word_search_general':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id in ['series_search_keyword', 'series_search_authority']:
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'universal_id_search':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'bib_search':
-        return calibreBackend
+        return backends.get('calibre')
     elif screen_id == 'title_search_archive.org':
-        return archiveOrgBackend
+        return backends.get('archive.org')
+    elif screen_id == 'title_search_federated':
+        return backends.get('federated')
 
 
 ## NB: deprecated
@@ -284,12 +346,33 @@ def search_screen_to_backend_fields (backend, screen_id):
 def handle_user_input():
     session = global_state.session
 
+    if not session.is_remote or REMOTE_PROFILING_COMMANDS:
+        if session.user_input.upper() == COMMAND_PROFILING_TOGGLE:
+            # NB: shows an overlay w/ the breakdown of the last search
+            profiling.toggle()
+            return
+        elif session.user_input.upper() == COMMAND_PROFILING_DUMP:
+            profiling.dump()
+            return
+
     if session.screen_id == 'welcome':
         if session.user_input in list(SCREENS.keys()):
             screen_change(session.user_input)
     elif session.screen_id == 'search_counter':
         if session.user_input.upper() == 'D': # Show all results
-            screen_change('summary')
+            # NB: actual transition happens once count is over, see `CounterScreen.update()`
+            session.screen.display_requested = True
+        elif session.user_input.upper() in ['SO', 'Q']: # Start Over / Quit current search
+            session.search.cancel()
+            screen_change('welcome')
+        elif session.user_input.upper() in ['P', 'B']: # Back to previous search level
+            session.search.cancel()
+            screen_change(session.search_screen_id)
+        elif session.user_input.upper() in ['F', '?']: # Forward / Help, not available at this level
+            pass
+        elif session.user_input: # Narrow the search w/ additional word(s)
+            session.search.add_terms(session.user_input)
+            screen_change('search_counter')
             # elif session.screen_id == 'title_search_keyword':
     elif session.screen_id in SEARCH_SCREENS:
         if session.user_input.upper() in ['SO', 'Q']: # Start Over / Quit current search
@@ -299,25 +382,37 @@ def handle_user_input():
         else:
             user_query = session.user_input
             search_type = search_screen_to_search_type(session.screen_id)
-            backend = search_screen_to_backend(session.screen_id)
-            session.search = DynixSearch(user_query, backend, search_type)
+            try:
+                backend = search_screen_to_backend(session.screen_id)
+            except Exception as e:
+                # NB: e.g. library not found, displayed by the search screen
+                session.error = e
+                return
+            session.search = DynixSearch(user_query, backend, search_type, session.term_matches,
+                                         on_progress=session.on_progress)
+            session.search_screen_id = session.screen_id
             # NB: systematic transition to search counter screen before search summary to mimick original behaviour
             screen_change('search_counter')
-            if session.search.results_total_count <= 30:
-                time.sleep(0.1)
-                screen_change('summary')
     elif session.screen_id == 'summary':
         if session.user_input.upper() in ['SO', 'Q']: # Start Over / Quit current search
             screen_change('welcome')
+        elif session.user_input.upper() in ['', 'F']: # Next page
+            session.search.next_page()
+            screen_change('summary')
+        elif session.user_input.upper() == 'P' and session.search.has_previous_page(): # Previous page
+            session.search.previous_page()
+            screen_change('summary')
         elif session.user_input.upper() in ['P', 'B']: # Previous page / Back to previous search level
             if session.search.results_total_count > 30:
                 screen_change('search_counter')
             else:
                 screen_change('title_search_keyword')
         elif session.user_input.isdigit():
-            session.item_id = int(session.user_input)
-            session.item = list(session.search.results.values())[session.item_id - 1]
-            screen_change('item_view')
+            item = session.search.item_record(int(session.user_input))
+            if item is not None:
+                session.item_id = int(session.user_input)
+                session.item = item
+                screen_change('item_view')
     elif session.screen_id == 'item_view':
         if session.user_input.upper() in ['SO', 'Q']: # Start Over / Quit current search
             screen_change('welcome')
@@ -326,12 +421,12 @@ def handle_user_input():
         elif session.user_input.upper() == 'PT': # Previous Title
             if session.item_id > 1:
                 session.item_id -= 1
-                session.item = list(session.search.results.values())[session.item_id - 1]
+                session.item = session.search.item_record(session.item_id)
                 screen_change('item_view')
         elif session.user_input.upper() == 'NT': # Next Title
             if session.item_id < session.search.results_total_count:
                 session.item_id += 1
-                session.item = list(session.search.results.values())[session.item_id - 1]
+                session.item = session.search.item_record(session.item_id)
                 screen_change('item_view')
     else:
         return "exit"
@@ -339,38 +434,36 @@ def handle_user_input():
 
 
 
-## SCRIPT
+## SESSION
 
-def main(stdscr):
-    # headers
+def session_start(term, on_progress=None, is_remote=False):
+    # NB: sets up the windows and state of a new terminal session into `global_state`
+    # `is_remote` for sessions of telnet clients
     global DISPLAY_MODEM_HEADER
     global LIBRARY_NAME, DISPLAY_SECONDS
 
     global SCREENS
     global SEARCH_SCREENS
 
-    win_list = []
-
-    curses.halfdelay(HALF_DELAY)
-    curses.noecho() # no input repeat
+    global_state.term = term
 
     y = 0
 
+    modem_header_win = None
     if DISPLAY_MODEM_HEADER:
-        modem_header_win = curses.newwin(1, curses.COLS, y, 0)
-        win_list.append(modem_header_win)
+        modem_header_win = term.newwin(1, term.cols, y, 0)
         y += 1
 
-    header_win = curses.newwin(2, curses.COLS, y, 0)
-    win_list.append(header_win)
+    header_win = term.newwin(2, term.cols, y, 0)
     y += 2
 
-    global_state.screen_win = curses.newwin(curses.LINES - y, curses.COLS, y, 0)
+    global_state.screen_win = term.newwin(term.lines - y, term.cols, y, 0)
 
-    global_state.session = DynixSession()
+    global_state.session = DynixSession(on_progress=on_progress, is_remote=is_remote)
     global_state.screen_list = SCREENS
     global_state.welcome_message = WELCOME_MESSAGE
     global_state.screen_prompt_list = SCREEN_PROMPTS
+    global_state.renderer = Renderer(header_win, LIBRARY_NAME, DISPLAY_SECONDS, modem_header_win)
 
     screen_change('welcome')
     # screen_welcome = WelcomeScreen(global_state.session.screen_id)
@@ -378,40 +471,119 @@ def main(stdscr):
     # global_state.session.screen = screen_welcome
 
 
-    running = True
-    while running:
-
-        stdscr.clear()
+def session_update():
+    # NB: screens may switch on their own, e.g. once a background search is over
+    next_screen_id = global_state.session.screen.update()
+    if next_screen_id:
+        screen_change(next_screen_id)
 
-        if DISPLAY_MODEM_HEADER:
-            draw_modem_header(modem_header_win)
-        draw_dynix_header(header_win, LIBRARY_NAME, DISPLAY_SECONDS)
+    # NB: only what changed gets repainted, usually just the clock
+    global_state.renderer.render()
 
-        global_state.session.screen.draw()
 
-        # NB: breaks after `HALF_DELAY`
+def session_process_input():
+    # NB: consumes pending keys, returns False once the session is over
+    while True:
+        # NB: returns once <Return> is pressed or no more keys are pending
         user_input = global_state.session.screen.get_input()
 
-        for w in win_list:
-            w.refresh()
-        global_state.session.screen.refresh()
-
-        if user_input == curses.ERR: # halfdelay
-            continue
+        if user_input == curses.ERR:
+            return True
 
         # NB: curses box has a tendency to add a trailing space when pressing <Return>
         global_state.session.user_input = user_input.strip()
 
         next_action = handle_user_input()
         if next_action == "exit":
-            running = False
+            return False
+
+        # NB: input may have changed state w/o changing screen
+        global_state.renderer.invalidate_screen()
+
+        # NB: keys typed ahead are for the next screen
+        session_update()
+
+
+def session_end():
+    if global_state.session.search is not None:
+        global_state.session.search.cancel()
+
+
+
+## SCRIPT
+
+def main(stdscr):
+    curses.noecho() # no input repeat
+
+    event_loop = EventLoop()
+    global_state.event_loop = event_loop
+
+    session_start(CursesTerminal(), on_progress=event_loop.notify)
+    session_update()
 
+    if hasattr(signal, 'SIGUSR1'):
+        # NB: only flags the dump, done from the loop below
+        def on_sigusr1(signum, frame):
+            profiling.request_dump()
+            event_loop.notify()
+        signal.signal(signal.SIGUSR1, on_sigusr1)
 
-## START
+    # NB: after the 1st paint, so as not to delay it
+    backends.warm_up(WARM_UP_BACKENDS)
+
+    running = True
+    while running:
+        # NB: sleeps until a key is pressed, a background search progresses or the clock changes
+        if event_loop.wait(global_state.renderer.next_frame_in()):
+            running = session_process_input()
+        profiling.dump_if_requested()
+        if running:
+            session_update()
+
+    session_end()
+    event_loop.close()
+
+
+def serve(host, port):
+    import asyncio
+    from dynix_ng.ui.server import DynixTelnetServer
+
+    backends.warm_up(WARM_UP_BACKENDS)
+    server = DynixTelnetServer(session_start, session_update, session_process_input, session_end,
+                               host=host, port=port)
+
+    async def run():
+        if hasattr(signal, 'SIGUSR1'):
+            # NB: called from the loop rather than from the signal handler, see `profiling.request_dump()`
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(signal.SIGUSR1, lambda: loop.run_in_executor(None, profiling.dump))
+        await server.serve_forever()
+
+    asyncio.run(run())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Dynix OPAC')
+    parser.add_argument('--telnet', metavar='PORT', type=int, nargs='?', const=TELNET_PORT,
+                        help='serve the OPAC over telnet instead of running it in this terminal'
+                        + ' (default port: ' + str(TELNET_PORT) + ')')
+    parser.add_argument('--host', default=TELNET_HOST, help='address to listen on, w/ --telnet'
+                        + ' (default: ' + TELNET_HOST + ', only local clients)')
+    return parser.parse_args()
+
+
+
+## START
 
 if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(filename=os.path.join(user_cache_dir(), LOG_FILE_NAME), level=logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     try:
-        wrapper(main)
-        print('got: "' + global_state.session.user_input +'"')
+        if args.telnet is not None:
+            serve(args.host, args.telnet)
+        else:
+            wrapper(main)
+            print('got: "' + global_state.session.user_input +'"')
     except KeyboardInterrupt:
         print('bye!')
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import os
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import json
 from pprint import pprint
 
+from dynix_ng.utils.cache import SqliteCache
+import dynix_ng.utils.query.recall as recall
+import dynix_ng.utils.profiling as profiling
+from dynix_ng.utils.xdg import user_cache_dir
+
 
 ## ------------------------------------------------------------------------
 ## CONSTS
@@ -14,6 +24,57 @@ from pprint import pprint
 BACKEND_TYPE = 'lucene'
 
 
+## NB: keep-alive connections kept around, per host
+HTTP_POOL_SIZE = 4
+
+## NB: (connect, read), in seconds
+HTTP_TIMEOUT = (3.05, 15)
+
+## NB: retries on connection errors and on 429/5xx, w/ exponential backoff (0.5s, 1s, 2s...)
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+## NB: responses get reused for `CACHE_TTL` seconds, then served stale for `CACHE_STALE_TTL` more
+## while being refetched in the background
+CACHE_TTL = 24 * 3600
+CACHE_STALE_TTL = 7 * 24 * 3600
+CACHE_MAX_BYTES = 64 * 2**20
+
+REVALIDATE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dynix-archive-revalidate')
+
+## NB: min accepted by the scrape API is 100
+SCRAPE_PAGE_SIZE = 100
+
+## NB: fetches the next page of a stream while the current one gets consumed
+SCRAPE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dynix-archive-scrape')
+
+
+## ------------------------------------------------------------------------
+## PRIVATE HELPERS - HTTP
+
+def make_http_session(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES,
+                      backoff_factor=HTTP_BACKOFF_FACTOR):
+    retry = Retry(total=max_retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=HTTP_RETRY_STATUSES,
+                  allowed_methods=frozenset(['GET']),
+                  # NB: archive.org sends it when rate-limiting
+                  respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip'})
+    return session
+
+
+def default_cache_path():
+    return os.path.join(user_cache_dir('archive.org'), 'responses.db')
+
+
 ## ------------------------------------------------------------------------
 ## PRIVATE HELPERS - API - SEARCH
 
@@ -25,11 +86,13 @@ DEFAULT_RETURNED_FIELDS = ['identifier', 'title', 'mediatype', 'collection']
 def urlencode_basic(s):
     return s.translate(str.maketrans({' ': '+', ':': '%3A'}))
 
-def search_raw(q, nb_items=15, returned_fields=DEFAULT_RETURNED_FIELDS):
+def search_raw(q, nb_items=15, returned_fields=DEFAULT_RETURNED_FIELDS, page=1,
+               http=None, url_prefix=URL_PREFIX, timeout=HTTP_TIMEOUT):
     payload = {
         'q': urlencode_basic(q),
         'fl[]': returned_fields,
         'rows': nb_items,
+        'page': page,
         'output': 'json',
     }
 
@@ -44,9 +107,38 @@ def search_raw(q, nb_items=15, returned_fields=DEFAULT_RETURNED_FIELDS):
 
     # NB: need to use ES old school URL encoding, so can't use requests' params option
     # r = requests.get(URL_PREFIX, params=payload)
-    r = requests.get(URL_PREFIX, params=urlsuffix)
+    if http is None:
+        http = requests
+    with profiling.span('archive.search_raw'):
+        r = http.get(url_prefix, params=urlsuffix, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
 
-    return r.json()
+## ------------------------------------------------------------------------
+## PRIVATE HELPERS - API - SCRAPE
+
+## https://archive.org/help/aboutsearch.htm
+
+SCRAPE_URL_PREFIX = 'https://archive.org/services/search/v1/scrape'
+
+def scrape_raw(q, returned_fields=DEFAULT_RETURNED_FIELDS, nb_items=SCRAPE_PAGE_SIZE, cursor=None,
+               http=None, url_prefix=SCRAPE_URL_PREFIX, timeout=HTTP_TIMEOUT):
+    payload = {
+        'q': q,
+        'fields': ','.join(f for f in returned_fields if f),
+        'count': nb_items,
+    }
+    # NB: no cursor for 1st page, response has none for last one
+    if cursor is not None:
+        payload['cursor'] = cursor
+
+    if http is None:
+        http = requests
+    with profiling.span('archive.scrape_raw'):
+        r = http.get(url_prefix, params=payload, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
 
 
 ## ------------------------------------------------------------------------
@@ -61,12 +153,103 @@ class ArchiveOrgApi():
 
     BACKEND_TYPE = BACKEND_TYPE
 
+    SUPPORTS_ITEM_IDS = False
+    SUPPORTS_KEYSET_PAGINATION = False
+    SUPPORTS_STREAMING = True
+    SUPPORTS_PROGRESS = False
+    SUPPORTS_BACKEND_STATS = False
+
+    ITEM_ID_TYPE = str
+
 
     # -------------------
     # LIFECYCLE
 
-    def __init__(self, db_path=BACKEND_TYPE):
+    def __init__(self, db_path=BACKEND_TYPE, url_prefix=URL_PREFIX, scrape_url_prefix=SCRAPE_URL_PREFIX,
+                 pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT,
+                 max_retries=HTTP_MAX_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR,
+                 cache=True, cache_path=None, cache_ttl=CACHE_TTL, cache_stale_ttl=CACHE_STALE_TTL,
+                 cache_max_bytes=CACHE_MAX_BYTES):
         self.db_path = db_path
+        self.url_prefix = url_prefix
+        self.scrape_url_prefix = scrape_url_prefix
+        self.timeout = timeout
+        # NB: shared by the UI, search and prefetch threads, which urllib3's pool is safe for
+        self.http = make_http_session(pool_size, max_retries, backoff_factor)
+
+        self.cache = None
+        if cache:
+            self.cache = SqliteCache(cache_path or default_cache_path(), ttl=cache_ttl,
+                                     stale_ttl=cache_stale_ttl, max_bytes=cache_max_bytes)
+        self.revalidating = set()
+        self.revalidating_lock = threading.Lock()
+
+    def close(self):
+        self.http.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def search_raw_uncached(self, q, **kwargs):
+        return search_raw(q, http=self.http, url_prefix=self.url_prefix, timeout=self.timeout,
+                          **kwargs)
+
+    def cache_key(self, q, nb_items=15, returned_fields=DEFAULT_RETURNED_FIELDS, page=1):
+        return json.dumps([self.url_prefix, ' '.join(q.split()), nb_items, page,
+                           sorted(returned_fields)])
+
+    def search_raw(self, q, **kwargs):
+        if self.cache is None:
+            return self.search_raw_uncached(q, **kwargs)
+
+        key = self.cache_key(q, **kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            (res, is_stale) = cached
+            if is_stale:
+                self.revalidate(key, q, kwargs)
+            return res
+
+        res = self.search_raw_uncached(q, **kwargs)
+        self.cache.put(key, res)
+        return res
+
+    def revalidate(self, key, q, kwargs):
+        with self.revalidating_lock:
+            if key in self.revalidating:
+                return
+            self.revalidating.add(key)
+
+        def refetch():
+            try:
+                self.cache.put(key, self.search_raw_uncached(q, **kwargs))
+            except requests.RequestException:
+                # NB: stale entry stays around until it expires
+                pass
+            finally:
+                with self.revalidating_lock:
+                    self.revalidating.discard(key)
+
+        REVALIDATE_EXECUTOR.submit(refetch)
+
+    def refresh(self):
+        return False
+
+    def data_version(self):
+        # NB: unknown, responses expire instead (see `cache_ttl`)
+        return None
+
+    def interrupt(self, thread_id=None):
+        # NB: requests can't be aborted, their result just gets ignored
+        pass
+
+    def fulltext_index_covers(self, columns):
+        return False
+
+    def token_index_covers(self, columns):
+        return False
+
+    def expansion_is_capped(self, columns, term):
+        return False
 
 
     # -------------------
@@ -81,8 +264,8 @@ class ArchiveOrgApi():
         'subjects': 'subject',
         'series': 'collection',
 
-        'ISBN': 'ISBN',
-        'LCCN': 'LCCN',
+        'ISBN': 'isbn',
+        'LCCN': 'lccn',
 
         'item_id': 'identifier',
     }
@@ -113,41 +296,121 @@ class ArchiveOrgApi():
     # -------------------
     # ITEMS
 
+    ## NB: fields needed to display a result in a list
+    SUMMARY_RETURNED_FIELDS = ['identifier', 'title', 'creator', 'publicdate', 'isbn']
+
+    ## NB: summary item field holding each searchable field
+    SUMMARY_ITEM_FIELDS = {
+        'title': 'name',
+        'creator': 'authors',
+        'isbn': 'ISBN',
+        'identifier': 'item_id',
+    }
+
+    def item_filter(self, columns, query_terms):
+        # NB: predicate over summary items, to narrow results already fetched w/o new requests
+        # None when some fields are not part of summaries
+        if not all(c in self.SUMMARY_ITEM_FIELDS for c in columns):
+            return None
+        matches = recall.recall_to_python(columns, query_terms)
+
+        def item_matches(item):
+            values = {}
+            for column in columns:
+                v = item.get(self.SUMMARY_ITEM_FIELDS[column])
+                if isinstance(v, list):
+                    v = ' & '.join(v)
+                values[column] = v
+            return matches(values)
+
+        return item_matches
+
     def item_list(self, fetch_mode='iter', fetch_format='v', where="",
-                  detailed=False):
+                  detailed=False, limit=None, offset=None, summary=False):
         if fetch_format == 'count':
-            res = search_raw(where,
+            res = self.search_raw(where,
                              # NB: 1 as 0 would fallback to default pagination value
                              nb_items=1,
                              # NB: similarly, [] would fallback to all standard fields
                              returned_fields=['identifier'])
             return res['response']['numFound']
         else:
-            raw_res = search_raw(where,
-                             nb_items=10,
-                             returned_fields=[''])
+            if limit is None:
+                limit = 10
+            offset = offset or 0
+            # NB: API paginates by pages of `rows` items
+            if offset % limit == 0:
+                (nb_items, page, skip) = (limit, offset // limit + 1, 0)
+            else:
+                (nb_items, page, skip) = (offset + limit, 1, offset)
+            returned_fields = ['']
+            if summary and not detailed:
+                returned_fields = self.SUMMARY_RETURNED_FIELDS
+            raw_res = self.search_raw(where,
+                             nb_items=nb_items,
+                             returned_fields=returned_fields,
+                             page=page)
             # raise Exception(json.dumps(raw_res))
             res = {}
-
-            field_2_std = {v: k for k, v in self.FIELD_CONVERTION.items()}
-
-            for raw_item in raw_res['response']['docs']:
-                item = {
-                    'authors': ['unknown'],
-                    'publishers': ['unknown'],
-                    'pub_date': '????',
-                    'name': 'unknown',
-                    'subjects': [],
-                    'series': [],
-                }
-                for k, v in raw_item.items():
-                    if k in field_2_std:
-                        item[field_2_std[k]] = v
-                # NB: when only 1 author/publisher, gets returned as a string instead of array
-                if isinstance(item['authors'], str):
-                    item['authors'] = [item['authors']]
-                if isinstance(item['publishers'], str):
-                    item['publishers'] = [item['publishers']]
+            for raw_item in raw_res['response']['docs'][skip:]:
+                item = self.normalize_item(raw_item)
                 res[item['item_id']] = item
             # raise Exception(json.dumps(res))
             return res
+
+    def scrape_raw(self, q, **kwargs):
+        return scrape_raw(q, http=self.http, url_prefix=self.scrape_url_prefix, timeout=self.timeout,
+                          **kwargs)
+
+    def item_stream(self, where="", detailed=False, summary=False, page_size=SCRAPE_PAGE_SIZE):
+        # NB: generator over all the results, walking the scrape API cursor
+        # the next page gets requested as soon as the current one arrives
+        returned_fields = list(self.FIELD_CONVERTION.values())
+        if summary and not detailed:
+            returned_fields = self.SUMMARY_RETURNED_FIELDS
+
+        def fetch(cursor):
+            return self.scrape_raw(where, returned_fields=returned_fields, nb_items=page_size,
+                                   cursor=cursor)
+
+        fetch = profiling.in_scope(fetch)
+        future = SCRAPE_EXECUTOR.submit(fetch, None)
+        try:
+            while future is not None:
+                raw_res = future.result()
+                cursor = raw_res.get('cursor')
+                future = None
+                if cursor is not None and raw_res.get('items'):
+                    future = SCRAPE_EXECUTOR.submit(fetch, cursor)
+                for raw_item in raw_res.get('items', []):
+                    yield self.normalize_item(raw_item)
+        finally:
+            # NB: stream abandoned (e.g. search restarted)
+            if future is not None:
+                future.cancel()
+
+    def item_record(self, item_id):
+        raw_res = self.search_raw('identifier:' + item_id, nb_items=1, returned_fields=[''])
+        for raw_item in raw_res['response']['docs']:
+            return self.normalize_item(raw_item)
+
+    def normalize_item(self, raw_item):
+        field_2_std = {v: k for k, v in self.FIELD_CONVERTION.items()}
+
+        item = {
+            'authors': ['unknown'],
+            'publishers': ['unknown'],
+            'pub_date': '????',
+            'name': 'unknown',
+            'subjects': [],
+            'series': [],
+        }
+        for k, v in raw_item.items():
+            if k in field_2_std:
+                item[field_2_std[k]] = v
+        # NB: when only 1 author/publisher, gets returned as a string instead of array
+        if isinstance(item['authors'], str):
+            item['authors'] = [item['authors']]
+        if isinstance(item['publishers'], str):
+            item['publishers'] = [item['publishers']]
+        return item
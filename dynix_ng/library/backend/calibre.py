@@ -1,19 +1,105 @@
 #!/usr/bin/env python3
 
+import os
 from os.path import expanduser
 import re
+import json
+import time
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 import sqlite3
 
 from pprint import pprint
 
+import dynix_ng.library.index.fts as fts
+from dynix_ng.library.index.fts import FtsIndex
+from dynix_ng.library.index.tokens import TokenIndex
+from dynix_ng.library.index.terms import MAX_EXPANSIONS
+from dynix_ng.utils.sqlite_pool import SqlitePool, POOL_SIZE
+import dynix_ng.utils.profiling as profiling
+import dynix_ng.utils.query.recall as recall
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+logger = logging.getLogger(__name__)
+
+## NB: sidecar indices get synced w/ `metadata.db` in the background, searches using REGEXP meanwhile
+INDEX_SYNC_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dynix-index-sync')
+
+## NB: one value per book for each searchable field, multi-valued ones being concatenated
+BOOK_SEARCH_FIELDS = {
+    'title': 'b.title',
+    'author': "(SELECT group_concat(a.name, ' & ') FROM books_authors_link AS b_a"
+    + " JOIN authors AS a ON b_a.author = a.id WHERE b_a.book = b.id)",
+    'publisher': "(SELECT group_concat(p.name, ' & ') FROM books_publishers_link AS b_p"
+    + " JOIN publishers AS p ON b_p.publisher = p.id WHERE b_p.book = b.id)",
+    'tag': "(SELECT group_concat(t.name, ' & ') FROM books_tags_link AS b_t"
+    + " JOIN tags AS t ON b_t.tag = t.id WHERE b_t.book = b.id)",
+    'series': "(SELECT group_concat(s.name, ' & ') FROM books_series_link AS b_s"
+    + " JOIN series AS s ON b_s.series = s.id WHERE b_s.book = b.id)",
+}
+
+## NB: tables other than `books` that `BOOK_SEARCH_FIELDS` are computed from
+BOOK_SEARCH_TABLES = ['books_authors_link', 'authors', 'books_publishers_link', 'publishers',
+                      'books_tags_link', 'tags', 'books_series_link', 'series']
+
+## NB: `books` augmented w/ the searchable fields, for REGEXP filters to apply to
+## SQLite flattens this subquery, so that only referenced fields get computed
+BOOKS_SEARCHABLE = '(SELECT b.*, ' \
+    + ', '.join(expr + ' AS ' + k for k, expr in BOOK_SEARCH_FIELDS.items() if k != 'title') \
+    + ' FROM books AS b)'
+
+
+def sql_json_list(value, from_where):
+    return '(SELECT json_group_array(v) FROM (SELECT ' + value + ' AS v FROM ' + from_where + '))'
+
+## NB: multi-valued fields, as JSON arrays
+## authors are ordered as in Calibre (link order), other ones alphabetically
+BOOK_DETAIL_FIELDS = {
+    'authors': sql_json_list('a.name', 'books_authors_link AS b_a JOIN authors AS a ON b_a.author = a.id'
+                             + ' WHERE b_a.book = b.id ORDER BY b_a.id'),
+    'authors_sorted': sql_json_list('a.sort', 'books_authors_link AS b_a JOIN authors AS a ON b_a.author = a.id'
+                                    + ' WHERE b_a.book = b.id ORDER BY b_a.id'),
+    'publishers': sql_json_list('p.name', 'books_publishers_link AS b_p JOIN publishers AS p ON b_p.publisher = p.id'
+                                + ' WHERE b_p.book = b.id ORDER BY p.name'),
+    'series': sql_json_list('s.name', 'books_series_link AS b_s JOIN series AS s ON b_s.series = s.id'
+                            + ' WHERE b_s.book = b.id ORDER BY b_s.id'),
+    'series_sorted': sql_json_list('s.sort', 'books_series_link AS b_s JOIN series AS s ON b_s.series = s.id'
+                                   + ' WHERE b_s.book = b.id ORDER BY b_s.id'),
+    'subjects': sql_json_list('t.name', 'books_tags_link AS b_t JOIN tags AS t ON b_t.tag = t.id'
+                              + ' WHERE b_t.book = b.id ORDER BY t.name'),
+}
+
+## NB: Calibre leaves `books.isbn` empty, ISBNs being stored as identifiers
+BOOK_ISBN_FIELD = "(SELECT i.val FROM identifiers AS i WHERE i.book = b.id AND i.type = 'isbn')"
+
+## NB: multi-valued fields needed to display a result in a list
+BOOK_SUMMARY_FIELDS = {k: BOOK_DETAIL_FIELDS[k] for k in ('authors',)}
+
+
 ## ------------------------------------------------------------------------
 ## UTILS
 
 
 def sqlite3_rx(expr, item):
+    # NB: called per row, so no span
+    if profiling.enabled:
+        return sqlite3_rx_profiled(expr, item)
+    if item is None:
+        return False
     return re.match(expr, item, re.IGNORECASE) is not None
 
+def sqlite3_rx_profiled(expr, item):
+    start = time.perf_counter()
+    res = item is not None and re.match(expr, item, re.IGNORECASE) is not None
+    profiling.record('calibre.regexp', time.perf_counter() - start)
+    return res
+
 def dict_from_sqlite3_row(row):
     return dict(zip(row.keys(), row))
 
@@ -29,30 +115,164 @@ class CalibreDb():
     BACKEND_TYPE = 'sql'
     BACKEND_DIALECT = 'sqlite3'
 
+    SUPPORTS_ITEM_IDS = True
+    SUPPORTS_KEYSET_PAGINATION = True
+    SUPPORTS_STREAMING = False
+    SUPPORTS_PROGRESS = False
+    SUPPORTS_BACKEND_STATS = False
+
+    ITEM_ID_TYPE = int
+
 
     # -------------------
     # LIFECYCLE
 
-    def __init__(self, db_path='~/Calibre Library/metadata.db'):
+    def __init__(self, db_path='~/Calibre Library/metadata.db', fts_index=True, token_index=True,
+                 bitmap_index=False, pool_size=POOL_SIZE, max_expansions=MAX_EXPANSIONS):
         self.db_path = expanduser(db_path)
-        self.cnnx = sqlite3.connect(self.db_path)
-        self.cnnx.row_factory = sqlite3.Row
-        self.cnnx.create_function("REGEXP", 2, sqlite3_rx)
-        self.cursor = self.cnnx.cursor()
-
-    def __fetch(self, q, fetch_mode='iter', fetch_format='k_v'):
-        iter = self.cursor.execute(q)
-        if fetch_mode == 'first':
-            # FIXME: this looks dirty, row object must have a value accessor
-            return list(dict(self.cursor.fetchone()).values())[0]
-        elif fetch_mode == 'all':
-            if fetch_format == 'k_v':
-                return [dict(row) for row in self.cursor.fetchall()]
+        # NB: read-only connections shared by sessions and background workers, queries run concurrently
+        self.pool = SqlitePool(self.db_path, size=pool_size, on_connect=self.__setup_connection)
+        # NB: serializes `refresh()`
+        self.lock = threading.RLock()
+        self.db_mtime = os.stat(self.db_path).st_mtime_ns
+
+        self.fts_index = None
+        self.token_index = None
+        # NB: background sync of the indices, see `refresh()`
+        self.index_sync_future = None
+        if fts_index and fts.is_available():
+            self.fts_index = self.__open_sidecar_index(FtsIndex(self.db_path, BOOK_SEARCH_FIELDS,
+                                                                source_tables=BOOK_SEARCH_TABLES))
+        # NB: takes precedence over FTS5 for the terms it supports
+        if token_index:
+            self.token_index = self.__open_sidecar_index(TokenIndex(self.db_path, BOOK_SEARCH_FIELDS,
+                                                                    source_tables=BOOK_SEARCH_TABLES,
+                                                                    max_expansions=max_expansions))
+
+        self.max_last_modified = self.__max_last_modified()
+
+        # NB: optional as it requires numpy and keeps the whole token index in memory
+        # built in the background too, see `refresh()`
+        self.bitmap_index = None
+        self.make_bitmap_index = None
+        # NB: `db_mtime` it got built for
+        self.bitmap_index_mtime = None
+        self.bitmap_index_future = None
+        if bitmap_index:
+            # NB: imports numpy
+            import dynix_ng.library.index.bitmap as bitmap
+            if bitmap.is_available():
+                self.make_bitmap_index = partial(bitmap.BitmapIndex, BOOK_SEARCH_FIELDS,
+                                                 max_expansions=max_expansions)
+
+        # NB: initial sync of the indices
+        self.refresh()
+
+    def __setup_connection(self, cnnx):
+        cnnx.row_factory = sqlite3.Row
+        cnnx.create_function("REGEXP", 2, sqlite3_rx, deterministic=True)
+        if self.fts_index is not None:
+            self.fts_index.attach(cnnx)
+        if self.token_index is not None:
+            self.token_index.attach(cnnx)
+
+    def __open_sidecar_index(self, index):
+        # NB: synced in the background (see `refresh()`), searches fallback to REGEXP meanwhile
+        # and for good when the cache dir is not writable
+        try:
+            index.create()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning('disabling %s index of %s: %s', index.SCHEMA_NAME, self.db_path, e)
+            return None
+        return index
+
+    def close(self):
+        self.pool.close()
+
+    def interrupt(self, thread_id=None):
+        # NB: aborts the queries running on behalf of `thread_id` (or all of them), from any thread
+        self.pool.interrupt(thread_id)
+
+    def __max_last_modified(self):
+        with self.pool.connection() as cnnx:
+            return cnnx.execute('SELECT MAX(last_modified) FROM books').fetchone()[0]
+
+    def data_version(self):
+        # NB: changes whenever `metadata.db` does, as of last `refresh()`
+        return (self.db_mtime, self.max_last_modified)
+
+    def refresh(self):
+        with self.lock:
+            return self.__refresh()
+
+    def __refresh(self):
+        # NB: returns True if `metadata.db` changed since last call
+        db_mtime = os.stat(self.db_path).st_mtime_ns
+        is_modified = db_mtime != self.db_mtime
+        self.db_mtime = db_mtime
+        if is_modified:
+            self.max_last_modified = self.__max_last_modified()
+
+        indices = [index for index in (self.fts_index, self.token_index) if index is not None]
+        if is_modified:
+            # NB: until synced, as they may lack the latest changes
+            for index in indices:
+                index.is_current = False
+        # NB: also retries the ones whose last sync failed
+        is_syncing = self.index_sync_future is not None and not self.index_sync_future.done()
+        if not is_syncing and any(not index.is_current for index in indices):
+            self.index_sync_future = INDEX_SYNC_EXECUTOR.submit(self.__sync_indices, indices)
+
+        is_building = self.bitmap_index_future is not None and not self.bitmap_index_future.done()
+        if self.make_bitmap_index is not None and not is_building and self.bitmap_index_mtime != db_mtime:
+            self.bitmap_index_future = INDEX_SYNC_EXECUTOR.submit(self.__build_bitmap_index, db_mtime)
+
+        return is_modified
+
+    def __sync_indices(self, indices):
+        for index in indices:
+            try:
+                index.sync()
+            except (sqlite3.Error, OSError) as e:
+                # NB: e.g. locked by a query still running on it, retried on next `refresh()`
+                logger.warning('failed to sync %s index of %s: %s', index.SCHEMA_NAME, self.db_path, e)
+
+    def __build_bitmap_index(self, db_mtime):
+        # NB: from scratch, then swapped for the previous one, which doesn't get used meanwhile
+        index = self.make_bitmap_index()
+        try:
+            with self.pool.connection() as cnnx:
+                index.build(cnnx)
+        except sqlite3.Error as e:
+            # NB: retried on next `refresh()`
+            logger.warning('failed to build bitmap index of %s: %s', self.db_path, e)
+            return
+        # NB: in this order, see `bitmap_index_covers()`
+        self.bitmap_index = index
+        self.bitmap_index_mtime = db_mtime
+
+    def sync_indices(self):
+        # NB: waits for the indices to be synced w/ `metadata.db`, e.g. for benchmarks
+        self.refresh()
+        for future in (self.index_sync_future, self.bitmap_index_future):
+            if future is not None:
+                future.result()
+
+    def __fetch(self, q, fetch_mode='iter', fetch_format='k_v', params=()):
+        with profiling.span('calibre.fetch'), self.pool.connection() as cnnx:
+            cursor = cnnx.execute(q, params)
+            if fetch_mode == 'first':
+                # FIXME: this looks dirty, row object must have a value accessor
+                return list(dict(cursor.fetchone()).values())[0]
+            elif fetch_mode == 'all':
+                if fetch_format == 'k_v':
+                    return [dict(row) for row in cursor.fetchall()]
+                else:
+                    # REVIEW: can we reset the cnnx.row_factory on the fly to get values directly?
+                    return list([dict(row) for row in cursor.fetchall()]).values()
             else:
-                # REVIEW: can we reset the self.cnnx.row_factory on the fly to get values directly?
-                return list([dict(row) for row in self.cursor.fetchall()]).values()
-        else:
-            return iter
+                # NB: rows get fetched before the connection goes back to the pool
+                return iter(cursor.fetchall())
 
 
     # -------------------
@@ -92,19 +312,72 @@ class CalibreDb():
         if search_type in self.SEARCH_TYPE_FIELDS:
             return self.SEARCH_TYPE_FIELDS[search_type]
 
+    def fulltext_index_covers(self, columns):
+        return self.fts_index is not None and self.fts_index.is_current and self.fts_index.covers(columns)
+
+    def fulltext_where(self, match):
+        return self.fts_index.where(match, 'b.id')
+
+    def token_index_covers(self, columns):
+        return self.token_index is not None and self.token_index.is_current and self.token_index.covers(columns)
+
+    def token_where(self, columns, lookups):
+        return self.token_index.where(columns, lookups, 'b.id')
+
+    def bitmap_index_covers(self, columns):
+        # NB: `bitmap_index_mtime` gets checked before `bitmap_index` gets read
+        return self.bitmap_index_mtime == self.db_mtime and self.bitmap_index is not None \
+            and self.bitmap_index.covers(columns)
+
+    def expansion_is_capped(self, columns, term):
+        # NB: whether the truncated `term` matches more tokens than the token and bitmap indices expand it to
+        # (`max_expansions`) in any of `columns`, in which case only the 1st ones got searched
+        lookup = recall.recall_term_to_token(term)
+        if lookup is None or lookup[0] != 'prefix':
+            return False
+        terms = None
+        if self.bitmap_index_covers(columns):
+            terms = self.bitmap_index.terms
+        elif self.token_index_covers(columns):
+            terms = self.token_index.terms
+        if terms is None:
+            return False
+        return any(terms.is_capped(column, lookup[1]) for column in columns if terms.covers([column]))
+
 
     # -------------------
     # ITEMS
 
     def item_list(self, fetch_mode='iter', fetch_format='v', where="",
-                  detailed=False):
+                  detailed=False, item_ids=None, limit=None, offset=None,
+                  after=None, before=None, summary=False):
+        # NB: `after` / `before` are (sorted_name, item_id) keys, for keyset pagination
+        # `summary` only fetches the multi-valued fields displayed in result lists
 
-        order_by = 'b.sort ASC'
+        multi_valued_fields = {}
+        if detailed:
+            multi_valued_fields = BOOK_DETAIL_FIELDS
+        elif summary:
+            multi_valued_fields = BOOK_SUMMARY_FIELDS
+
+        order_by = 'b.sort COLLATE NOCASE ASC, b.id ASC'
+        if before is not None:
+            order_by = 'b.sort COLLATE NOCASE DESC, b.id DESC'
+
+        if fetch_format == 'count' and item_ids is not None and not where:
+            return len(item_ids)
+
+        if fetch_format == 'count' and item_ids is None and isinstance(where, recall.RecallWhere) \
+           and self.bitmap_index_covers(where.columns):
+            with profiling.span('calibre.item_ids.bitmap'):
+                matches = self.bitmap_index.recall_matches(where.columns, where.query_terms)
+            if matches is not None:
+                return len(matches)
 
         if fetch_format == 'count':
             cols = 'count(1)'
             fetch_mode = 'first'
-            detailed = False
+            multi_valued_fields = {}
             order_by = ''
         else:
             cols = '''
@@ -112,44 +385,29 @@ class CalibreDb():
             b.title AS name,
             b.sort AS sorted_name,
             b.pubdate AS pub_date,
-            b.isbn AS ISBN,
             b.lccn AS LCCN,
             b.timestamp AS in_lib_date,
-            b.last_modified AS modif_in_lib_date
-            '''
-            if detailed:
-                cols += ''',
-                a.name as author,
-                a.sort as author_sorted,
-                p.name as publisher,
-                s.name as series,
-                s.sort as series_sorted,
-                t.name as subject
-                '''
+            b.last_modified AS modif_in_lib_date,
+            ''' + BOOK_ISBN_FIELD + ' AS ISBN'
+            if multi_valued_fields:
+                # NB: multi-valued fields get aggregated per book, so that we get exactly 1 row per book
+                cols += ', ' + ', '.join(expr + ' AS ' + k for k, expr in multi_valued_fields.items())
 
         where_list = []
 
-        q = 'SELECT ' + cols + ' FROM books AS b'
-        if detailed:
-            q += ' LEFT JOIN books_publishers_link AS b_p' \
-                + ' ON b_p.book = b.id' \
-                + ' LEFT JOIN publishers AS p' \
-                + ' ON b_p.publisher = p.id'
-            q += ' LEFT JOIN books_tags_link AS b_t' \
-                + ' ON b_t.book = b.id' \
-                + ' LEFT JOIN tags AS t' \
-                + ' ON b_t.tag = t.id'
-            q += ' LEFT JOIN books_series_link AS b_s' \
-                + ' ON b_s.book = b.id' \
-                + ' LEFT JOIN series AS s' \
-                + ' ON b_s.series = t.id'
-            q += ', authors AS a, books_authors_link AS b_a'
-            where_joins = [
-                'b_a.author = a.id', 'b_a.book = b.id',
-            ]
-            where_list.append(' AND '.join(where_joins))
+        q = 'SELECT ' + cols + ' FROM ' + BOOKS_SEARCHABLE + ' AS b'
         if where:
             where_list.append(where)
+        params = ()
+        if item_ids is not None:
+            where_list.append('b.id IN (SELECT value FROM json_each(?))')
+            params = (json.dumps(list(item_ids)),)
+        if after is not None:
+            where_list.append('(b.sort COLLATE NOCASE > ? OR (b.sort COLLATE NOCASE = ? AND b.id > ?))')
+            params += (after[0], after[0], after[1])
+        if before is not None:
+            where_list.append('(b.sort COLLATE NOCASE < ? OR (b.sort COLLATE NOCASE = ? AND b.id < ?))')
+            params += (before[0], before[0], before[1])
 
         if where_list:
             q += ' WHERE ' + ' AND '.join(where_list)
@@ -157,52 +415,73 @@ class CalibreDb():
         if order_by:
             q += ' ORDER BY ' + order_by
 
+        if limit is not None:
+            q += ' LIMIT ' + str(int(limit))
+            if offset:
+                q += ' OFFSET ' + str(int(offset))
 
-        raw_res = self.__fetch(q, fetch_mode, fetch_format)
 
+        raw_res = self.__fetch(q, fetch_mode, fetch_format, params)
 
-        if detailed:
-            joins = ('author', 'publisher', 'series', 'subject')
-            field_2_std = {v: k for k, v in self.FIELD_CONVERTION.items()}
+
+        if before is not None and fetch_mode == 'all' and fetch_format == 'k_v':
+            raw_res.reverse()
+
+        if multi_valued_fields:
             res = {}
-            for b_a in raw_res:
-                b_id = b_a['item_id']
-
-                cols_to_group = []
-                for j in joins:
-                    j_sorted = j + '_sorted'
-                    if j in b_a:
-                        cols_to_group.append(j)
-                    if j_sorted in b_a:
-                        cols_to_group.append(j_sorted)
-
-                if not b_id in res:
-                    res[b_id] = b_a
-
-                    for k in cols_to_group:
-                        if k.endswith('_sorted'):
-                            k_new = k.replace('_sorted', 's_sorted')
-                        else:
-                            k_new = k + 's'
-                        res[b_id][k_new] = {b_a[k]}
-                        del res[b_id][k]
-                else:
-                    for k in cols_to_group:
-                        if k.endswith('_sorted'):
-                            k_new = k.replace('_sorted', 's_sorted')
-                            # BUG: this is a buggy attempt
-                            # std_k = field_2_std[k.replace('_sorted', '')]
-                            # k_new = std_k + 's_sorted'
-                        else:
-                            k_new = k + 's'
-                            # std_k = field_2_std[k]
-                            # k_new = std_k + 's'
-                        res[b_id][k_new].add(b_a[k])
+            with profiling.span('calibre.group'):
+                for item in raw_res:
+                    for k in multi_valued_fields.keys():
+                        item[k] = json.loads(item[k])
+                    res[item['item_id']] = item
             return res
 
         return raw_res
 
 
+    def item_ids(self, where="", within=None):
+        # NB: `within` restricts the scan to a set of candidate items, looked up by rowid
+        q = 'SELECT b.id FROM ' + BOOKS_SEARCHABLE + ' AS b'
+        where_list = []
+        params = ()
+        if within is not None:
+            where_list.append('b.id IN (SELECT value FROM json_each(?))')
+            params = (json.dumps(list(within)),)
+        if where:
+            where_list.append('(' + where + ')')
+        if where_list:
+            q += ' WHERE ' + ' AND '.join(where_list)
+        with profiling.span('calibre.item_ids'), self.pool.connection() as cnnx:
+            return frozenset(row[0] for row in cnnx.execute(q, params))
+
+    def item_record(self, item_id):
+        res = self.item_list(fetch_mode='all', fetch_format='k_v', item_ids=[item_id], detailed=True)
+        return res.get(item_id)
+
+    def item_filter(self, columns, query_terms):
+        # NB: narrowing happens in SQL, see `term_item_ids()`
+        return None
+
+    def term_item_ids(self, column, term, within=None):
+        # NB: w/ `within`, only matches among those get returned
+        if self.bitmap_index_covers([column]):
+            matches = self.bitmap_index.term_matches(column, term)
+            if matches is not None:
+                if within is not None:
+                    matches = matches & within
+                return matches
+        if within is not None and self.__is_lookup([column], term):
+            # NB: index lookups are already proportional to the nb of matches of the term
+            return within & self.item_ids(where=recall.recall_to_db_dialect(self, [column], [term]))
+        return self.item_ids(where=recall.recall_to_db_dialect(self, [column], [term]), within=within)
+
+
+    def __is_lookup(self, columns, term):
+        # NB: whether the term gets answered from a sidecar index rather than by a REGEXP scan
+        return (self.token_index_covers(columns) and recall.recall_to_tokens([term]) is not None) \
+            or (self.fulltext_index_covers(columns) and recall.recall_to_fts5(columns, [term]) is not None)
+
+
     def author_list(self, fetch_mode='iter', fetch_format='v', where=""):
         if fetch_format == 'count':
             cols = 'count(1)'
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+import re
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dynix_ng.utils.profiling as profiling
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+BACKEND_TYPE = 'federated'
+
+## NB: nb of concurrent counts per backend, each having its own workers so that a slow one
+## (e.g. archive.org) doesn't hold the others' queries
+COUNT_WORKERS_PER_BACKEND = 4
+
+## NB: nb of items each backend may produce ahead of what got consumed
+READ_AHEAD = 200
+
+## NB: page size when a backend doesn't stream its results
+PAGE_SIZE = 100
+
+ISBN_RX = re.compile(r'[^0-9X]')
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def normalize_isbn(isbn):
+    if isinstance(isbn, list):
+        isbn = isbn[0] if isbn else None
+    if not isbn:
+        return None
+    isbn = ISBN_RX.sub('', isbn.upper())
+    return isbn or None
+
+
+def paged_item_stream(backend, where, page_size=PAGE_SIZE):
+    # NB: for backends w/o `item_stream()`
+    nb_fetched = 0
+    last_key = None
+    while True:
+        kwargs = {}
+        if backend.SUPPORTS_KEYSET_PAGINATION and last_key is not None:
+            kwargs['after'] = last_key
+        else:
+            kwargs['offset'] = nb_fetched
+        items = backend.item_list(fetch_mode='all', fetch_format='k_v', where=where, summary=True,
+                                  limit=page_size, **kwargs)
+        items = list(items.values())
+        for item in items:
+            yield item
+        if len(items) < page_size:
+            return
+        nb_fetched += len(items)
+        last_key = (items[-1]['sorted_name'], items[-1]['item_id'])
+
+
+## ------------------------------------------------------------------------
+## STATS
+
+## Per backend outcome of a count / stream, owned by the search (e.g. `DynixSearch`) as the backend
+## is shared by all sessions.
+
+class SearchStats():
+
+    def __init__(self):
+        self.latencies = {}
+        self.first_item_latencies = {}
+        self.counts = {}
+        self.errors = {}
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Fans searches out to several backends concurrently and merges their results.
+## Items are re-identified as "<backend name>:<backend item id>".
+
+class FederatedBackend():
+
+    # -------------------
+    # CONSTS
+
+    BACKEND_TYPE = BACKEND_TYPE
+
+    SUPPORTS_ITEM_IDS = False
+    SUPPORTS_KEYSET_PAGINATION = False
+    SUPPORTS_STREAMING = True
+    # NB: count accepts an `on_progress` callback, for partial results
+    SUPPORTS_PROGRESS = True
+    # NB: count and stream accept a `stats` object to fill, see `search_stats()`
+    SUPPORTS_BACKEND_STATS = True
+
+    ITEM_ID_TYPE = str
+
+
+    # -------------------
+    # LIFECYCLE
+
+    def __init__(self, backends):
+        # NB: {name: backend}
+        self.backends = backends
+        self.db_path = BACKEND_TYPE + ':' + ','.join(backends.keys())
+
+        # NB: {name: executor}, see `COUNT_WORKERS_PER_BACKEND`
+        self.count_executors = {name: ThreadPoolExecutor(max_workers=COUNT_WORKERS_PER_BACKEND,
+                                                         thread_name_prefix='dynix-federated-' + name)
+                                for name in backends.keys()}
+
+        # NB: {caller thread id: ids of the worker threads querying the backends on its behalf}
+        self.worker_thread_ids = {}
+
+    def search_stats(self):
+        return SearchStats()
+
+    def refresh(self):
+        is_modified = False
+        for backend in self.backends.values():
+            is_modified = backend.refresh() or is_modified
+        return is_modified
+
+    def data_version(self):
+        versions = tuple(backend.data_version() for backend in self.backends.values())
+        if None in versions:
+            return None
+        return versions
+
+    def interrupt(self, thread_id=None):
+        worker_thread_ids = [None]
+        if thread_id is not None:
+            worker_thread_ids = self.worker_thread_ids.get(thread_id, set())
+        for backend in self.backends.values():
+            for worker_thread_id in list(worker_thread_ids):
+                backend.interrupt(worker_thread_id)
+
+    def fulltext_index_covers(self, columns):
+        return False
+
+    def token_index_covers(self, columns):
+        return False
+
+    def expansion_is_capped(self, columns, term):
+        # NB: `columns` is {backend name: columns}
+        return any(backend.expansion_is_capped(columns[name], term) for name, backend in self.backends.items())
+
+
+    # -------------------
+    # FIELDS
+
+    def search_type_corresponding_fields(self, search_type):
+        # NB: {name: fields}, see `recall_to_db_dialect()`
+        return {name: backend.search_type_corresponding_fields(search_type)
+                for name, backend in self.backends.items()}
+
+
+    # -------------------
+    # ITEMS
+
+    def __timed_count(self, caller_thread_id, name, where, stats, on_progress=None):
+        self.worker_thread_ids[caller_thread_id].add(threading.get_ident())
+        start = time.perf_counter()
+        try:
+            count = self.backends[name].item_list(fetch_mode='first', fetch_format='count', where=where)
+        except Exception as e:
+            # NB: e.g. archive.org unreachable, local results still get counted
+            stats.errors[name] = e
+            count = 0
+        stats.latencies[name] = time.perf_counter() - start
+        stats.counts[name] = count
+        if on_progress is not None:
+            on_progress()
+        return count
+
+    def item_list(self, fetch_mode='iter', fetch_format='v', where=None, on_progress=None, stats=None, **kwargs):
+        # NB: `where` is {name: where}
+        if stats is None:
+            stats = SearchStats()
+        if fetch_format == 'count':
+            caller_thread_id = threading.get_ident()
+            self.worker_thread_ids[caller_thread_id] = set()
+            try:
+                futures = [self.count_executors[name].submit(profiling.in_scope(self.__timed_count), caller_thread_id, name, w, stats, on_progress)
+                           for name, w in where.items()]
+                # NB: upper bound, duplicates only get detected when streaming results
+                return sum(f.result() for f in futures)
+            finally:
+                del self.worker_thread_ids[caller_thread_id]
+
+        res = {}
+        for item in self.item_stream(where=where, stats=stats):
+            res[item['item_id']] = item
+        return res
+
+    def item_filter(self, columns, query_terms):
+        return None
+
+    def wrap_item(self, name, item):
+        item = dict(item)
+        item['item_id'] = name + ':' + str(item['item_id'])
+        item['source'] = name
+        return item
+
+    def item_stream(self, where=None, detailed=False, summary=True, stats=None):
+        # NB: each backend produces its results in its own thread, consumed as they arrive
+        # so that local results don't wait for remote ones
+        # a failing backend doesn't prevent the others' results from being shown, see `stats.errors`
+        if stats is None:
+            stats = SearchStats()
+        items = queue.Queue()
+        is_stopped = threading.Event()
+        nb_running = len(where)
+
+        def produce(name, backend_where):
+            backend = self.backends[name]
+            start = time.perf_counter()
+            try:
+                if backend.SUPPORTS_STREAMING:
+                    stream = backend.item_stream(where=backend_where, summary=True)
+                else:
+                    stream = paged_item_stream(backend, backend_where)
+                for i, item in enumerate(stream):
+                    if i == 0:
+                        stats.first_item_latencies[name] = time.perf_counter() - start
+                    # NB: backpressure, w/o blocking forever once the consumer is gone
+                    while items.qsize() >= READ_AHEAD * len(where):
+                        if is_stopped.wait(0.05):
+                            return
+                    if is_stopped.is_set():
+                        return
+                    items.put((name, item))
+            except Exception as e:
+                stats.errors[name] = e
+            finally:
+                items.put((name, None))
+
+        for name, backend_where in where.items():
+            threading.Thread(target=profiling.in_scope(produce), args=(name, backend_where), daemon=True,
+                             name='dynix-federated-' + name).start()
+
+        seen = set()
+        try:
+            while nb_running:
+                (name, item) = items.get()
+                if item is None:
+                    nb_running -= 1
+                    continue
+                item = self.wrap_item(name, item)
+                isbn = normalize_isbn(item.get('ISBN'))
+                key = 'isbn:' + isbn if isbn else item['item_id']
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield item
+        finally:
+            is_stopped.set()
+
+    def item_record(self, item_id):
+        (name, backend_item_id) = item_id.split(':', 1)
+        backend = self.backends[name]
+        item = backend.item_record(backend.ITEM_ID_TYPE(backend_item_id))
+        if item is not None:
+            return self.wrap_item(name, item)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+WARM_UP_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dynix-warm-up')
+
+
+
+## ------------------------------------------------------------------------
+## REGISTRY
+
+## Backends by name, created on first use from their factory.
+##
+## So that the app starts w/o opening any database nor importing heavy modules (e.g. `requests`),
+## and that a misconfigured backend only fails the searches that use it.
+## Creating a backend is thread-safe: a search and the warm-up waiting for the same backend get the same
+## instance. A backend whose creation failed gets re-created on next use.
+
+class BackendRegistry():
+
+    def __init__(self):
+        # NB: {name: fn returning the backend}, may call `get()` for other backends
+        self.factories = {}
+        self.backends = {}
+        # NB: per backend, so that a slow one doesn't hold the creation of others
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, factory):
+        with self.lock:
+            self.factories[name] = factory
+            self.locks[name] = threading.Lock()
+
+    def get(self, name):
+        backend = self.backends.get(name)
+        if backend is not None:
+            return backend
+        with self.locks[name]:
+            backend = self.backends.get(name)
+            if backend is None:
+                backend = self.factories[name]()
+                self.backends[name] = backend
+        return backend
+
+    def is_created(self, name):
+        return name in self.backends
+
+    def warm_up(self, names):
+        # NB: creates backends in the background, errors get raised again on use
+        def create(name):
+            try:
+                self.get(name)
+            except Exception:
+                pass
+        return [WARM_UP_EXECUTOR.submit(create, name) for name in names]
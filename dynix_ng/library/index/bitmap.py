@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dynix_ng.library.index.terms import TermDictionary, MAX_EXPANSIONS
+from dynix_ng.utils.query.recall import text_tokens, is_valid_token, recall_term_to_token
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: a token w/ more matches than 1 / `DENSE_RATIO` of the catalog is stored as a bitmap
+## below, as an array of ordinals (4 bytes each), i.e. whichever is the smallest
+DENSE_RATIO = 32
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def is_available():
+    return np is not None
+
+
+def popcount(bits):
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+    return int(np.unpackbits(bits).sum(dtype=np.int64))
+
+
+## ------------------------------------------------------------------------
+## MATCH SET
+
+## Set of items matched by a recall, as a packed bit array over the index ordinals.
+## Supports the same `&`, `|`, `len()` and iteration as the `frozenset` of item ids it stands for.
+
+class BitmapMatches():
+
+    def __init__(self, index, bits):
+        self.index = index
+        self.bits = bits
+
+    def __coerce(self, other):
+        if isinstance(other, BitmapMatches):
+            return other.bits
+        return self.index.item_ids_to_bits(other)
+
+    def __and__(self, other):
+        return BitmapMatches(self.index, self.bits & self.__coerce(other))
+
+    def __or__(self, other):
+        return BitmapMatches(self.index, self.bits | self.__coerce(other))
+
+    __rand__ = __and__
+    __ror__ = __or__
+
+    def __len__(self):
+        return popcount(self.bits)
+
+    def __iter__(self):
+        return iter(self.item_ids().tolist())
+
+    def item_ids(self):
+        ordinals = np.flatnonzero(np.unpackbits(self.bits, count=self.index.nb_items))
+        return self.index.item_ids[ordinals]
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## In-memory inverted index: per searchable field, normalized token -> items.
+## Items are identified by dense ordinals (position in `item_ids`).
+
+class BitmapIndex():
+
+    # -------------------
+    # LIFECYCLE
+
+    def __init__(self, fields, max_expansions=MAX_EXPANSIONS):
+        # NB: {column: SQL expression over `books AS b`}
+        self.fields = fields
+        self.nb_items = 0
+        self.item_ids = None
+        self.postings = {}
+        self.max_expansions = max_expansions
+        self.terms = TermDictionary({}, max_expansions)
+
+    def build(self, cnnx):
+        q = 'SELECT b.id, ' + ', '.join(self.fields.values()) + ' FROM books AS b ORDER BY b.id'
+        columns = list(self.fields.keys())
+
+        item_ids = []
+        raw_postings = {c: {} for c in columns}
+        for ordinal, row in enumerate(cnnx.execute(q)):
+            item_ids.append(row[0])
+            for column, text in zip(columns, row[1:]):
+                column_postings = raw_postings[column]
+                for token in text_tokens(text):
+                    if token in column_postings:
+                        column_postings[token].append(ordinal)
+                    else:
+                        column_postings[token] = [ordinal]
+
+        self.nb_items = len(item_ids)
+        self.item_ids = np.array(item_ids, dtype=np.int64)
+        self.postings = {}
+        for column, column_postings in raw_postings.items():
+            self.postings[column] = {token: self.__compact(ordinals)
+                                     for token, ordinals in column_postings.items()}
+        self.terms = TermDictionary.from_tokens({c: p.keys() for c, p in self.postings.items()},
+                                                self.max_expansions)
+
+    def __compact(self, ordinals):
+        ordinals = np.array(ordinals, dtype=np.uint32)
+        if len(ordinals) * DENSE_RATIO > self.nb_items:
+            return self.ordinals_to_bits(ordinals)
+        return ordinals
+
+    def nbytes(self):
+        total = self.item_ids.nbytes if self.item_ids is not None else 0
+        for column_postings in self.postings.values():
+            total += sum(p.nbytes for p in column_postings.values())
+        return total
+
+
+    # -------------------
+    # CONVERSIONS
+
+    def empty_bits(self):
+        return np.zeros((self.nb_items + 7) // 8, dtype=np.uint8)
+
+    def ordinals_to_bits(self, ordinals):
+        flags = np.zeros(self.nb_items, dtype=bool)
+        flags[ordinals] = True
+        return np.packbits(flags)
+
+    def item_ids_to_bits(self, item_ids):
+        return np.packbits(np.isin(self.item_ids, np.fromiter(item_ids, dtype=np.int64)))
+
+
+    # -------------------
+    # QUERY
+
+    def covers(self, columns):
+        return all(c in self.postings for c in columns)
+
+    def term_tokens(self, column, term):
+        # NB: returns None when the term can't be expressed as a set of tokens
+        lookup = recall_term_to_token(term)
+        if lookup is None:
+            return None
+        (kind, token) = lookup
+
+        if kind == 'prefix':
+            (tokens, _) = self.terms.expand(column, token)
+            return tokens
+        elif kind == 'folded' and token[-1] == "s":
+            # NB: the tokens folded into `token`
+            return [t for t in (token, token[:-1] + "'s") if is_valid_token(t)]
+        return [token]
+
+    def term_matches(self, column, term):
+        tokens = self.term_tokens(column, term)
+        if tokens is None:
+            return None
+
+        column_postings = self.postings[column]
+        bits = self.empty_bits()
+        sparse_ordinals = []
+        for token in tokens:
+            posting = column_postings.get(token)
+            if posting is None:
+                continue
+            if posting.dtype == np.uint8:
+                bits |= posting
+            else:
+                sparse_ordinals.append(posting)
+        if sparse_ordinals:
+            bits |= self.ordinals_to_bits(np.concatenate(sparse_ordinals))
+        return BitmapMatches(self, bits)
+
+    def recall_matches(self, columns, query_terms):
+        if not query_terms:
+            return None
+        column_bits = []
+        for column in columns:
+            term_bits = []
+            for term in query_terms:
+                matches = self.term_matches(column, term)
+                if matches is None:
+                    return None
+                term_bits.append(matches.bits)
+            column_bits.append(np.bitwise_and.reduce(term_bits))
+        return BitmapMatches(self, np.bitwise_or.reduce(column_bits))
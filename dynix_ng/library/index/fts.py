@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+from dynix_ng.library.index.sidecar import SidecarIndex, SOURCE_SCHEMA_NAME, sql_quote
+from dynix_ng.utils.query.recall import fold_case
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: alias under which the sidecar gets attached to the backend connection
+SCHEMA_NAME = 'calibre_fts'
+TABLE_NAME = 'books_fts'
+
+## NB: `tokenchars` so that tokens are the same as what `\w` matches on the REGEXP path
+TOKENIZER = "unicode61 remove_diacritics 0 tokenchars '_'"
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def is_available():
+    # NB: FTS5 is an optional SQLite extension
+    cnnx = sqlite3.connect(':memory:')
+    try:
+        cnnx.execute('CREATE VIRTUAL TABLE temp.fts5_test USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        cnnx.close()
+
+
+def sql_fold_case(s):
+    # NB: unicode61 only lowercases, e.g. "İ" doesn't match "I" as w/ `re.IGNORECASE`
+    if s is None:
+        return None
+    return fold_case(s)
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Sidecar SQLite database holding an FTS5 table w/ one row per book.
+
+class FtsIndex(SidecarIndex):
+
+    # -------------------
+    # CONSTS
+
+    SCHEMA_NAME = SCHEMA_NAME
+    TABLE_NAME = TABLE_NAME
+    ID_COLUMN = 'rowid'
+    INDEX_PATH_SUFFIX = '.fts.db'
+    VERSION = 2
+
+
+    # -------------------
+    # QUERY
+
+    def where(self, match, id_column='b.id'):
+        return id_column + ' IN (SELECT rowid FROM ' + self.SCHEMA_NAME + '.' + self.TABLE_NAME \
+            + ' WHERE ' + self.TABLE_NAME + ' MATCH ' + sql_quote(match) + ')'
+
+
+    # -------------------
+    # MAINTENANCE
+
+    def create_tables(self, cnnx):
+        cnnx.execute('DROP TABLE IF EXISTS main.' + self.TABLE_NAME)
+        cnnx.execute('CREATE VIRTUAL TABLE main.' + self.TABLE_NAME + ' USING fts5('
+                     + ', '.join(self.fields.keys())
+                     + ', tokenize=' + sql_quote(TOKENIZER) + ')')
+
+    def insert_books(self, cnnx, where=''):
+        cnnx.create_function('fold_case', 1, sql_fold_case, deterministic=True)
+        q = 'INSERT INTO main.' + self.TABLE_NAME + '(rowid, ' + ', '.join(self.fields.keys()) + ')' \
+            + ' SELECT b.id, ' + ', '.join('fold_case(' + expr + ')' for expr in self.fields.values()) \
+            + ' FROM ' + SOURCE_SCHEMA_NAME + '.books AS b'
+        if where:
+            q += ' WHERE ' + where
+        cnnx.execute(q)
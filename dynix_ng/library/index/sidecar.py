@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import os
+import zlib
+import hashlib
+import threading
+
+import sqlite3
+
+from dynix_ng.utils.xdg import user_cache_dir
+from dynix_ng.utils.sqlite_pool import sqlite3_uri
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: alias under which the source `metadata.db` gets attached when (re)indexing
+SOURCE_SCHEMA_NAME = 'calibre'
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def default_index_path(db_path, suffix):
+    db_hash = hashlib.sha1(os.path.realpath(db_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(user_cache_dir('calibre'), db_hash + suffix)
+
+
+def sql_quote(s):
+    return "'" + s.replace("'", "''") + "'"
+
+
+def sql_crc32(v):
+    if v is None:
+        return None
+    return zlib.crc32(str(v).encode('utf-8'))
+
+
+## NB: last computed signature of source tables, shared by the indices of a same `metadata.db`
+## (db path, source tables, mtime) -> signature
+source_signature_cache = {}
+source_signature_lock = threading.Lock()
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Sidecar SQLite database derived from `metadata.db`, w/ rows per book in `TABLE_NAME`.
+## The source `metadata.db` only ever gets attached read-only.
+## `source_tables` are the tables other than `books` that `fields` are computed from (e.g. authors and their links).
+## Subclasses implement `create_tables()` and `insert_books()`, and `clear_tables()` when having other tables.
+
+class SidecarIndex():
+
+    # -------------------
+    # CONSTS
+
+    ## NB: alias under which the sidecar gets attached to the backend connection
+    SCHEMA_NAME = None
+    TABLE_NAME = None
+    ## NB: column of `TABLE_NAME` holding the book id
+    ID_COLUMN = 'rowid'
+    INDEX_PATH_SUFFIX = '.db'
+    ## NB: to bump whenever what gets indexed changes, for existing sidecars to get rebuilt
+    VERSION = 1
+
+
+    # -------------------
+    # LIFECYCLE
+
+    def __init__(self, db_path, fields, index_path=None, source_tables=()):
+        self.db_path = db_path
+        # NB: {column: SQL expression over `books AS b`}
+        self.fields = fields
+        self.source_tables = source_tables
+        self.index_path = index_path or default_index_path(db_path, self.INDEX_PATH_SUFFIX)
+        self.fields_signature = hashlib.sha1(repr((self.VERSION, sorted(fields.items()))).encode('utf-8')).hexdigest()
+        self.source_mtime = None
+        # NB: whether the last `sync()` succeeded, i.e. the index can be queried
+        self.is_current = False
+
+    def __connect(self):
+        cnnx = sqlite3.connect(sqlite3_uri(self.index_path), uri=True)
+        cnnx.execute('ATTACH DATABASE ? AS ' + SOURCE_SCHEMA_NAME,
+                     (sqlite3_uri(self.db_path, 'ro'),))
+        return cnnx
+
+    def create(self):
+        # NB: empty until synced, but connections can already attach it
+        # they see its tables as soon as `sync()` commits them
+        cnnx = sqlite3.connect(sqlite3_uri(self.index_path), uri=True)
+        cnnx.close()
+
+    def attach(self, cnnx):
+        # NB: read-only, `cnnx` must have been opened w/ `uri=True`
+        cnnx.execute('ATTACH DATABASE ? AS ' + self.SCHEMA_NAME, (sqlite3_uri(self.index_path, 'ro'),))
+
+
+    # -------------------
+    # QUERY
+
+    def covers(self, columns):
+        return all(c in self.fields for c in columns)
+
+
+    # -------------------
+    # MAINTENANCE
+
+    def sync(self):
+        """Bring the index up to date w/ `metadata.db`.
+
+        Only stats the source file when it did not change since the last sync, of this process or a previous one.
+        Books added, removed or having a newer `last_modified` are reindexed incrementally.
+        Any modification of `source_tables` (e.g. an author rename) triggers a full rebuild.
+        Other modifications of the source (e.g. Calibre preferences) leave the index as is.
+        Returns True if the index got modified.
+        """
+        mtime = os.stat(self.db_path).st_mtime_ns
+        if mtime == self.source_mtime:
+            self.mark_current(False)
+            return False
+
+        cnnx = self.__connect()
+        try:
+            meta = self.__read_meta(cnnx)
+            # NB: e.g. on startup, w/ `metadata.db` untouched since the last sync of a previous process
+            if meta.get('fields_signature') == self.fields_signature and meta.get('source_mtime') == str(mtime):
+                self.source_mtime = mtime
+                self.mark_current(False)
+                return False
+
+            (max_last_modified, book_count) = cnnx.execute(
+                'SELECT max(last_modified), count(1) FROM ' + SOURCE_SCHEMA_NAME + '.books').fetchone()
+
+            source_signature = self.__source_signature(cnnx, mtime)
+
+            prev_max_last_modified = meta.get('max_last_modified') or ''
+            has_newer_books = (max_last_modified or '') > prev_max_last_modified
+            has_deleted_books = (max_last_modified or '') == prev_max_last_modified \
+                and meta.get('book_count') != str(book_count)
+
+            is_modified = True
+            if meta.get('fields_signature') != self.fields_signature:
+                self.create_tables(cnnx)
+                self.__rebuild(cnnx)
+            elif meta.get('source_signature') != source_signature:
+                self.__rebuild(cnnx)
+            elif has_newer_books or has_deleted_books:
+                self.__update(cnnx, prev_max_last_modified)
+            else:
+                is_modified = False
+
+            self.__write_meta(cnnx, {
+                'fields_signature': self.fields_signature,
+                'max_last_modified': max_last_modified,
+                'book_count': book_count,
+                'source_signature': source_signature,
+                'source_mtime': mtime,
+            })
+            if is_modified:
+                # NB: until `mark_current()`, e.g. for subclasses w/ state derived from the tables
+                self.is_current = False
+            cnnx.commit()
+        finally:
+            cnnx.close()
+
+        self.source_mtime = mtime
+        self.mark_current(is_modified)
+        return is_modified
+
+    def mark_current(self, is_modified):
+        # NB: called once synced, w/ `is_modified` as returned by `sync()`
+        # overrides refresh what they derive from the tables before calling it
+        self.is_current = True
+
+    def rebuild(self):
+        cnnx = self.__connect()
+        try:
+            self.create_tables(cnnx)
+            self.__rebuild(cnnx)
+            cnnx.commit()
+        finally:
+            cnnx.close()
+        self.source_mtime = None
+
+    def create_tables(self, cnnx):
+        # NB: (re)creates `main.<TABLE_NAME>` and its indices, dropping any previous one
+        raise NotImplementedError
+
+    def clear_tables(self, cnnx):
+        cnnx.execute('DELETE FROM main.' + self.TABLE_NAME)
+
+    def insert_books(self, cnnx, where=''):
+        # NB: indexes the books of `<SOURCE_SCHEMA_NAME>.books AS b` matching `where`
+        raise NotImplementedError
+
+    def __rebuild(self, cnnx):
+        self.clear_tables(cnnx)
+        self.insert_books(cnnx)
+
+    def __update(self, cnnx, since_last_modified):
+        table = 'main.' + self.TABLE_NAME
+        books = SOURCE_SCHEMA_NAME + '.books'
+        cnnx.execute('DELETE FROM ' + table + ' WHERE ' + self.ID_COLUMN + ' NOT IN (SELECT id FROM ' + books + ')')
+        cnnx.execute('DELETE FROM ' + table + ' WHERE ' + self.ID_COLUMN + ' IN (SELECT id FROM ' + books
+                     + ' WHERE last_modified > ?)', (since_last_modified,))
+        self.insert_books(cnnx, 'b.id NOT IN (SELECT ' + self.ID_COLUMN + ' FROM ' + table + ')')
+
+    def __source_signature(self, cnnx, mtime):
+        key = (self.db_path, tuple(self.source_tables), mtime)
+        with source_signature_lock:
+            signature = source_signature_cache.get(key)
+        if signature is None:
+            signature = self.__compute_source_signature(cnnx)
+            with source_signature_lock:
+                source_signature_cache.clear()
+                source_signature_cache[key] = signature
+        return signature
+
+    def __compute_source_signature(self, cnnx):
+        # NB: aggregates over the content of `source_tables`, as their rows have no modification date
+        # values get weighted by rowid, for a value moving from a row to another to change them
+        cnnx.create_function('crc32', 1, sql_crc32, deterministic=True)
+        h = hashlib.sha1()
+        for table in self.source_tables:
+            aggregates = ['count(1)', 'max(rowid)']
+            for (_, column, column_type, *_) in cnnx.execute('PRAGMA ' + SOURCE_SCHEMA_NAME
+                                                                + '.table_info(' + table + ')'):
+                v = column if 'INT' in column_type.upper() else 'crc32(' + column + ')'
+                aggregates.append('total((rowid % 65521) * ' + v + ')')
+            row = cnnx.execute('SELECT ' + ', '.join(aggregates)
+                               + ' FROM ' + SOURCE_SCHEMA_NAME + '.' + table).fetchone()
+            h.update(repr((table, row)).encode('utf-8'))
+        return h.hexdigest()
+
+    def __read_meta(self, cnnx):
+        cnnx.execute('CREATE TABLE IF NOT EXISTS main.meta (k TEXT PRIMARY KEY, v TEXT)')
+        return dict(cnnx.execute('SELECT k, v FROM main.meta').fetchall())
+
+    def __write_meta(self, cnnx, meta):
+        cnnx.executemany('INSERT OR REPLACE INTO main.meta (k, v) VALUES (?, ?)',
+                         [(k, None if v is None else str(v)) for k, v in meta.items()])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+from bisect import bisect_left
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: max nb of tokens a truncated term (e.g. "COMPUT?") expands to, the 1st ones in alphabetical order
+## so that short stems (e.g. "A?") don't end up looking up most of the vocabulary
+MAX_EXPANSIONS = 256
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def prefix_upper_bound(prefix):
+    # NB: smallest string greater than all the ones starting w/ `prefix`
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Sorted vocabulary of normalized tokens (see `text_tokens()`), per searchable field.
+## Expanding a truncated term costs O(log V + nb of tokens it expands to).
+
+class TermDictionary():
+
+    def __init__(self, terms, max_expansions=MAX_EXPANSIONS):
+        # NB: {column: sorted list of distinct tokens}
+        self.terms = terms
+        self.max_expansions = max_expansions
+
+    @classmethod
+    def from_tokens(cls, terms, max_expansions=MAX_EXPANSIONS):
+        # NB: `terms` is {column: iterable of tokens}
+        return cls({column: sorted(set(tokens)) for column, tokens in terms.items()}, max_expansions)
+
+    def covers(self, columns):
+        return all(c in self.terms for c in columns)
+
+    def __len__(self):
+        return sum(len(tokens) for tokens in self.terms.values())
+
+    def prefix_range(self, column, prefix):
+        # NB: bounds of the tokens starting w/ `prefix` in `self.terms[column]`
+        vocabulary = self.terms[column]
+        start = bisect_left(vocabulary, prefix)
+        end = bisect_left(vocabulary, prefix_upper_bound(prefix), lo=start)
+        return (start, end)
+
+    def expand(self, column, prefix):
+        # NB: returns (tokens, is_capped), `is_capped` being True when there were more than `max_expansions`
+        (start, end) = self.prefix_range(column, prefix)
+        if self.max_expansions is not None and end - start > self.max_expansions:
+            return (self.terms[column][start:start + self.max_expansions], True)
+        return (self.terms[column][start:end], False)
+
+    def is_capped(self, column, prefix):
+        (start, end) = self.prefix_range(column, prefix)
+        return self.max_expansions is not None and end - start > self.max_expansions
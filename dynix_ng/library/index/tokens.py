@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+from itertools import islice
+
+import sqlite3
+
+from dynix_ng.library.index.sidecar import SidecarIndex, SOURCE_SCHEMA_NAME, sql_quote
+from dynix_ng.library.index.terms import TermDictionary, MAX_EXPANSIONS
+from dynix_ng.utils.query.recall import text_tokens, fold_token
+from dynix_ng.utils.sqlite_pool import sqlite3_uri
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: alias under which the sidecar gets attached to the backend connection
+SCHEMA_NAME = 'calibre_tokens'
+TABLE_NAME = 'book_tokens'
+VOCABULARY_TABLE_NAME = 'tokens'
+
+## NB: nb of books tokenized at once when (re)indexing
+BATCH_SIZE = 5000
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Sidecar SQLite database holding the normalized tokens of each book, per searchable field.
+## Tokens get normalized as recall terms do (see `recall_to_tokens()`), so that a term is an
+## equality lookup on `folded` (or on `token`, once expanded, when truncated) instead of a REGEXP per row.
+##
+## - `tokens`: vocabulary, one row per distinct (field, token), also kept in memory as a `TermDictionary`
+## - `book_tokens`: (token id, book) postings
+
+class TokenIndex(SidecarIndex):
+
+    # -------------------
+    # CONSTS
+
+    SCHEMA_NAME = SCHEMA_NAME
+    TABLE_NAME = TABLE_NAME
+    VOCABULARY_TABLE_NAME = VOCABULARY_TABLE_NAME
+    ID_COLUMN = 'book'
+    INDEX_PATH_SUFFIX = '.tokens.db'
+    VERSION = 1
+
+
+    # -------------------
+    # LIFECYCLE
+
+    def __init__(self, db_path, fields, index_path=None, source_tables=(), max_expansions=MAX_EXPANSIONS):
+        super().__init__(db_path, fields, index_path, source_tables)
+        self.max_expansions = max_expansions
+        # NB: (re)loaded by `mark_current()`
+        self.terms = None
+
+    def load_terms(self):
+        cnnx = sqlite3.connect(sqlite3_uri(self.index_path, 'ro'), uri=True)
+        try:
+            terms = {column: [] for column in self.fields}
+            for (column, token) in cnnx.execute('SELECT field, token FROM ' + self.VOCABULARY_TABLE_NAME):
+                terms[column].append(token)
+        finally:
+            cnnx.close()
+        return TermDictionary.from_tokens(terms, self.max_expansions)
+
+
+    # -------------------
+    # QUERY
+
+    def term_select(self, column, kind, token):
+        q = 'SELECT id FROM ' + self.SCHEMA_NAME + '.' + self.VOCABULARY_TABLE_NAME \
+            + ' WHERE field = ' + sql_quote(column)
+        if kind == 'prefix':
+            (tokens, _) = self.terms.expand(column, token)
+            q += ' AND token IN (' + ', '.join(sql_quote(t) for t in tokens) + ')'
+        elif kind == 'token':
+            q += ' AND token = ' + sql_quote(token)
+        else:
+            q += ' AND folded = ' + sql_quote(token)
+        return 'SELECT book FROM ' + self.SCHEMA_NAME + '.' + self.TABLE_NAME + ' WHERE token IN (' + q + ')'
+
+    def where(self, columns, lookups, id_column='b.id'):
+        # NB: `lookups` is [(kind, token)] (see `recall_to_tokens()`), all matching in the same column
+        column_filters = []
+        for column in columns:
+            column_filters.append(id_column + ' IN ('
+                                  + ' INTERSECT '.join(self.term_select(column, kind, token)
+                                                       for (kind, token) in lookups)
+                                  + ')')
+        return '(' + ' OR '.join(column_filters) + ')'
+
+
+    # -------------------
+    # MAINTENANCE
+
+    def mark_current(self, is_modified):
+        # NB: not queryable until the terms match the sidecar
+        if is_modified or self.terms is None:
+            self.terms = self.load_terms()
+        super().mark_current(is_modified)
+
+    def create_tables(self, cnnx):
+        vocabulary = 'main.' + self.VOCABULARY_TABLE_NAME
+        cnnx.execute('DROP TABLE IF EXISTS main.' + self.TABLE_NAME)
+        cnnx.execute('DROP TABLE IF EXISTS ' + vocabulary)
+        cnnx.execute('CREATE TABLE ' + vocabulary + ' (id INTEGER PRIMARY KEY, field TEXT NOT NULL,'
+                     + ' token TEXT NOT NULL, folded TEXT NOT NULL, UNIQUE (field, token))')
+        cnnx.execute('CREATE INDEX ' + vocabulary + '_folded ON ' + self.VOCABULARY_TABLE_NAME + ' (field, folded)')
+        cnnx.execute('CREATE TABLE main.' + self.TABLE_NAME + ' (token INTEGER NOT NULL, book INTEGER NOT NULL,'
+                     + ' PRIMARY KEY (token, book)) WITHOUT ROWID')
+
+    def clear_tables(self, cnnx):
+        cnnx.execute('DELETE FROM main.' + self.TABLE_NAME)
+        cnnx.execute('DELETE FROM main.' + self.VOCABULARY_TABLE_NAME)
+
+    def insert_books(self, cnnx, where=''):
+        columns = list(self.fields.keys())
+        q = 'SELECT b.id, ' + ', '.join(self.fields.values()) \
+            + ' FROM ' + SOURCE_SCHEMA_NAME + '.books AS b'
+        if where:
+            q += ' WHERE ' + where
+        books = cnnx.execute(q)
+        if where:
+            # NB: read upfront, as `where` refers to the table being inserted into
+            books = iter(books.fetchall())
+            # NB: tokens of deleted or reindexed books, so that truncated terms don't expand to them
+            cnnx.execute('DELETE FROM main.' + self.VOCABULARY_TABLE_NAME
+                         + ' WHERE id NOT IN (SELECT token FROM main.' + self.TABLE_NAME + ')')
+
+        # NB: {(field, token): id}
+        token_ids = {(field, token): token_id for (token_id, field, token)
+                     in cnnx.execute('SELECT id, field, token FROM main.' + self.VOCABULARY_TABLE_NAME)}
+        next_token_id = max(token_ids.values(), default=0) + 1
+
+        while True:
+            batch = list(islice(books, BATCH_SIZE))
+            if not batch:
+                break
+            new_tokens = []
+            postings = []
+            for row in batch:
+                for column, text in zip(columns, row[1:]):
+                    for token in text_tokens(text):
+                        token_id = token_ids.get((column, token))
+                        if token_id is None:
+                            token_id = next_token_id
+                            next_token_id += 1
+                            token_ids[(column, token)] = token_id
+                            new_tokens.append((token_id, column, token, fold_token(token)))
+                        postings.append((token_id, row[0]))
+            cnnx.executemany('INSERT INTO main.' + self.VOCABULARY_TABLE_NAME + ' (id, field, token, folded)'
+                             + ' VALUES (?, ?, ?, ?)', new_tokens)
+            # NB: in primary key order, for pages to get filled sequentially
+            postings.sort()
+            cnnx.executemany('INSERT INTO main.' + self.TABLE_NAME + ' (token, book) VALUES (?, ?)', postings)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import json
+import threading
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import sqlite3
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: rough estimate of in-memory size above which rows get spilled to a temporary on-disk table
+DEFAULT_MEMORY_BUDGET = 64 * 2**20
+
+POINTER_SIZE = 8
+
+## NB: stored as epoch seconds, w/ the exact same string given back
+DATE_COLUMNS = ('pub_date', 'in_lib_date', 'modif_in_lib_date')
+
+## NB: e.g. "1999-01-01 00:00:00+00:00" (Calibre) or "1999-01-01T00:00:00Z" (archive.org)
+## (date, separator, time, suffix)
+DATE_RX = re.compile(r'(\d{4})-(\d\d)-(\d\d)([ T])(\d\d):(\d\d):(\d\d)(.*)')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+NO_DATE = -2**63
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def encode_date(v):
+    # NB: returns (epoch seconds, (separator, suffix)), or None when not a date
+    m = DATE_RX.fullmatch(v) if isinstance(v, str) else None
+    if m is None:
+        return None
+    (year, month, day, sep, hour, minute, second, suffix) = m.groups()
+    try:
+        dt = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return (int((dt - EPOCH).total_seconds()), (sep, suffix))
+
+
+def decode_date(seconds, date_format):
+    (sep, suffix) = date_format
+    dt = EPOCH + timedelta(seconds=seconds)
+    return '%04d-%02d-%02d%s%02d:%02d:%02d%s' % (dt.year, dt.month, dt.day, sep,
+                                                 dt.hour, dt.minute, dt.second, suffix)
+
+
+## ------------------------------------------------------------------------
+## MAIN CLASS
+
+## Ordered list of result items (dicts), stored column by column in arrays:
+## - ids as integers
+## - dates (`DATE_COLUMNS`) as epoch seconds, w/ their string format per column
+## - other values (e.g. sort keys, authors) as codes of interned values, as authors, publishers and tags
+##   are heavily repeated across a result set
+## Columns fallback to lists when their values don't fit, e.g. ids that are not integers.
+## May be built by a background worker then read from the UI thread, the spill connection being shared.
+
+class ResultSet():
+
+    # -------------------
+    # LIFECYCLE
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_size = 0
+
+        self.nb_rows = 0
+        # NB: falls back to a list when ids are not integers (e.g. archive.org identifiers)
+        self.item_ids = array('q')
+        self.columns = {}
+        # NB: {column: (separator, suffix)}, for the ones holding dates
+        self.date_formats = {}
+        # NB: interned values, by code, and their codes
+        self.values = [None]
+        self.codes = {None: 0}
+
+        # NB: rows from position `spill_start` are stored on disk
+        self.spill_start = None
+        self.spill_cnnx = None
+        self.spill_lock = threading.Lock()
+
+    def close(self):
+        with self.spill_lock:
+            if self.spill_cnnx is not None:
+                self.spill_cnnx.close()
+                self.spill_cnnx = None
+
+
+    # -------------------
+    # WRITE
+
+    def __intern(self, v):
+        if isinstance(v, (list, tuple, set)):
+            v = tuple(self.values[self.__intern(e)] for e in v)
+        code = self.codes.get(v)
+        if code is None:
+            code = len(self.values)
+            self.codes[v] = code
+            self.values.append(v)
+            self.memory_size += sys.getsizeof(v) + 2 * POINTER_SIZE
+        return code
+
+    def __new_column(self, k, v):
+        # NB: w/ None for the previous rows
+        if k in DATE_COLUMNS and encode_date(v) is not None:
+            self.date_formats[k] = encode_date(v)[1]
+            return array('q', [NO_DATE]) * self.nb_rows
+        return array('i', [0]) * self.nb_rows
+
+    def __column_to_codes(self, k):
+        # NB: for a date column w/ a value not in its format (e.g. "????")
+        values = [self.__decode(k, e) for e in self.columns[k]]
+        del self.date_formats[k]
+        self.columns[k] = array('i', [self.__intern(v) for v in values])
+
+    def __column_to_list(self, k):
+        # NB: for a column w/ a value that can't be interned (not hashable)
+        self.columns[k] = [self.__decode(k, e) for e in self.columns[k]]
+
+    def __encode(self, k, v):
+        column = self.columns[k]
+        if not isinstance(column, array):
+            return v
+        if k in self.date_formats:
+            if v is None:
+                return NO_DATE
+            encoded = encode_date(v)
+            if encoded is not None and encoded[1] == self.date_formats[k]:
+                return encoded[0]
+            self.__column_to_codes(k)
+        try:
+            return self.__intern(v)
+        except TypeError:
+            self.__column_to_list(k)
+            return v
+
+    def __decode(self, k, e):
+        column = self.columns[k]
+        if not isinstance(column, array):
+            return e
+        if k in self.date_formats:
+            if e == NO_DATE:
+                return None
+            return decode_date(e, self.date_formats[k])
+        return self.values[e]
+
+    def __spill(self):
+        # NB: "" opens a private temporary database, deleted on close
+        self.spill_cnnx = sqlite3.connect('', check_same_thread=False)
+        self.spill_cnnx.execute('CREATE TABLE rows (position INTEGER PRIMARY KEY, item TEXT)')
+        self.spill_start = self.nb_rows
+
+    def append(self, item):
+        if self.spill_start is None and self.memory_size > self.memory_budget:
+            self.__spill()
+
+        if self.spill_start is not None:
+            with self.spill_lock:
+                self.spill_cnnx.execute('INSERT INTO rows (position, item) VALUES (?, ?)',
+                                        (self.nb_rows, json.dumps(item)))
+            self.nb_rows += 1
+            return
+
+        item_id = item.get('item_id')
+        if isinstance(self.item_ids, array) and not isinstance(item_id, int):
+            self.item_ids = list(self.item_ids)
+        self.item_ids.append(item_id)
+        self.memory_size += POINTER_SIZE
+
+        for k, v in item.items():
+            if k == 'item_id':
+                continue
+            if k not in self.columns:
+                self.columns[k] = self.__new_column(k, v)
+            e = self.__encode(k, v)
+            self.columns[k].append(e)
+            self.memory_size += self.columns[k].itemsize if isinstance(self.columns[k], array) else POINTER_SIZE
+        for k, column in self.columns.items():
+            if len(column) == self.nb_rows:
+                column.append(self.__encode(k, None))
+
+        self.nb_rows += 1
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+
+    # -------------------
+    # READ
+
+    def __len__(self):
+        return self.nb_rows
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.nb_rows
+        if not 0 <= position < self.nb_rows:
+            raise IndexError(position)
+
+        if self.spill_start is not None and position >= self.spill_start:
+            with self.spill_lock:
+                (raw_item,) = self.spill_cnnx.execute('SELECT item FROM rows WHERE position = ?',
+                                                      (position,)).fetchone()
+            return json.loads(raw_item)
+
+        item = {'item_id': self.item_ids[position]}
+        for k, column in self.columns.items():
+            v = self.__decode(k, column[position])
+            item[k] = list(v) if isinstance(v, tuple) else v
+        return item
+
+    def __iter__(self):
+        for position in range(self.nb_rows):
+            yield self[position]
+
+    def window(self, start, size):
+        return [self[p] for p in range(start, min(start + size, self.nb_rows))]
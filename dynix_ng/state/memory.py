@@ -1,4 +1,50 @@
+import sys
+import threading
+from types import ModuleType
+
+
+## NB: state of a terminal session
+## several sessions can share a process (see `dynix_ng.ui.server`), each being processed by its own thread:
+## these are per thread, and get moved across threads w/ `save()` / `restore()`
+SESSION_STATE_KEYS = ['term', 'session', 'screen_win', 'inputwin', 'input_box', 'renderer']
+
+thread_state = threading.local()
+
+
+class ThreadLocalStateModule(ModuleType):
+
+    def __getattr__(self, k):
+        # NB: only called for attributes not found as module globals
+        if k in SESSION_STATE_KEYS:
+            try:
+                return getattr(thread_state, k)
+            except AttributeError:
+                pass
+        raise AttributeError("module '" + __name__ + "' has no attribute '" + k + "'")
+
+    def __setattr__(self, k, v):
+        if k in SESSION_STATE_KEYS:
+            setattr(thread_state, k, v)
+        else:
+            super().__setattr__(k, v)
+
+    def __delattr__(self, k):
+        if k in SESSION_STATE_KEYS:
+            delattr(thread_state, k)
+        else:
+            super().__delattr__(k)
+
+sys.modules[__name__].__class__ = ThreadLocalStateModule
+
 
 def init():
-    global session
-    session = {}
+    thread_state.session = {}
+
+
+def save():
+    return {k: getattr(thread_state, k, None) for k in SESSION_STATE_KEYS}
+
+
+def restore(state):
+    for k, v in state.items():
+        setattr(thread_state, k, v)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import selectors
+
+
+
+# EVENT LOOP
+
+## Sleeps until there is something to do:
+## - keys pending on the terminal input
+## - a notification from another thread (e.g. background search progress), see `notify()`
+## - a deadline, e.g. the header clock changing
+## Notifications go through a self-pipe, so that they also wake up `select()`.
+
+class EventLoop():
+
+    def __init__(self, input_fd=None):
+        if input_fd is None:
+            input_fd = sys.stdin.fileno()
+        self.input_fd = input_fd
+
+        (self.wakeup_r, self.wakeup_w) = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.input_fd, selectors.EVENT_READ, 'input')
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, 'wakeup')
+
+        self.stats = {
+            'wakeups': 0,
+            'inputs': 0,
+            'notifications': 0,
+            'timeouts': 0,
+        }
+
+    def close(self):
+        self.selector.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    def notify(self):
+        # NB: thread-safe, several notifications before a wakeup get coalesced
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except (BlockingIOError, OSError):
+            # NB: pipe full (a wakeup is pending anyway) or loop closed
+            pass
+
+    def wait(self, timeout=None):
+        # NB: returns True if there are keys to read
+        # `timeout` in seconds, None to wait until an input or notification
+        if timeout is not None:
+            timeout = max(0, timeout)
+        events = self.selector.select(timeout)
+        self.stats['wakeups'] += 1
+
+        is_input = False
+        for key, _mask in events:
+            if key.data == 'input':
+                is_input = True
+                self.stats['inputs'] += 1
+            else:
+                self.stats['notifications'] += 1
+                try:
+                    while os.read(self.wakeup_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+        if not events:
+            self.stats['timeouts'] += 1
+        return is_input
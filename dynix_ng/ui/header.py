@@ -9,18 +9,20 @@ from dynix_ng.utils.curses.print import addstr_x_centered
 
 
 def draw_modem_header(win):
+    (_, cols) = win.getmaxyx()
+
     # FDX probably means full duplex
     header_txt = " " * 8 + "FDX" + " " * 4 + "10:32p  22- 48"
 
     # NB: this -1 should not be needed but doesn't work on a gnome-terminal if not set...
     # works on an actual HW terminal
-    # header_txt += " " * (curses.COLS - len(header_txt))
-    header_txt += " " * (curses.COLS - len(header_txt) - 1)
+    # header_txt += " " * (cols - len(header_txt))
+    header_txt += " " * (cols - len(header_txt) - 1)
 
     win.addstr(0, 0, header_txt, curses.A_UNDERLINE)
 
 
-def draw_dynix_header(win, library_name, display_seconds=False):
+def dynix_header_clock(display_seconds=False):
     now = datetime.datetime.now()
     today_str = now.strftime("%d %b %Y").upper()
 
@@ -29,14 +31,31 @@ def draw_dynix_header(win, library_name, display_seconds=False):
     time_format = "%I:%M%p"
     if display_seconds:
         time_format = "%I:%M:%S%p"
-        now_str = now.strftime(time_format).lower()
-        # locale.setlocale(locale.LC_CTYPE, curr_locale + '.' + curr_encoding)
+    now_str = now.strftime(time_format).lower()
+    # locale.setlocale(locale.LC_CTYPE, curr_locale + '.' + curr_encoding)
 
-    now_str_modem = now_str[:-1]
+    return (today_str, now_str)
 
-    win.addstr(0, 1, " " * (curses.COLS - 2), curses.A_REVERSE)
-    win.addstr(0, 2, today_str, curses.A_REVERSE)
-    win.addstr(0, curses.COLS - len(now_str) - 2, now_str, curses.A_REVERSE)
+
+def dynix_header_clock_next_change(display_seconds=False):
+    # NB: nb of seconds until the displayed time changes, w/ a margin not to wake up just before
+    now = datetime.datetime.now()
+    if display_seconds:
+        return 1 - now.microsecond / 10**6 + 0.001
+    return 60 - now.second - now.microsecond / 10**6 + 0.001
+
+
+def draw_dynix_header(win, library_name, display_seconds=False):
+    (_, cols) = win.getmaxyx()
+    win.addstr(0, 1, " " * (cols - 2), curses.A_REVERSE)
+    draw_dynix_header_clock(win, dynix_header_clock(display_seconds))
     addstr_x_centered(win, 1, library_name, curses.A_REVERSE)
 
     # addstr_x_centered(stdscr, 1, " Dial Pac ", curses.A_REVERSE)
+
+
+def draw_dynix_header_clock(win, clock):
+    (_, cols) = win.getmaxyx()
+    (today_str, now_str) = clock
+    win.addstr(0, 2, today_str, curses.A_REVERSE)
+    win.addstr(0, cols - len(now_str) - 2, now_str, curses.A_REVERSE)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+import curses
+import curses.ascii
+
+from dynix_ng.utils.curses.terminal import VirtualTerminal
+
+import dynix_ng.state.memory as global_state
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+DEFAULT_WINDOW_SIZE = (24, 80)
+
+## NB: how long to wait for a screen to show up by default
+WAIT_TIMEOUT = 30
+
+
+
+## ------------------------------------------------------------------------
+## DRIVER
+
+## Runs a session w/o a terminal, for benchmarks and scripted checks: keys get fed to a `VirtualTerminal`
+## and what it would send to the terminal gets recorded.
+##
+## Same callbacks as `DynixTelnetServer`, so the session gets processed exactly as when served.
+## Each frame (i.e. `doupdate()`) gets recorded as {'time': s spent drawing it, 'bytes': nb of bytes sent}.
+
+class HeadlessDriver():
+
+    def __init__(self, session_start, session_update, session_process_input, session_end,
+                 lines=DEFAULT_WINDOW_SIZE[0], cols=DEFAULT_WINDOW_SIZE[1]):
+        self.session_start = session_start
+        self.session_update = session_update
+        self.session_process_input = session_process_input
+        self.session_end = session_end
+
+        self.term = VirtualTerminal(lines, cols, write=self.on_write)
+        self.state = None
+        self.is_running = False
+
+        # NB: set from background search workers
+        self.wakeup = threading.Event()
+
+        self.frames = []
+        self.frame_start = None
+
+    # -------------------
+    # LIFECYCLE
+
+    def start(self):
+        self.frame_start = time.perf_counter()
+        self.session_start(self.term, on_progress=self.wakeup.set)
+        self.state = global_state.save()
+        self.is_running = True
+        self.update()
+
+    def stop(self):
+        if self.state is None:
+            return
+        global_state.restore(self.state)
+        self.session_end()
+        self.state = None
+        self.is_running = False
+
+    def on_write(self, data):
+        now = time.perf_counter()
+        self.frames.append({'time': now - self.frame_start, 'bytes': len(data)})
+        # NB: several frames can get drawn in a row, e.g. key echo then new screen
+        self.frame_start = now
+
+    # -------------------
+    # STEP
+
+    def update(self):
+        # NB: returns the frames drawn
+        nb_frames = len(self.frames)
+        global_state.restore(self.state)
+        self.frame_start = time.perf_counter()
+        self.session_update()
+        self.state = global_state.save()
+        return self.frames[nb_frames:]
+
+    def press(self, keys):
+        # NB: `keys` as a str (<Return> being '\n') or key codes
+        # returns the frames drawn, w/ 'latency' being the time from the key press to the end of each
+        if isinstance(keys, str):
+            keys = [curses.ascii.NL if k in '\r\n' else ord(k) for k in keys]
+        nb_frames = len(self.frames)
+        global_state.restore(self.state)
+        start = time.perf_counter()
+        self.frame_start = start
+        self.term.feed_keys(keys)
+        self.is_running = self.session_process_input()
+        if self.is_running:
+            self.session_update()
+        self.state = global_state.save()
+
+        frames = self.frames[nb_frames:]
+        end = start
+        for frame in frames:
+            end += frame['time']
+            frame['latency'] = end - start
+        return frames
+
+    def wait_for(self, marker, timeout=WAIT_TIMEOUT):
+        # NB: keeps the session ticking until `marker` is displayed, returns how long it took
+        start = time.perf_counter()
+        deadline = start + timeout
+        while not self.contains(marker):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError('"' + marker + '" not displayed after ' + str(timeout) + 's')
+            global_state.restore(self.state)
+            next_frame_in = global_state.renderer.next_frame_in()
+            self.wakeup.wait(min(remaining, next_frame_in))
+            self.wakeup.clear()
+            self.update()
+        return time.perf_counter() - start
+
+    # -------------------
+    # DISPLAY
+
+    def screen_lines(self):
+        # NB: as last sent to the terminal
+        if self.term.curscr is None:
+            return []
+        return [''.join(ch for (ch, _) in row) for row in self.term.curscr]
+
+    def contains(self, marker):
+        return any(marker in line for line in self.screen_lines())
+
+    def screen_text(self):
+        return '\n'.join(line.rstrip() for line in self.screen_lines())
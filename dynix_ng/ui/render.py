@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import curses
+
+from dynix_ng.ui.header import draw_modem_header, draw_dynix_header, draw_dynix_header_clock, dynix_header_clock, \
+    dynix_header_clock_next_change
+
+import dynix_ng.utils.profiling as profiling
+import dynix_ng.state.memory as global_state
+
+
+
+# RENDERER
+
+## Only repaints what changed since the last frame:
+## - the header clock, when the displayed time changes
+## - the current screen, when invalidated (screen change, user input) or when its `render_state()` changes
+## Windows are staged w/ `noutrefresh()` and sent to the terminal at once w/ a single `doupdate()`.
+
+class Renderer():
+
+    def __init__(self, header_win, library_name, display_seconds=False, modem_header_win=None):
+        self.header_win = header_win
+        self.modem_header_win = modem_header_win
+        self.library_name = library_name
+        self.display_seconds = display_seconds
+
+        self.is_header_dirty = True
+        self.is_screen_dirty = True
+        self.clock = None
+        self.screen_state = None
+
+        self.stats = {
+            'frames': 0,
+            'updates': 0,
+            'header_repaints': 0,
+            'clock_repaints': 0,
+            'screen_repaints': 0,
+        }
+
+    def invalidate(self):
+        self.is_header_dirty = True
+        self.is_screen_dirty = True
+
+    def invalidate_screen(self):
+        self.is_screen_dirty = True
+
+    def next_frame_in(self):
+        # NB: w/o any event, nothing but the clock changes
+        return dynix_header_clock_next_change(self.display_seconds)
+
+    def render(self):
+        screen = global_state.session.screen
+        self.stats['frames'] += 1
+        is_updated = False
+
+        if self.is_header_dirty:
+            if self.modem_header_win is not None:
+                draw_modem_header(self.modem_header_win)
+                self.modem_header_win.noutrefresh()
+            draw_dynix_header(self.header_win, self.library_name, self.display_seconds)
+            self.header_win.noutrefresh()
+            self.clock = dynix_header_clock(self.display_seconds)
+            self.is_header_dirty = False
+            self.stats['header_repaints'] += 1
+            is_updated = True
+        else:
+            clock = dynix_header_clock(self.display_seconds)
+            if clock != self.clock:
+                draw_dynix_header_clock(self.header_win, clock)
+                self.header_win.noutrefresh()
+                self.clock = clock
+                self.stats['clock_repaints'] += 1
+                is_updated = True
+
+        screen_state = (screen.render_state(), profiling.overlay_state())
+        if self.is_screen_dirty or screen_state != self.screen_state:
+            global_state.screen_win.erase()
+            with profiling.span('draw.' + type(screen).__name__):
+                screen.draw()
+            if profiling.enabled:
+                self.draw_profiling_overlay()
+            global_state.screen_win.noutrefresh()
+            self.screen_state = screen_state
+            self.is_screen_dirty = False
+            self.stats['screen_repaints'] += 1
+            is_updated = True
+
+        if is_updated:
+            # NB: last, so that the cursor ends up in the input field
+            global_state.inputwin.noutrefresh()
+            global_state.term.doupdate()
+            self.stats['updates'] += 1
+
+    def draw_profiling_overlay(self):
+        # NB: on the last line, over the screen's shortcuts
+        win = global_state.screen_win
+        (lines, cols) = win.getmaxyx()
+        win.move(lines - 1, 0)
+        win.clrtoeol()
+        win.addstr(lines - 1, 0, profiling.overlay_text(cols), curses.A_REVERSE)
@@ -26,9 +26,13 @@ class DynixScreen(ABC):
     def get_input(self):
         pass
 
-    def refresh(self):
-        global_state.screen_win.refresh()
-        global_state.inputwin.refresh()
+    def update(self):
+        # NB: called on every wakeup of the event loop, returns the id of the screen to switch to, if any
+        pass
+
+    def render_state(self):
+        # NB: screen gets redrawn when this changes, in addition to on user input
+        pass
 
     def handle_user_input(self, user_input, SCREENS):
         pass
@@ -87,8 +91,8 @@ class WelcomeScreen(DynixScreen):
 
 
     def get_input(self):
-        box = CustomTextbox(global_state.inputwin)
-        user_input = box.edit() # NB: breaks after `HALF_DELAY`
+        box = global_state.input_box
+        user_input = box.edit() # NB: breaks once no more keys are pending
         if user_input != curses.ERR:
             try:
                     return list(global_state.screen_list.keys())[int(user_input)]
@@ -127,6 +131,10 @@ class SearchScreen(DynixScreen):
                         'COMPUT? (For words starting with COMPUT...)'):
             global_state.screen_win.addstr(y, 15, example)
             y += 2
+
+        if session.error is not None:
+            global_state.screen_win.addstr(lines - 4, 4, ("Search failed: " + str(session.error))[:cols - 5])
+
         # input
         prompt_text = " " + input_prompt +  " "
         global_state.screen_win.addstr(lines - 2, 1, prompt_text, curses.A_STANDOUT)
@@ -135,8 +143,8 @@ class SearchScreen(DynixScreen):
 
 
     def get_input(self):
-        box = CustomTextbox(global_state.inputwin)
-        user_input = box.edit() # NB: breaks after `HALF_DELAY`
+        box = global_state.input_box
+        user_input = box.edit() # NB: breaks once no more keys are pending
 
         if user_input != curses.ERR:
             return user_input
@@ -158,10 +166,30 @@ class CounterScreen(DynixScreen):
     def __init__(self):
         session = global_state.session
         session.search_stage = 'count'
-        session.search.query_count_incremental()
+        # NB: count runs in the background, results get displayed as they arrive
+        if session.search.nb_counted_terms < len(session.search.recall_query):
+            session.search.start_count()
+        self.display_requested = False
 
         super().__init__()
 
+    def update(self):
+        search = global_state.session.search
+        if search.is_counting() or search.count_error():
+            return
+        if self.display_requested or search.results_total_count <= 30:
+            return 'summary'
+
+    def render_state(self):
+        # NB: counts come in from the background search
+        search = global_state.session.search
+        state = (search.results_total_count, tuple(search.results_incremental_counts.items()),
+                 tuple(sorted(search.capped_terms)), search.is_counting(), str(search.count_error()))
+        stats = search.backend_stats
+        if stats is not None:
+            state += (tuple(stats.counts.items()), tuple(stats.errors.keys()))
+        return state
+
 
     def draw(self):
         (lines, cols) = global_state.screen_win.getmaxyx()
@@ -178,12 +206,38 @@ class CounterScreen(DynixScreen):
 
         global_state.screen_win.addstr(y, 4, "Searching...                Running Total")
         y += 2
+        # NB: rows below shift down as term counts come in
+        global_state.screen_win.move(y, 0)
+        global_state.screen_win.clrtobot()
 
-        for term, count in session.search.results_incremental_counts.items():
+        for term, count in list(session.search.results_incremental_counts.items()):
             global_state.screen_win.addstr(y, 4, term)
             global_state.screen_win.addstr(y, 25, str(count))
+            if term in session.search.capped_terms:
+                global_state.screen_win.addstr(y, 35, "Too many words, only the 1st ones searched"[:cols - 36])
             y += 1
 
+        # NB: federated search, per backend
+        stats = session.search.backend_stats
+        if stats is not None:
+            y += 1
+            for name in session.search.backend.backends.keys():
+                if name in stats.errors:
+                    status = "failed (%dms)" % (stats.latencies.get(name, 0) * 1000)
+                elif name in stats.counts:
+                    status = "%-8d (%dms)" % (stats.counts[name], stats.latencies[name] * 1000)
+                else:
+                    status = "..."
+                global_state.screen_win.addstr(y, 4, name)
+                global_state.screen_win.addstr(y, 25, status)
+                y += 1
+
+        error = session.search.count_error()
+        if error is not None:
+            global_state.screen_win.addstr(lines - 8, 4, ("Search failed: " + str(error))[:cols - 5])
+        elif session.search.is_counting():
+            global_state.screen_win.addstr(y, 4, "...")
+
         global_state.screen_win.addstr(lines - 7, 4, "titles matched     " + nb_total)
 
         global_state.screen_win.addstr(lines - 5, 4, "To narrow the search, enter more words.")
@@ -197,8 +251,8 @@ class CounterScreen(DynixScreen):
 
 
     def get_input(self):
-        box = CustomTextbox(global_state.inputwin)
-        user_input = box.edit() # NB: breaks after `HALF_DELAY`
+        box = global_state.input_box
+        user_input = box.edit() # NB: breaks once no more keys are pending
 
         if user_input != curses.ERR:
             return user_input
@@ -221,7 +275,10 @@ class SummaryScreen(DynixScreen):
     def __init__(self):
         session = global_state.session
         session.search_stage = 'summary'
-        session.search.query()
+        # NB: only fetch the titles that fit on screen, 2 lines per title
+        if session.search.page is None:
+            (lines, cols) = global_state.screen_win.getmaxyx()
+            session.search.query_page((lines - 6) // 2)
 
         super().__init__()
 
@@ -247,8 +304,8 @@ class SummaryScreen(DynixScreen):
         y += 1
 
         # results table
-        i = 1
-        for item_id, item in session.search.results.items():
+        i = session.search.page_start
+        for item in session.search.page:
             # author_summary = ' - '.join(item['authors_sorted'])
             res_id_prefix = str(i) + ". "
             author_summary = ' - '.join(item['authors'])
@@ -279,15 +336,19 @@ class SummaryScreen(DynixScreen):
 
         # paging
         # TODO: right-align
-        global_state.screen_win.addstr(lines - 3, 0, "---" + str(session.search.results_total_count) + " titles, End of List" + "---")
+        if session.search.has_next_page():
+            paging_status = " titles, Press <Return> for more"
+        else:
+            paging_status = " titles, End of List"
+        global_state.screen_win.addstr(lines - 3, 0, "---" + str(session.search.results_total_count) + paging_status + "---")
 
         # shortcuts
-        global_state.screen_win.addstr(lines - 1, 0, "Commands: SO=Start Over, B=Back, D=Display, ?=Help")
+        global_state.screen_win.addstr(lines - 1, 0, "Commands: SO=Start Over, B=Back, F=Forward, P=Previous, ?=Help")
 
 
     def get_input(self):
-        box = CustomTextbox(global_state.inputwin)
-        user_input = box.edit() # NB: breaks after `HALF_DELAY`
+        box = global_state.input_box
+        user_input = box.edit() # NB: breaks once no more keys are pending
 
         if user_input != curses.ERR:
             return user_input
@@ -302,6 +363,8 @@ class ItemScreen(DynixScreen):
     def __init__(self):
         session = global_state.session
         session.search_stage = 'item'
+        # NB: so that PT / NT display instantly
+        session.search.prefetch_neighbours(session.item_id)
         super().__init__()
 
     def draw(self):
@@ -350,8 +413,8 @@ class ItemScreen(DynixScreen):
 
 
     def get_input(self):
-        box = CustomTextbox(global_state.inputwin)
-        user_input = box.edit() # NB: breaks after `HALF_DELAY`
+        box = global_state.input_box
+        user_input = box.edit() # NB: breaks once no more keys are pending
 
         if user_input != curses.ERR:
             return user_input
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from dynix_ng.utils.curses.terminal import VirtualTerminal
+from dynix_ng.utils.telnet import TelnetDecoder, NEGOTIATION
+
+import dynix_ng.state.memory as global_state
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: like the original Dynix terminals, when the client doesn't report its window size
+DEFAULT_WINDOW_SIZE = (24, 80)
+MIN_WINDOW_SIZE = (24, 80)
+
+## NB: how long to wait for the client to report its window size before drawing the 1st screen
+NEGOTIATION_TIMEOUT = 0.2
+
+MAX_SESSIONS = 256
+
+READ_SIZE = 4096
+
+
+
+## ------------------------------------------------------------------------
+## SERVER
+
+## Serves the OPAC to many telnet clients from a single process, like the original Dynix host.
+##
+## Each connection gets its own session, screens and (virtual) terminal, while backends and their caches
+## are shared. Each session gets processed by a thread of its own, its state in `global_state` being
+## per thread (see `dynix_ng.state.memory`), so that a session waiting (e.g. on archive.org or a record
+## fetch) doesn't hold the others. The asyncio loop only does the socket I/O.
+## Searches still run in background workers and notify the loop of their progress.
+
+class DynixTelnetServer():
+
+    def __init__(self, session_start, session_update, session_process_input, session_end,
+                 host='127.0.0.1', port=2323, max_sessions=MAX_SESSIONS):
+        # NB: callbacks operating on the session in `global_state` of the calling thread, see `dynix_ng.main()`
+        self.session_start = session_start
+        self.session_update = session_update
+        self.session_process_input = session_process_input
+        self.session_end = session_end
+
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.server = None
+
+        self.nb_sessions = 0
+        self.stats = {
+            'connections': 0,
+            'rejected': 0,
+            'updates': 0,
+            'bytes_sent': 0,
+        }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        # NB: w/ port 0, the one actually bound
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def negotiate(self, reader, writer, decoder):
+        writer.write(NEGOTIATION)
+        await writer.drain()
+        try:
+            data = await asyncio.wait_for(reader.read(READ_SIZE), NEGOTIATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            return []
+        if not data:
+            raise ConnectionResetError()
+        # NB: keys typed right away
+        return decoder.feed(data)
+
+    def session_step(self, is_input_pending):
+        # NB: on the session thread, returns (whether the session goes on, time until its next frame)
+        running = True
+        if is_input_pending:
+            running = self.session_process_input()
+        if running:
+            self.session_update()
+        return (running, global_state.renderer.next_frame_in())
+
+    async def handle_connection(self, reader, writer):
+        if self.nb_sessions >= self.max_sessions:
+            self.stats['rejected'] += 1
+            writer.write(b'Too many sessions, please try again later.\r\n')
+            await writer.drain()
+            writer.close()
+            return
+
+        self.nb_sessions += 1
+        self.stats['connections'] += 1
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        decoder = TelnetDecoder()
+        # NB: 1 thread, so that the steps of the session run in order
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dynix-session')
+        term = None
+        is_started = False
+        read_task = None
+        wakeup_task = None
+
+        try:
+            keys = await self.negotiate(reader, writer, decoder)
+
+            # NB: called from the session thread, transports not being thread-safe
+            def write(data):
+                loop.call_soon_threadsafe(writer.write, data)
+
+            (lines, cols) = decoder.window_size or DEFAULT_WINDOW_SIZE
+            term = VirtualTerminal(max(lines, MIN_WINDOW_SIZE[0]), max(cols, MIN_WINDOW_SIZE[1]),
+                                   write=write)
+            term.feed_keys(keys)
+
+            # NB: called from background search workers
+            def on_progress():
+                loop.call_soon_threadsafe(wakeup.set)
+
+            def start():
+                self.session_start(term, on_progress=on_progress, is_remote=True)
+
+            await loop.run_in_executor(executor, start)
+            is_started = True
+
+            running = True
+            is_input_pending = bool(keys)
+            while running:
+                (running, timeout) = await loop.run_in_executor(executor, self.session_step, is_input_pending)
+                is_input_pending = False
+                if not running:
+                    break
+
+                await writer.drain()
+
+                # NB: sleeps until a key is pressed, a background search progresses or the clock changes
+                if read_task is None:
+                    read_task = asyncio.ensure_future(reader.read(READ_SIZE))
+                wakeup_task = asyncio.ensure_future(wakeup.wait())
+                (done, _) = await asyncio.wait({read_task, wakeup_task}, timeout=timeout,
+                                               return_when=asyncio.FIRST_COMPLETED)
+                wakeup_task.cancel()
+                wakeup.clear()
+
+                if read_task in done:
+                    data = read_task.result()
+                    read_task = None
+                    if not data:
+                        break
+                    keys = decoder.feed(data)
+                    if keys:
+                        # NB: the session thread is idle meanwhile
+                        term.feed_keys(keys)
+                        is_input_pending = True
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        finally:
+            for task in (read_task, wakeup_task):
+                if task is not None:
+                    task.cancel()
+            if is_started:
+                # NB: w/o waiting, the session thread may still be blocked on a step
+                executor.submit(self.session_end)
+                self.stats['updates'] += term.stats['updates']
+                self.stats['bytes_sent'] += term.stats['bytes']
+            executor.shutdown(wait=False)
+            self.nb_sessions -= 1
+            writer.close()
@@ -1,12 +1,69 @@
 #!/usr/bin/env python3
 
+import sys
+import threading
+import operator
+import itertools
+from functools import reduce
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import dynix_ng.utils.query.recall as recall
+import dynix_ng.utils.profiling as profiling
+from dynix_ng.utils.cache import LruCache
+from dynix_ng.library.result_set import ResultSet
+
+
+
+# CONF
+
+## NB: max nb of (backend, column, term) match sets kept around by a session
+TERM_MATCHES_CACHE_SIZE = 64
+
+## NB: nb of titles before and after the one displayed whose full record gets prefetched
+PREFETCH_NEIGHBOURS = 1
+
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dynix-prefetch')
+
+## NB: shared by all sessions, a session's additional words get counted after its current ones
+## see `DynixSearch.start_count()`
+SEARCH_WORKERS = 4
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='dynix-search')
+
+## NB: counts and matched item ids of searches, shared by all sessions
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE_MAX_BYTES = 64 * 2**20
+
+
+
+# HELPERS
+
+def item_ids_nbytes(item_ids):
+    if item_ids is None:
+        return 0
+    if hasattr(item_ids, 'bits'): # `BitmapMatches`
+        return item_ids.bits.nbytes
+    # NB: hash table + int objects
+    return sys.getsizeof(item_ids) + 28 * len(item_ids)
+
+
+def search_cache_entry_nbytes(entry):
+    (count, matched_item_ids, running_matches) = entry
+    # NB: same set may be referenced several times, e.g. w/ a single field
+    unique_item_ids = {id(v): v for v in [matched_item_ids, *running_matches.values()]}
+    return sum(item_ids_nbytes(v) for v in unique_item_ids.values())
+
+
+SEARCH_CACHE = LruCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_MAX_BYTES, search_cache_entry_nbytes)
+
+
+def search_cache_stats():
+    return SEARCH_CACHE.stats()
 
 
-
 
 class DynixSession():
-    def __init__(self):
+    def __init__(self, on_progress=None, is_remote=False):
 
         self.screen_id = 'welcome'
         self.screen = None
@@ -14,34 +71,339 @@ class DynixSession():
         self.user_input = ""
 
         self.search = None
+        # NB: screen the current search got typed in, to go back to
+        self.search_screen_id = None
+        # NB: why the last search couldn't start
+        self.error = None
         self.search_stage = None
         self.item_id = None
         self.item = None
 
+        self.term_matches = LruCache(TERM_MATCHES_CACHE_SIZE)
+
+        # NB: called from background threads when a search progresses, e.g. to wake up the event loop
+        self.on_progress = on_progress
+        # NB: telnet client, as opposed to the terminal the process runs in
+        self.is_remote = is_remote
+
 
 class DynixSearch():
-    def __init__(self, user_query, backend, search_type):
+    def __init__(self, user_query, backend, search_type, term_matches=None, on_progress=None):
+        # NB: the overlay shows the breakdown of the last search of the session, whose thread this is
+        self.profiling_spans = profiling.new_scope()
+
         self.user_query = user_query
         self.recall_query = recall.user_query_to_recall(self.user_query)
         self.search_type = search_type
         self.backend = backend
         self.backend_fields = backend.search_type_corresponding_fields(search_type)
 
+        if term_matches is None:
+            term_matches = LruCache(TERM_MATCHES_CACHE_SIZE)
+        self.term_matches = term_matches
+        self.is_refreshed = False
+
+        # NB: count runs in the background, `results_incremental_counts` filling up as it goes
+        self.count_future = None
+        # NB: last count whose narrowed results got taken over by the UI thread, see `collect_count()`
+        self.collected_future = None
+        self.is_cancelled = False
+        # NB: worker running the count, so that cancelling only interrupts this search's queries
+        self.count_thread_id = None
+        self.on_progress = on_progress
+
         self.results_total_count = 0
         self.results_incremental_counts = {}
-        self.results = {}
+        # NB: truncated terms matching too many words, of which only the 1st ones got searched
+        self.capped_terms = set()
+        # NB: per backend counts, latencies and errors of the last count, w/ federated backends
+        self.backend_stats = None
+        # NB: results fetched so far, in order and w/o gap from the 1st one
+        self.results = ResultSet()
+        # NB: for backends that stream results, generator of the remaining ones
+        self.results_stream = None
+
+        # NB: window of results currently displayed, `page_start` being the position of its 1st item
+        self.page = None
+        self.page_start = 1
+        self.page_size = None
+
+        # NB: full records of the displayed title and its neighbours, as futures by position
+        self.records = {}
+
+        # NB: complete results before the last terms got added, for backends w/o item ids
+        # only ever read by the count worker, which narrows them down into a new `ResultSet`
+        self.narrowed_results = None
+
+        # NB: running intersection of the matches of the counted terms, per backend field
+        self.nb_counted_terms = 0
+        self.running_matches = {}
+        self.matched_item_ids = None
+
+    def add_terms(self, user_query):
+        self.collect_count()
+        self.user_query += ' ' + user_query
+        self.recall_query += recall.user_query_to_recall(user_query)
+
+        # NB: when all the results are known, new terms only need to be tested against them
+        self.narrowed_results = None
+        if self.results_total_count and len(self.results) == self.results_total_count:
+            self.narrowed_results = self.results
+        self.results = ResultSet()
+        self.results_stream = None
+        self.page = None
+        self.records = {}
+
+    # -------------------
+    # BACKGROUND COUNT
 
-    def query_count_incremental(self):
-        incremental_terms = []
-        for term in self.recall_query:
-            incremental_terms.append(term)
+    def start_count(self):
+        # NB: queued after the previous count of this search, which is either running or ahead in the queue
+        previous_future = self.count_future
+        self.count_future = SEARCH_EXECUTOR.submit(profiling.in_scope(self.query_count_incremental), previous_future,
+                                                   self.narrowed_results)
+        self.count_future.add_done_callback(lambda f: self.notify_progress())
+        return self.count_future
+
+    def collect_count(self):
+        # NB: on the UI thread, results narrowed down by the last count replace the current ones
+        future = self.count_future
+        if future is None or not future.done() or future is self.collected_future:
+            return
+        self.collected_future = future
+        if future.cancelled() or future.exception() is not None:
+            return
+        narrowed_results = future.result()
+        if narrowed_results is not None:
+            self.narrowed_results = narrowed_results
+            self.results = narrowed_results
+
+    def notify_progress(self):
+        if self.on_progress is not None:
+            self.on_progress()
+
+    def is_counting(self):
+        return self.count_future is not None and not self.count_future.done()
+
+    def count_error(self):
+        if self.count_future is not None and self.count_future.done() and not self.is_cancelled:
+            return self.count_future.exception()
+
+    def cancel(self):
+        self.is_cancelled = True
+        # NB: a count still queued stops by itself once started
+        if self.is_counting() and self.count_thread_id is not None:
+            self.backend.interrupt(self.count_thread_id)
+
+    # -------------------
+    # COUNT
+
+    def search_key(self, query_terms):
+        # NB: w/ AND semantics, order and repetition of terms don't matter
+        data_version = self.backend.data_version()
+        if data_version is None:
+            return None
+        return (self.backend.BACKEND_TYPE, self.backend.db_path, data_version, self.search_type,
+                tuple(sorted(set(query_terms))))
+
+    def cached_count(self, query_terms):
+        key = self.search_key(query_terms)
+        if key is not None:
+            return SEARCH_CACHE.get(key)
+
+    def cache_count(self, query_terms, count):
+        key = self.search_key(query_terms)
+        if key is not None:
+            SEARCH_CACHE.put(key, (count, self.matched_item_ids, dict(self.running_matches)))
+
+    def term_item_ids(self, column, term, within=None):
+        key = (self.backend.BACKEND_TYPE, self.backend.db_path, self.backend.data_version(), column, term)
+        item_ids = self.term_matches.get(key)
+        if item_ids is not None:
+            if within is not None:
+                item_ids = within & item_ids
+            return item_ids
+        if within is not None:
+            # NB: only tested against candidates, so not reusable by other searches
+            if not within:
+                return within
+            return self.backend.term_item_ids(column, term, within=within)
+        item_ids = self.backend.term_item_ids(column, term)
+        self.term_matches.put(key, item_ids)
+        return item_ids
+
+    def query_count_incremental(self, previous_future=None, narrowed_results=None):
+        # NB: returns the complete results of the search, when they got narrowed down from `narrowed_results`
+        if previous_future is not None:
+            futures.wait([previous_future])
+            # NB: complete results of the previous terms, not known yet when this count got queued
+            if not previous_future.cancelled() and previous_future.exception() is None \
+               and previous_future.result() is not None:
+                narrowed_results = previous_future.result()
+        self.count_thread_id = threading.get_ident()
+        try:
+            if not self.is_refreshed:
+                if self.backend.refresh():
+                    # NB: entries are keyed by data version, so stale ones are unreachable anyway
+                    self.term_matches.clear()
+                    SEARCH_CACHE.clear()
+                self.is_refreshed = True
+
+            for i in range(self.nb_counted_terms, len(self.recall_query)):
+                if self.is_cancelled:
+                    return
+                incremental_terms = self.recall_query[:i + 1]
+                cached = self.cached_count(incremental_terms)
+                if cached is not None:
+                    (count, self.matched_item_ids, running_matches) = cached
+                    self.running_matches = dict(running_matches)
+                    # NB: not narrowed down w/ this term
+                    narrowed_results = None
+                else:
+                    (count, narrowed_results) = self.query_count_term(incremental_terms, narrowed_results)
+                    self.cache_count(incremental_terms, count)
+                self.results_incremental_counts[incremental_terms[-1]] = count
+                if self.backend.expansion_is_capped(self.backend_fields, incremental_terms[-1]):
+                    self.capped_terms.add(incremental_terms[-1])
+                self.results_total_count = count
+                self.nb_counted_terms += 1
+                self.notify_progress()
+            return narrowed_results
+        except Exception:
+            # NB: interrupted backend query
+            if self.is_cancelled:
+                return
+            raise
+
+    def query_count_term(self, incremental_terms, narrowed_results=None):
+        # NB: returns (count of the search w/ its last term added, its complete results if narrowed down)
+        if not self.backend.SUPPORTS_ITEM_IDS:
+            item_filter = self.backend.item_filter(self.backend_fields, incremental_terms)
+            if narrowed_results is not None and item_filter is not None:
+                results = ResultSet()
+                results.extend(item for item in narrowed_results if item_filter(item))
+                return (len(results), results)
             where = recall.recall_to_db_dialect(self.backend, self.backend_fields, incremental_terms)
-            count = self.backend.item_list(fetch_mode='first', fetch_format='count', where=where)
-            self.results_incremental_counts[term] = count
+            kwargs = {}
+            if self.backend.SUPPORTS_PROGRESS:
+                kwargs['on_progress'] = self.notify_progress
+            if self.backend.SUPPORTS_BACKEND_STATS:
+                self.backend_stats = self.backend.search_stats()
+                kwargs['stats'] = self.backend_stats
+            return (self.backend.item_list(fetch_mode='first', fetch_format='count', where=where, **kwargs), None)
 
-        self.results_total_count = list(self.results_incremental_counts.values())[-1]
+        # NB: a search matches items for which at least one field contains all the terms
+        # so, to count a new term, we only need to test it against the matches of the previous ones
+        term = incremental_terms[-1]
+        for column in self.backend_fields:
+            self.running_matches[column] = self.term_item_ids(column, term,
+                                                              within=self.running_matches.get(column))
+        self.matched_item_ids = reduce(operator.or_, self.running_matches.values())
+        return (len(self.matched_item_ids), None)
 
-    def query(self):
+    def results_filter(self):
+        if self.matched_item_ids is not None:
+            return {'item_ids': self.matched_item_ids}
         # TODO: move this outside to be generic
         where = recall.recall_to_db_dialect(self.backend, self.backend_fields, self.recall_query)
-        self.results = self.backend.item_list(fetch_mode='all', fetch_format='k_v', where=where, detailed=True)
+        return {'where': where}
+
+    def query(self):
+        self.results = ResultSet()
+        items = self.backend.item_list(fetch_mode='all', fetch_format='k_v', summary=True,
+                                       **self.results_filter())
+        self.results.extend(items.values())
+
+    # -------------------
+    # WINDOWED RESULTS
+
+    @staticmethod
+    def item_key(item):
+        return (item['sorted_name'], item['item_id'])
+
+    def fetch_results(self, nb_results):
+        # NB: fetch results until we have at least `nb_results` of them (or all of them)
+        self.collect_count()
+        nb_missing = min(nb_results, self.results_total_count) - len(self.results)
+        if nb_missing <= 0:
+            return
+        if self.backend.SUPPORTS_STREAMING:
+            if self.results_stream is None:
+                kwargs = self.results_filter()
+                if self.backend_stats is not None:
+                    kwargs['stats'] = self.backend_stats
+                self.results_stream = self.backend.item_stream(summary=True, **kwargs)
+            nb_results_before = len(self.results)
+            self.results.extend(itertools.islice(self.results_stream, nb_missing))
+            # NB: count may be an upper bound, e.g. w/ federated search duplicates
+            if len(self.results) - nb_results_before < nb_missing:
+                self.results_total_count = len(self.results)
+            return
+        kwargs = self.results_filter()
+        if self.backend.SUPPORTS_KEYSET_PAGINATION and len(self.results):
+            kwargs['after'] = self.item_key(self.results[-1])
+        else:
+            kwargs['offset'] = len(self.results)
+        items = self.backend.item_list(fetch_mode='all', fetch_format='k_v', summary=True,
+                                       limit=max(nb_missing, self.page_size or 0), **kwargs)
+        self.results.extend(items.values())
+
+    def show_page(self, page_start):
+        self.fetch_results(page_start - 1 + self.page_size)
+        self.page_start = page_start
+        self.page = self.results.window(page_start - 1, self.page_size)
+
+    def query_page(self, page_size):
+        self.page_size = page_size
+        self.show_page(1)
+
+    def has_next_page(self):
+        return self.page_start + len(self.page) - 1 < self.results_total_count
+
+    def has_previous_page(self):
+        return self.page_start > 1
+
+    def next_page(self):
+        if self.has_next_page():
+            self.show_page(self.page_start + self.page_size)
+
+    def previous_page(self):
+        if self.has_previous_page():
+            self.show_page(max(1, self.page_start - self.page_size))
+
+    def item_at(self, position):
+        if position < 1:
+            return None
+        self.fetch_results(position)
+        if position <= len(self.results):
+            return self.results[position - 1]
+
+    # -------------------
+    # FULL RECORDS
+
+    def item_record(self, position):
+        future = self.records.get(position)
+        if future is not None and future.exception() is None:
+            return future.result()
+
+        item = self.item_at(position)
+        if item is None:
+            return None
+        future = Future()
+        future.set_result(self.backend.item_record(item['item_id']))
+        self.records[position] = future
+        return future.result()
+
+    def prefetch_neighbours(self, position):
+        wanted = range(position - PREFETCH_NEIGHBOURS, position + PREFETCH_NEIGHBOURS + 1)
+        for p, future in list(self.records.items()):
+            if p not in wanted:
+                future.cancel()
+                del self.records[p]
+
+        for p in wanted:
+            if p in self.records or p < 1 or p > self.results_total_count:
+                continue
+            item = self.item_at(p)
+            if item is not None:
+                self.records[p] = PREFETCH_EXECUTOR.submit(profiling.in_scope(self.backend.item_record), item['item_id'])
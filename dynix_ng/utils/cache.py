@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import sqlite3
+
+
+
+## ------------------------------------------------------------------------
+## LRU
+
+class LruCache():
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=None):
+        # NB: `sizeof(value)` estimates the memory taken by an entry, needed for `max_bytes`
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # NB: shared w/ background workers
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        nb_lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / nb_lookups if nb_lookups else 0,
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+        }
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.__remove(key)
+            size = self.sizeof(value) if self.sizeof is not None else 0
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.nbytes += size
+            while len(self.entries) > self.max_entries \
+                  or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self.__remove(next(iter(self.entries)))
+
+    def __remove(self, key):
+        del self.entries[key]
+        self.nbytes -= self.sizes.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+
+
+## ------------------------------------------------------------------------
+## PERSISTENT
+
+## JSON-serializable values in a SQLite file, w/ a TTL and LRU eviction past `max_bytes`.
+## Entries older than `ttl` are still served for `stale_ttl` more seconds, flagged as stale
+## so that the caller can revalidate them in the background.
+
+class SqliteCache():
+
+    def __init__(self, path, ttl=24 * 3600, stale_ttl=7 * 24 * 3600, max_bytes=64 * 2**20):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.cnnx = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # NB: several dynix-ng processes may share the same cache
+        self.cnnx.execute('PRAGMA journal_mode=WAL')
+        self.cnnx.execute('PRAGMA synchronous=NORMAL')
+        self.cnnx.execute('''CREATE TABLE IF NOT EXISTS entries (
+                                 key TEXT PRIMARY KEY,
+                                 value TEXT NOT NULL,
+                                 size INTEGER NOT NULL,
+                                 created REAL NOT NULL,
+                                 accessed REAL NOT NULL)''')
+        self.cnnx.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self.cnnx.execute('CREATE INDEX IF NOT EXISTS entries_created ON entries (created)')
+        # NB: running total of `size`, kept by triggers as other processes write to the same cache
+        self.cnnx.execute('BEGIN IMMEDIATE')
+        self.cnnx.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)')
+        self.cnnx.execute('INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+        self.cnnx.execute('''CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                                 UPDATE totals SET size = size + new.size WHERE id = 0;
+                             END''')
+        self.cnnx.execute('''CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                                 UPDATE totals SET size = size - old.size WHERE id = 0;
+                             END''')
+        self.cnnx.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            self.cnnx.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.cnnx.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def nbytes(self):
+        with self.lock:
+            return self.__nbytes()
+
+    def __nbytes(self):
+        return self.cnnx.execute('SELECT size FROM totals WHERE id = 0').fetchone()[0]
+
+    def stats(self):
+        nb_lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.stale_hits) / nb_lookups if nb_lookups else 0,
+        }
+
+    def get(self, key):
+        # NB: returns (value, is_stale), or None on miss
+        now = time.time()
+        with self.lock:
+            row = self.cnnx.execute('SELECT value, created FROM entries WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl + self.stale_ttl:
+                self.misses += 1
+                return None
+            self.cnnx.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+        (raw_value, created) = row
+        is_stale = now - created > self.ttl
+        if is_stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return (json.loads(raw_value), is_stale)
+
+    def put(self, key, value):
+        raw_value = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            # NB: not `INSERT OR REPLACE`, as its implicit delete doesn't fire triggers
+            self.cnnx.execute('BEGIN IMMEDIATE')
+            try:
+                self.cnnx.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self.cnnx.execute('INSERT INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                                  (key, raw_value, len(raw_value), now, now))
+                self.__evict(now)
+            except BaseException:
+                self.cnnx.execute('ROLLBACK')
+                raise
+            self.cnnx.execute('COMMIT')
+
+    def __evict(self, now):
+        self.cnnx.execute('DELETE FROM entries WHERE created < ?', (now - self.ttl - self.stale_ttl,))
+        total = self.__nbytes()
+        if total <= self.max_bytes:
+            return
+        to_delete = []
+        for (key, size) in self.cnnx.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            total -= size
+        self.cnnx.executemany('DELETE FROM entries WHERE key = ?', to_delete)
+
+    def clear(self):
+        with self.lock:
+            self.cnnx.execute('DELETE FROM entries')
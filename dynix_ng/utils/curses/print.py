@@ -7,7 +7,8 @@ import curses
 
 
 def addstr_x_centered(win, y, message, flags=0):
-    x = int(math.floor((curses.COLS - len(message)) / 2))
+    (_, cols) = win.getmaxyx()
+    x = int(math.floor((cols - len(message)) / 2))
     win.addstr(y, x, message, flags)
 
 
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import curses
+from collections import deque
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+ESC = '\x1b'
+
+BLANK = (' ', 0)
+
+## NB: attributes used by the screens -> SGR parameter
+SGR_ATTRS = [
+    (curses.A_STANDOUT | curses.A_REVERSE, '7'),
+    (curses.A_UNDERLINE, '4'),
+    (curses.A_BOLD, '1'),
+]
+
+
+
+## ------------------------------------------------------------------------
+## CURSES TERMINAL
+
+## The terminal of the process, i.e. plain curses.
+## Only valid after `curses.initscr()`.
+
+class CursesTerminal():
+
+    def __init__(self):
+        self.lines = curses.LINES
+        self.cols = curses.COLS
+
+    def newwin(self, nlines, ncols, begin_y, begin_x):
+        return curses.newwin(nlines, ncols, begin_y, begin_x)
+
+    def doupdate(self):
+        curses.doupdate()
+
+
+
+## ------------------------------------------------------------------------
+## VIRTUAL TERMINAL
+
+## Same interface, for a remote terminal: windows get drawn in memory and `doupdate()` sends the
+## cells that changed since the last update as ANSI escape sequences to `write(bytes)`.
+## Keys are fed w/ `feed_keys()` and read w/ `getch()` on any window.
+##
+## Unlike curses, several of those can coexist in a single process, one per connection.
+
+class VirtualTerminal():
+
+    def __init__(self, lines=24, cols=80, write=None):
+        self.lines = lines
+        self.cols = cols
+        self.write = write
+
+        self.keys = deque()
+
+        # NB: what the windows staged w/ `noutrefresh()` vs what was last sent
+        # `curscr` is None until the 1st update, which clears the remote screen
+        self.newscr = [[BLANK] * cols for _ in range(lines)]
+        self.curscr = None
+        self.cursor = (0, 0)
+
+        self.stats = {
+            'updates': 0,
+            'bytes': 0,
+        }
+
+    def newwin(self, nlines, ncols, begin_y, begin_x):
+        return VirtualWindow(self, nlines, ncols, begin_y, begin_x)
+
+    def feed_keys(self, keys):
+        self.keys.extend(keys)
+
+    def getch(self):
+        if self.keys:
+            return self.keys.popleft()
+        return curses.ERR
+
+    def doupdate(self):
+        out = []
+        if self.curscr is None:
+            out.append(ESC + '[0m' + ESC + '[H' + ESC + '[2J')
+            self.curscr = [[BLANK] * self.cols for _ in range(self.lines)]
+
+        attr = 0
+        for y in range(self.lines):
+            new_row = self.newscr[y]
+            cur_row = self.curscr[y]
+            if new_row == cur_row:
+                continue
+            x = 0
+            while x < self.cols:
+                if new_row[x] == cur_row[x]:
+                    x += 1
+                    continue
+                out.append(ESC + '[%d;%dH' % (y + 1, x + 1))
+                while x < self.cols and new_row[x] != cur_row[x]:
+                    (ch, a) = new_row[x]
+                    if a != attr:
+                        out.append(sgr(a))
+                        attr = a
+                    out.append(ch)
+                    x += 1
+            self.curscr[y] = list(new_row)
+        if attr != 0:
+            out.append(sgr(0))
+
+        (y, x) = self.cursor
+        out.append(ESC + '[%d;%dH' % (y + 1, x + 1))
+
+        data = ''.join(out).encode('utf-8', 'replace')
+        self.stats['updates'] += 1
+        self.stats['bytes'] += len(data)
+        if self.write is not None:
+            self.write(data)
+        return data
+
+
+def sgr(attr):
+    params = ['0'] + [p for a, p in SGR_ATTRS if attr & a]
+    return ESC + '[' + ';'.join(params) + 'm'
+
+
+
+## ------------------------------------------------------------------------
+## VIRTUAL WINDOW
+
+## Subset of the curses window API used by the screens and `Textbox`.
+## NB: writes past the edges get clipped instead of raising `curses.error`.
+
+class VirtualWindow():
+
+    def __init__(self, term, nlines, ncols, begin_y, begin_x):
+        self.term = term
+        self.nlines = nlines
+        self.ncols = ncols
+        self.begin_y = begin_y
+        self.begin_x = begin_x
+        self.cells = [[BLANK] * ncols for _ in range(nlines)]
+        self.y = 0
+        self.x = 0
+        self.is_keypad = False
+        self.is_nodelay = False
+
+    # -------------------
+    # GEOMETRY
+
+    def getmaxyx(self):
+        return (self.nlines, self.ncols)
+
+    def getbegyx(self):
+        return (self.begin_y, self.begin_x)
+
+    def getyx(self):
+        return (self.y, self.x)
+
+    def move(self, y, x):
+        if not (0 <= y < self.nlines and 0 <= x < self.ncols):
+            raise curses.error('move() returned ERR')
+        self.y = y
+        self.x = x
+
+    # -------------------
+    # OUTPUT
+
+    def put(self, ch, attr):
+        if self.y < self.nlines and self.x < self.ncols:
+            self.cells[self.y][self.x] = (ch, attr)
+        if self.x < self.ncols - 1:
+            self.x += 1
+        elif self.y < self.nlines - 1:
+            self.y += 1
+            self.x = 0
+
+    def addstr(self, *args):
+        # NB: ([y, x,] str[, attr])
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        s = args[0]
+        attr = args[1] if len(args) > 1 else 0
+        for ch in s:
+            if ch == '\n':
+                self.clrtoeol()
+                if self.y < self.nlines - 1:
+                    self.move(self.y + 1, 0)
+                continue
+            self.put(ch, attr)
+
+    def addch(self, *args):
+        # NB: ([y, x,] ch[, attr])
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        ch = args[0]
+        if isinstance(ch, int):
+            ch = chr(ch & 0xff)
+        attr = args[1] if len(args) > 1 else 0
+        self.put(ch, attr)
+
+    def insch(self, *args):
+        # NB: ([y, x,] ch[, attr]), cursor doesn't move
+        if len(args) >= 3:
+            self.move(args[0], args[1])
+            args = args[2:]
+        ch = args[0]
+        if isinstance(ch, int):
+            ch = chr(ch & 0xff)
+        attr = args[1] if len(args) > 1 else 0
+        row = self.cells[self.y]
+        row.insert(self.x, (ch, attr))
+        row.pop()
+
+    def delch(self, *args):
+        if args:
+            self.move(*args)
+        row = self.cells[self.y]
+        del row[self.x]
+        row.append(BLANK)
+
+    def inch(self, *args):
+        if args:
+            self.move(*args)
+        (ch, attr) = self.cells[self.y][self.x]
+        return ord(ch) | attr
+
+    def insertln(self):
+        self.cells.insert(self.y, [BLANK] * self.ncols)
+        self.cells.pop()
+
+    def deleteln(self):
+        del self.cells[self.y]
+        self.cells.append([BLANK] * self.ncols)
+
+    def clrtoeol(self):
+        row = self.cells[self.y]
+        row[self.x:] = [BLANK] * (self.ncols - self.x)
+
+    def clrtobot(self):
+        self.clrtoeol()
+        for y in range(self.y + 1, self.nlines):
+            self.cells[y] = [BLANK] * self.ncols
+
+    def erase(self):
+        self.cells = [[BLANK] * self.ncols for _ in range(self.nlines)]
+        self.y = 0
+        self.x = 0
+
+    def clear(self):
+        # NB: like curses, also repaints the whole terminal on next update
+        self.erase()
+        self.term.curscr = None
+
+    # -------------------
+    # REFRESH
+
+    def noutrefresh(self):
+        term = self.term
+        for y in range(min(self.nlines, term.lines - self.begin_y)):
+            row = self.cells[y]
+            ncols = min(self.ncols, term.cols - self.begin_x)
+            term.newscr[self.begin_y + y][self.begin_x:self.begin_x + ncols] = row[:ncols]
+        term.cursor = (min(self.begin_y + self.y, term.lines - 1), min(self.begin_x + self.x, term.cols - 1))
+
+    def refresh(self):
+        self.noutrefresh()
+        self.term.doupdate()
+
+    # -------------------
+    # INPUT
+
+    def keypad(self, flag):
+        # NB: keys are fed already decoded
+        self.is_keypad = flag
+
+    def nodelay(self, flag):
+        # NB: never blocks anyway, see `VirtualTerminal.feed_keys()`
+        self.is_nodelay = flag
+
+    def getch(self):
+        return self.term.getch()
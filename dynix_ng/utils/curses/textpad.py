@@ -12,7 +12,7 @@ import dynix_ng.utils.curses.ascii as ascii_ext
 class CustomTextbox(Textbox):
     """Wrapper around `Textbox` widget from curses.textpad.
 
-    Provides a modified `edit()` that takes into account `curses.halfdelay()`.
+    Provides a modified `edit()` that takes into account non-blocking input (`nodelay()`).
 
     Additionnally, enhances text inputs with:
     - extended DEL and BACKSPACE support
@@ -158,7 +158,7 @@ class CustomTextbox(Textbox):
         "Edit in the widget window and collect the results."
         while 1:
             ch = self.win.getch()
-            if ch == curses.ERR: # halfdelay
+            if ch == curses.ERR: # no more keys pending
                 return curses.ERR
             if validate:
                 ch = validate(ch)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import cProfile
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+from dynix_ng.utils.xdg import user_cache_dir
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: set to anything but '' or '0' to start w/ profiling on
+ENV_VAR = 'DYNIX_PROFILE'
+
+## NB: spans summed up in the overlay, (span name or prefix, label)
+OVERLAY_SPANS = [
+    ('recall', 'recall'),
+    ('calibre.fetch', 'sql'),
+    ('calibre.item_ids', 'ids'),
+    ('calibre.regexp', 'rx'),
+    ('calibre.group', 'group'),
+    ('archive', 'http'),
+    ('draw', 'draw'),
+]
+
+## NB: spans that don't make the overlay get repainted, or else drawing it would trigger a repaint
+OVERLAY_PASSIVE_SPANS = ['draw']
+
+TRACEMALLOC_FRAMES = 10
+
+
+
+## ------------------------------------------------------------------------
+## STATE
+
+## NB: spans of threads not bound to a scope, see `new_scope()`
+## {name: [nb of calls, total duration (s)]}
+spans = {}
+lock = threading.Lock()
+
+# NB: `scope` being the spans of the thread, e.g. of the search of a telnet session
+local = threading.local()
+
+enabled = False
+
+# NB: cProfile only sees the thread it got enabled from, i.e. the UI one
+profiler = None
+
+# NB: whether `enable()` started tracemalloc, as it may have been started by something else
+is_tracemalloc_started = False
+
+# NB: set by `request_dump()`, see `dump_if_requested()`
+is_dump_requested = False
+
+last_dump_path = None
+
+
+
+## ------------------------------------------------------------------------
+## SWITCH
+
+def enable():
+    global enabled, profiler, is_tracemalloc_started
+    if enabled:
+        return
+    reset()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # NB: another profiler is already active, e.g. when run under `python -m cProfile`
+        profiler = None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        is_tracemalloc_started = True
+    enabled = True
+
+
+def disable():
+    global enabled, profiler, is_tracemalloc_started
+    if not enabled:
+        return
+    enabled = False
+    if profiler is not None:
+        profiler.disable()
+        profiler = None
+    if is_tracemalloc_started:
+        tracemalloc.stop()
+        is_tracemalloc_started = False
+
+
+def toggle():
+    if enabled:
+        disable()
+    else:
+        enable()
+    return enabled
+
+
+def reset():
+    # NB: only the spans of the current scope, other sessions keep theirs
+    global last_dump_path
+    with lock:
+        current_spans().clear()
+    last_dump_path = None
+
+
+
+## ------------------------------------------------------------------------
+## SCOPES
+
+def new_scope():
+    # NB: spans of a search, so that concurrent sessions don't mix theirs up
+    # records of the current thread go there, until another scope gets bound
+    scope = {}
+    local.scope = scope
+    return scope
+
+
+def current_spans():
+    return getattr(local, 'scope', spans)
+
+
+def in_scope(fn):
+    # NB: for work done in another thread on behalf of the current one, e.g. `executor.submit(in_scope(fn))`
+    scope = current_spans()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous_scope = getattr(local, 'scope', None)
+        local.scope = scope
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if previous_scope is None:
+                del local.scope
+            else:
+                local.scope = previous_scope
+    return wrapper
+
+
+
+## ------------------------------------------------------------------------
+## SPANS
+
+def record(name, duration):
+    scope = current_spans()
+    with lock:
+        s = scope.get(name)
+        if s is None:
+            scope[name] = [1, duration]
+        else:
+            s[0] += 1
+            s[1] += duration
+
+
+@contextmanager
+def span(name):
+    # NB: ~free when disabled
+    # for code called per row, check `enabled` and call `record()` directly instead
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def breakdown():
+    # NB: [(label, nb of calls, total duration (s))], summed up per `OVERLAY_SPANS` entry
+    scope = current_spans()
+    with lock:
+        items = [(name, s[0], s[1]) for name, s in scope.items()]
+    res = []
+    for (prefix, label) in OVERLAY_SPANS:
+        matching = [(n, t) for (name, n, t) in items if name == prefix or name.startswith(prefix + '.')]
+        if matching:
+            res.append((label, sum(n for n, _ in matching), sum(t for _, t in matching)))
+    return res
+
+
+
+## ------------------------------------------------------------------------
+## OVERLAY
+
+def overlay_state():
+    # NB: changes whenever the overlay needs to be repainted
+    if not enabled:
+        return None
+    passive = tuple(label for (prefix, label) in OVERLAY_SPANS if prefix in OVERLAY_PASSIVE_SPANS)
+    return (tuple((label, n, round(t * 1000)) for (label, n, t) in breakdown() if label not in passive),
+            last_dump_path)
+
+
+def overlay_text(cols):
+    if last_dump_path is not None:
+        text = 'PROF dumped ' + last_dump_path
+    else:
+        text = 'PROF ' + ' '.join('%s=%.1fms/%d' % (label, t * 1000, n) for (label, n, t) in breakdown())
+    return text[:cols - 1]
+
+
+
+## ------------------------------------------------------------------------
+## DUMP
+
+def dump(dir_path=None):
+    # NB: returns the path prefix of the files written:
+    # - `.prof`: cProfile stats, for `python -m pstats` or snakeviz
+    # - `.tracemalloc`: memory snapshot, for `tracemalloc.Snapshot.load()`
+    # - `.spans.txt`: spans of the current scope, i.e. of the last search of the calling session
+    global last_dump_path
+    if dir_path is None:
+        dir_path = user_cache_dir('profiles')
+    path = os.path.join(dir_path, time.strftime('%Y%m%d-%H%M%S') + '-' + str(os.getpid()))
+
+    if profiler is not None:
+        # NB: stops it
+        profiler.dump_stats(path + '.prof')
+        profiler.enable()
+    if tracemalloc.is_tracing():
+        tracemalloc.take_snapshot().dump(path + '.tracemalloc')
+    scope = current_spans()
+    with lock:
+        items = sorted(scope.items(), key=lambda kv: -kv[1][1])
+    with open(path + '.spans.txt', 'w') as f:
+        for name, (n, t) in items:
+            f.write('%-32s %8d %12.3fms\n' % (name, n, t * 1000))
+
+    last_dump_path = path
+    return path
+
+
+def request_dump():
+    # NB: for signal handlers, which may interrupt a thread holding `lock`, so `dump()` would deadlock
+    global is_dump_requested
+    is_dump_requested = True
+
+
+def dump_if_requested():
+    # NB: to call from the main loop
+    global is_dump_requested
+    if not is_dump_requested:
+        return None
+    is_dump_requested = False
+    return dump()
+
+
+
+## ------------------------------------------------------------------------
+## INIT
+
+if os.environ.get(ENV_VAR, '') not in ('', '0'):
+    enable()
@@ -1,5 +1,35 @@
 #!/usr/bin/env python3
 
+import re
+
+import dynix_ng.utils.profiling as profiling
+
+
+
+# CONSTS
+
+## NB: same tokens as what `\w` delimits on the REGEXP path
+## apostrophe-joined words (e.g. "CAT'S", "O'BRIEN") get indexed both as a whole and per part
+WORD_RX = re.compile(r"\w+(?:'\w+)*")
+
+## NB: lowercase characters `re.IGNORECASE` matches alike, besides having the same lowercase
+## (as of Python 3.11, see `re._casefix`)
+CASE_EQUIVALENCES = [
+    (0x69, 0x131), (0x73, 0x17f), (0xb5, 0x3bc), (0x345, 0x3b9, 0x1fbe), (0x390, 0x1fd3), (0x3b0, 0x1fe3),
+    (0x3b2, 0x3d0), (0x3b5, 0x3f5), (0x3b8, 0x3d1), (0x3ba, 0x3f0), (0x3c0, 0x3d6), (0x3c1, 0x3f1),
+    (0x3c2, 0x3c3), (0x3c6, 0x3d5), (0x432, 0x1c80), (0x434, 0x1c81), (0x43e, 0x1c82), (0x441, 0x1c83),
+    (0x442, 0x1c84, 0x1c85), (0x44a, 0x1c86), (0x463, 0x1c87), (0x1c88, 0xa64b), (0x1e61, 0x1e9b),
+    (0xfb05, 0xfb06),
+]
+
+## NB: `str.lower()` applies full case mappings, `re` simple ones, which only differ for this character
+CASE_FOLD_PRE = {0x130: 'i'}
+CASE_FOLD = {c: chr(cs[0]) for cs in CASE_EQUIVALENCES for c in cs[1:]}
+
+## NB: ASCII characters `re.IGNORECASE` also matches w/ non-ASCII ones, which SQL `UPPER()` doesn't fold:
+## "İ" (U+0130) and "ı" (U+0131), "K" (U+212A Kelvin sign) and "ſ" (U+017F long s)
+SQL_PREFILTER_UNSAFE_RX = re.compile('[IKS]+')
+
 
 
 # USER-INPUT -> RECALL
@@ -20,17 +50,54 @@ def user_query_to_recall(query):
 
 # RECALL -> DB DIALECT
 
+## NB: SQL filter of a recall query, that still knows the query, for backends to answer it w/o SQL
+## e.g. counts from an in-memory index, see `CalibreDb.item_list()`
+class RecallWhere(str):
+
+    def __new__(cls, where, columns, query_terms):
+        res = super().__new__(cls, where)
+        res.columns = columns
+        res.query_terms = query_terms
+        return res
+
+
 def recall_to_db_dialect(db, columns, query_terms):
+    with profiling.span('recall'):
+        return backend_recall_to_db_dialect(db, columns, query_terms)
+
+
+def backend_recall_to_db_dialect(db, columns, query_terms):
     if db.BACKEND_TYPE == 'sql':
-        return recall_to_sql(columns, query_terms, db.BACKEND_DIALECT)
+        return RecallWhere(recall_to_sql_where(db, columns, query_terms), columns, query_terms)
     elif db.BACKEND_TYPE == 'lucene':
         return recall_to_lucene(columns, query_terms)
+    elif db.BACKEND_TYPE == 'federated':
+        # NB: `columns` is {backend name: columns}
+        return {name: backend_recall_to_db_dialect(backend, columns[name], query_terms)
+                for name, backend in db.backends.items()}
 
 
 
+def recall_to_sql_where(db, columns, query_terms):
+    if db.token_index_covers(columns):
+        lookups = recall_to_tokens(query_terms)
+        if lookups is not None:
+            return db.token_where(columns, lookups)
+    if db.fulltext_index_covers(columns):
+        match = recall_to_fts5(columns, query_terms)
+        if match is not None:
+            # NB: FTS5 splits words on apostrophes (e.g. "CAT'S" also matches "CAT-S" or "CAT S."),
+            # so its matches are only the candidates the REGEXP gets run on
+            return db.fulltext_where(match) + ' AND (' \
+                + recall_to_sql(columns, query_terms, db.BACKEND_DIALECT) + ')'
+    return recall_to_sql(columns, query_terms, db.BACKEND_DIALECT)
+
+
+
 # RECALL -> LUCENE
 
 def recall_to_lucene(columns, query_terms):
+    # NB: same semantics as `recall_to_python()`, i.e. a field matching all the terms
     archive_term_list = []
     for term in query_terms:
         ends_with_s = term[-1] == "S"
@@ -39,11 +106,13 @@ def recall_to_lucene(columns, query_terms):
             term = term.replace('?', '*')
         elif ends_with_s or ends_with_apostroph_s:
             if ends_with_apostroph_s:
-                term = term[-2:]
+                term_no_apostroph = term[:-2]
             else:
-                term = term[-1]
+                term_no_apostroph = term[:-1]
+            # NB: plural or possessive, as w/ `recall_term_to_rx()`
+            term = '(' + term_no_apostroph + "S OR " + term_no_apostroph + "'S)"
         archive_term_list.append(term)
-    v_filter = '(' +  ' OR '.join(archive_term_list) + ')'
+    v_filter = '(' +  ' AND '.join(archive_term_list) + ')'
 
     archive_query_filters = []
     for column in columns:
@@ -53,37 +122,176 @@ def recall_to_lucene(columns, query_terms):
 
 
 
-# RECALL -> SQL
+# RECALL -> TOKENS
 
-# https://stackoverflow.com/questions/5071601/how-do-i-use-regex-in-a-sqlite-query
+## NB: terms as lookups of normalized tokens, each matching exactly the items the REGEXP path does
 
-def recall_to_sql(columns, query_terms, sql_dialect):
-    (wb_l, wb_r) = sql_dialect_word_boundaries(sql_dialect)
-    wc = sql_dialect_word_character(sql_dialect)
-    is_case_sensitive = sql_dialect_is_case_sensitive(sql_dialect)
+def fold_case(s):
+    # NB: 2 strings are equal once folded iff they match each other w/ `re.IGNORECASE`
+    if s.isascii():
+        return s.lower()
+    return s.translate(CASE_FOLD_PRE).lower().translate(CASE_FOLD)
 
-    sql_rx_list = []
+
+def text_tokens(text):
+    tokens = set()
+    if not text:
+        return tokens
+    for word in WORD_RX.findall(fold_case(text)):
+        if "'" not in word:
+            tokens.add(word)
+            continue
+        parts = word.split("'")
+        for i in range(len(parts)):
+            for j in range(i + 1, len(parts) + 1):
+                tokens.add("'".join(parts[i:j]))
+    return tokens
+
+
+def is_valid_token(s):
+    return s != '' and WORD_RX.fullmatch(s) is not None
+
+
+def fold_token(token):
+    # NB: plural and possessive forms that a term ending w/ S matches alike, i.e. "CATS" and "CAT'S"
+    if token[-2:] == "'s":
+        return token[:-2] + "s"
+    return token
+
+
+def recall_term_to_token(term):
+    # NB: returns ('prefix', prefix) for truncated terms, to match against tokens
+    # ('folded', token) otherwise, to match against folded tokens
+    # ('token', token) for the rare plurals that only match one token, e.g. "CAT'S'" only matches "CAT'S"
+    # or None when the term can't be expressed as a single token
+    ends_with_s = term[-1] == "S"
+    ends_with_apostroph_s = term[-2:] in ("'S", "S'")
+
+    if '?' in term:
+        prefix = fold_case(term[:-1])
+        if term.index('?') != len(term) - 1 or not is_valid_token(prefix):
+            return None
+        return ('prefix', prefix)
+    elif ends_with_s or ends_with_apostroph_s:
+        if ends_with_apostroph_s:
+            term_no_apostroph = term[:-2]
+        else:
+            term_no_apostroph = term[:-1]
+        token = fold_case(term_no_apostroph) + "s"
+        if not is_valid_token(token):
+            return None
+        if fold_token(token) != token:
+            return ('token', token)
+        return ('folded', token)
+    token = fold_case(term)
+    if is_valid_token(token):
+        return ('folded', token)
+
+
+def recall_to_tokens(query_terms):
+    # NB: returns [(kind, token)], one per term, all of them having to match in the same column
+    if not query_terms:
+        return None
+    lookups = [recall_term_to_token(term) for term in query_terms]
+    if None in lookups:
+        return None
+    return lookups
+
+
+
+# RECALL -> FTS5
+
+# https://www.sqlite.org/fts5.html#full_text_query_syntax
+
+def fts5_phrase(s):
+    # NB: case-folded as the indexed text is, see `dynix_ng.library.index.fts`
+    s = fold_case(s)
+    return '"' + s.replace('"', '""') + '"'
+
+
+def recall_to_fts5(columns, query_terms):
+    fts_term_list = []
     for term in query_terms:
+        # NB: w/o any word character, the FTS5 tokenizer would produce an empty phrase
+        if not any(c.isalnum() or c == '_' for c in term):
+            return None
+
         ends_with_s = term[-1] == "S"
         ends_with_apostroph_s = term[-2:] in ("'S", "S'")
 
-        if term[-1] == '?':
-            term = term.replace('?', wc + '*')
-            rx = "'.*" + wb_l + term + wb_r + ".*'"
+        if '?' in term:
+            # NB: FTS5 only supports prefix queries, not inner wildcards
+            if term.index('?') != len(term) - 1:
+                return None
+            fts_term = fts5_phrase(term[:-1]) + ' *'
         elif ends_with_s or ends_with_apostroph_s:
             if ends_with_apostroph_s:
-                term_no_apostroph = term[-2:]
+                term_no_apostroph = term[:-2]
             else:
-                term_no_apostroph = term[-1]
-            rx = "'.*" + wb_l + term_no_apostroph +  + "('S|S)" + wb_r + "S?.*'"
+                term_no_apostroph = term[:-1]
+            fts_term = '(' + fts5_phrase(term_no_apostroph + "S") \
+                + ' OR ' + fts5_phrase(term_no_apostroph + "'S") + ')'
         else:
-            rx = "'.*" + wb_l + term + wb_r + ".*'"
+            fts_term = fts5_phrase(term)
+
+        fts_term_list.append(fts_term)
+
+    fts_query_filters = []
+    for column in columns:
+        fts_query_filters.append(column + ' : (' + ' AND '.join(fts_term_list) + ')')
+
+    return ' OR '.join(fts_query_filters)
+
+
+
+# RECALL -> SQL
+
+# https://stackoverflow.com/questions/5071601/how-do-i-use-regex-in-a-sqlite-query
+
+def recall_term_to_rx(term, wb_l=r'\b', wb_r=r'\b', wc=r'\w'):
+    # NB: returns (rx, literal), `literal` being a substring all matches contain
+    ends_with_s = term[-1] == "S"
+    ends_with_apostroph_s = term[-2:] in ("'S", "S'")
+
+    if term[-1] == '?':
+        literal = term[:term.index('?')]
+        term = term.replace('?', wc + '*')
+        rx = ".*" + wb_l + term + wb_r + ".*"
+    elif ends_with_s or ends_with_apostroph_s:
+        if ends_with_apostroph_s:
+            term_no_apostroph = term[:-2]
+        else:
+            term_no_apostroph = term[:-1]
+        literal = term_no_apostroph
+        rx = ".*" + wb_l + term_no_apostroph + "('S|S)" + wb_r + "S?.*"
+    else:
+        literal = term
+        rx = ".*" + wb_l + term + wb_r + ".*"
+
+    return (rx, literal)
 
-        sql_rx_list.append(rx)
+
+def recall_to_sql(columns, query_terms, sql_dialect):
+    (wb_l, wb_r) = sql_dialect_word_boundaries(sql_dialect)
+    wc = sql_dialect_word_character(sql_dialect)
+    is_case_sensitive = sql_dialect_is_case_sensitive(sql_dialect)
+
+    sql_rx_list = []
+    sql_literal_list = []
+    for term in query_terms:
+        (rx, literal) = recall_term_to_rx(term, wb_l, wb_r, wc)
+        sql_rx_list.append(sql_quote(rx))
+        literal = sql_prefilter_literal(literal)
+        if literal is not None:
+            sql_literal_list.append(sql_quote(literal))
 
     sql_query_filters = []
     for column in columns:
         sql_col_filters = []
+        # NB: cheap native substring prefilters come first so that the costly REGEXP callback
+        # only gets called on candidate rows
+        for literal in sql_literal_list:
+            sql_col_filters.append("instr(UPPER(" + column + "), " + literal + ") > 0")
         if is_case_sensitive:
             column = 'UPPER(' + column + ')'
         for rx in sql_rx_list:
@@ -93,6 +301,23 @@ def recall_to_sql(columns, query_terms, sql_dialect):
     return ' OR '.join(sql_query_filters)
 
 
+def sql_quote(s):
+    return "'" + s.replace("'", "''") + "'"
+
+
+def sql_prefilter_literal(literal):
+    # NB: SQL `UPPER()` only folds ASCII and a regex metacharacter would not match itself,
+    # so other literals would make the prefilter stricter than the REGEXP
+    if literal == '' \
+       or not all(('A' <= c <= 'Z') or ('0' <= c <= '9') or c in "_' " for c in literal):
+        return None
+    # NB: longest part w/o characters that may be spelled w/ non-ASCII ones, e.g. "TANBUL" for "ISTANBUL"
+    literal = max(SQL_PREFILTER_UNSAFE_RX.split(literal), key=len)
+    if literal == '':
+        return None
+    return literal
+
+
 def sql_dialect_word_boundaries(dialect):
     default_v = (r'\b', r'\b')
     return {
@@ -115,3 +340,24 @@ def sql_dialect_is_case_sensitive(dialect):
         'sqlite3': False,
         'mysql': False,
     }.get(dialect, default_v)
+
+
+
+# RECALL -> PYTHON
+
+## NB: same semantics as the SQL REGEXP path, for filtering items already in memory
+
+def recall_to_python(columns, query_terms):
+    rx_list = [re.compile(recall_term_to_rx(term)[0], re.IGNORECASE) for term in query_terms]
+
+    def item_matches(values):
+        # NB: `values` is {column: text}
+        for column in columns:
+            v = values.get(column)
+            if v is None:
+                continue
+            if all(rx.match(v) is not None for rx in rx_list):
+                return True
+        return False
+
+    return item_matches
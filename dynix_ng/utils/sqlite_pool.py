@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import sqlite3
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## NB: max nb of queries running at once, SQLite releases the GIL while stepping through a query
+POOL_SIZE = min(8, (os.cpu_count() or 1) + 1)
+
+## NB: how long to wait for a connection when they are all in use
+ACQUIRE_TIMEOUT = 30
+
+## NB: per connection
+MMAP_SIZE = 256 * 2**20
+CACHE_SIZE_KIB = 16 * 2**10
+CACHED_STATEMENTS = 256
+
+
+
+## NB: handed over to a waiting thread in place of a connection, for it to open one
+CONNECT = object()
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def sqlite3_uri(path, mode=None):
+    uri = 'file:' + pathname2url(os.path.abspath(path))
+    if mode:
+        uri += '?mode=' + mode
+    return uri
+
+
+
+## ------------------------------------------------------------------------
+## POOL
+
+## Read-only connections to a SQLite db, shared by threads.
+## Connections get opened lazily, up to `size`, which caps the nb of concurrent queries.
+## `on_connect(cnnx)` gets called on each new connection, e.g. to register functions.
+
+class SqlitePool():
+
+    def __init__(self, db_path, size=POOL_SIZE, on_connect=None,
+                 mmap_size=MMAP_SIZE, cache_size_kib=CACHE_SIZE_KIB, cached_statements=CACHED_STATEMENTS,
+                 acquire_timeout=ACQUIRE_TIMEOUT):
+        self.uri = sqlite3_uri(db_path, 'ro')
+        self.size = size
+        self.on_connect = on_connect
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.cached_statements = cached_statements
+        self.acquire_timeout = acquire_timeout
+
+        # NB: LIFO, the most recently used connection has the warmest cache
+        self.idle = []
+        self.waiters = deque()
+        self.nb_connections = 0
+        # NB: {thread id: connections}, for `interrupt()`
+        self.in_use = {}
+        # NB: bumped by `reset()`, connections of older generations get closed once returned
+        self.generation = 0
+        self.generations = {}
+
+        self.condition = threading.Condition()
+
+        self.stats = {
+            'connections': 0,
+            'acquires': 0,
+            'waits': 0,
+        }
+
+    def connect(self):
+        cnnx = sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        cnnx.execute('PRAGMA query_only = ON')
+        cnnx.execute('PRAGMA mmap_size = ' + str(int(self.mmap_size)))
+        # NB: negative values are in KiB
+        cnnx.execute('PRAGMA cache_size = ' + str(-int(self.cache_size_kib)))
+        if self.on_connect is not None:
+            self.on_connect(cnnx)
+        return cnnx
+
+    def acquire(self):
+        thread_id = threading.get_ident()
+        with self.condition:
+            self.stats['acquires'] += 1
+            cnnx = None
+            if self.idle and not self.waiters:
+                cnnx = self.idle.pop()
+            elif self.nb_connections < self.size:
+                # NB: reserved before connecting, outside of the lock
+                self.nb_connections += 1
+            else:
+                # NB: first come, first served, so that a thread looping over queries doesn't starve others
+                self.stats['waits'] += 1
+                waiter = [None]
+                self.waiters.append(waiter)
+                if not self.condition.wait_for(lambda: waiter[0] is not None, self.acquire_timeout):
+                    self.waiters.remove(waiter)
+                    raise sqlite3.OperationalError('timed out waiting for a connection')
+                cnnx = waiter[0]
+                if cnnx is CONNECT:
+                    cnnx = None
+            generation = self.generation
+
+        if cnnx is None:
+            try:
+                cnnx = self.connect()
+            except Exception:
+                with self.condition:
+                    self.nb_connections -= 1
+                    self.__hand_over(None)
+                raise
+            with self.condition:
+                self.stats['connections'] += 1
+                self.generations[id(cnnx)] = generation
+
+        with self.condition:
+            self.in_use.setdefault(thread_id, []).append(cnnx)
+        return cnnx
+
+    def __hand_over(self, cnnx):
+        # NB: gives `cnnx` to the 1st waiting thread, if any
+        # w/ None (connection closed), it gets to open a new one instead
+        if not self.waiters:
+            if cnnx is not None:
+                self.idle.append(cnnx)
+            return
+        if cnnx is None:
+            self.nb_connections += 1
+            cnnx = CONNECT
+        waiter = self.waiters.popleft()
+        waiter[0] = cnnx
+        self.condition.notify_all()
+
+    def release(self, cnnx):
+        thread_id = threading.get_ident()
+        with self.condition:
+            thread_cnnxs = self.in_use.get(thread_id, [])
+            if cnnx in thread_cnnxs:
+                thread_cnnxs.remove(cnnx)
+            if not thread_cnnxs:
+                self.in_use.pop(thread_id, None)
+            if self.generations.get(id(cnnx)) != self.generation:
+                self.generations.pop(id(cnnx), None)
+                self.nb_connections -= 1
+                cnnx.close()
+                cnnx = None
+            self.__hand_over(cnnx)
+
+    @contextmanager
+    def connection(self):
+        cnnx = self.acquire()
+        try:
+            yield cnnx
+        finally:
+            # NB: an interrupted query leaves no open transaction behind in read-only mode
+            self.release(cnnx)
+
+    def interrupt(self, thread_id=None):
+        # NB: aborts queries running on behalf of `thread_id`, or all of them
+        with self.condition:
+            if thread_id is None:
+                cnnxs = [c for thread_cnnxs in self.in_use.values() for c in thread_cnnxs]
+            else:
+                cnnxs = list(self.in_use.get(thread_id, []))
+        for cnnx in cnnxs:
+            cnnx.interrupt()
+
+    def reset(self):
+        # NB: connections get re-opened (and `on_connect()` called again) before their next use
+        with self.condition:
+            self.generation += 1
+            idle = self.idle
+            self.idle = []
+            for cnnx in idle:
+                self.generations.pop(id(cnnx), None)
+                self.nb_connections -= 1
+            self.condition.notify_all()
+        for cnnx in idle:
+            cnnx.close()
+
+    def close(self):
+        self.reset()
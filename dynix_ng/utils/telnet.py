@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import curses
+import curses.ascii
+
+import dynix_ng.utils.curses.ascii as ascii_ext
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+## https://www.rfc-editor.org/rfc/rfc854
+
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+OPT_ECHO = 1
+OPT_SGA = 3
+OPT_NAWS = 31
+
+## NB: character mode, the server echoes, and the client reports its window size (RFC 1073)
+NEGOTIATION = bytes([IAC, WILL, OPT_ECHO,
+                     IAC, WILL, OPT_SGA,
+                     IAC, DO, OPT_NAWS])
+
+## NB: escape sequences -> curses keys
+ESCAPE_SEQUENCES = {
+    b'\x1b[A': curses.KEY_UP,
+    b'\x1b[B': curses.KEY_DOWN,
+    b'\x1b[C': curses.KEY_RIGHT,
+    b'\x1b[D': curses.KEY_LEFT,
+    b'\x1bOA': curses.KEY_UP,
+    b'\x1bOB': curses.KEY_DOWN,
+    b'\x1bOC': curses.KEY_RIGHT,
+    b'\x1bOD': curses.KEY_LEFT,
+    b'\x1b[3~': ascii_ext.DEL,
+}
+
+
+
+## ------------------------------------------------------------------------
+## DECODER
+
+## Strips the telnet protocol out of the byte stream and turns what remains into curses key codes.
+
+class TelnetDecoder():
+
+    def __init__(self):
+        self.state = 'data'
+        self.command = None
+        self.subnegotiation = bytearray()
+        self.escape = b''
+        self.is_after_cr = False
+
+        # NB: (lines, cols), once reported by the client
+        self.window_size = None
+
+    def feed(self, data):
+        keys = []
+        for b in data:
+            if self.state == 'data':
+                if b == IAC:
+                    self.state = 'iac'
+                else:
+                    self.feed_byte(b, keys)
+            elif self.state == 'iac':
+                if b == IAC:
+                    # NB: escaped 0xff
+                    self.state = 'data'
+                    self.feed_byte(b, keys)
+                elif b in (WILL, WONT, DO, DONT):
+                    self.command = b
+                    self.state = 'option'
+                elif b == SB:
+                    self.subnegotiation = bytearray()
+                    self.state = 'sb'
+                else:
+                    self.state = 'data'
+            elif self.state == 'option':
+                # NB: what we asked for, nothing to answer
+                self.state = 'data'
+            elif self.state == 'sb':
+                if b == IAC:
+                    self.state = 'sb_iac'
+                else:
+                    self.subnegotiation.append(b)
+            elif self.state == 'sb_iac':
+                if b == SE:
+                    self.handle_subnegotiation(bytes(self.subnegotiation))
+                    self.state = 'data'
+                else:
+                    self.subnegotiation.append(b)
+                    self.state = 'sb'
+        return keys
+
+    def handle_subnegotiation(self, sb):
+        if len(sb) == 5 and sb[0] == OPT_NAWS:
+            cols = (sb[1] << 8) + sb[2]
+            lines = (sb[3] << 8) + sb[4]
+            if lines and cols:
+                self.window_size = (lines, cols)
+
+    def feed_byte(self, b, keys):
+        # NB: <Return> is sent as CR LF or CR NUL
+        if self.is_after_cr:
+            self.is_after_cr = False
+            if b in (curses.ascii.NL, curses.ascii.NUL):
+                return
+        if b == curses.ascii.CR:
+            self.is_after_cr = True
+            b = curses.ascii.NL
+
+        if self.escape or b == curses.ascii.ESC:
+            self.escape += bytes([b])
+            if self.escape in ESCAPE_SEQUENCES:
+                keys.append(ESCAPE_SEQUENCES[self.escape])
+                self.escape = b''
+            elif not any(seq.startswith(self.escape) for seq in ESCAPE_SEQUENCES):
+                # NB: not a known sequence, e.g. Alt + key
+                keys.extend(self.escape)
+                self.escape = b''
+            return
+
+        keys.append(b)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import os
+from os.path import expanduser
+
+
+
+## ------------------------------------------------------------------------
+## CONSTS
+
+APP_NAME = 'dynix-ng'
+
+
+
+## ------------------------------------------------------------------------
+## DIRS
+
+def user_cache_dir(*subdirs):
+    base = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    path = os.path.join(base, APP_NAME, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
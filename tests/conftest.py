@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import sqlite3
+
+import pytest
+
+tests_path = os.path.dirname(os.path.realpath(__file__))
+module_path = os.path.abspath(tests_path + '/..')
+bench_path = os.path.join(module_path, 'benchmarks')
+for path in (module_path, bench_path):
+    if path not in sys.path:
+        sys.path.append(path)
+
+from synth_calibre import generate
+from archive_stub import start_stub_server
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+NB_BOOKS = 2000
+
+NB_ARCHIVE_DOCS = 1000
+
+## NB: titles the recall rules are the most likely to get wrong on: apostrophes and plurals, case folding
+## outside of ASCII (KELVIN SIGN, dotted I, long s, sharp s, ligatures), digits, underscores and punctuation
+EDGE_TITLES = [
+    "The Cat's Cradle",
+    "CATS'S PAJAMAS",
+    "O'Brien's cats",
+    "Jo'brien",
+    "Cats' Eyes",
+    "cat-s cats' catss",
+    "naïve CAT'S'S",
+    "x's",
+    "S",
+    "'S ' S'",
+    "don't stop",
+    "L'ÉTRANGER",
+    "R2-D2's droids",
+    "İstanbul",
+    "\u212aey Largo",
+    "Miſsissippi ſmith",
+    "Straße und Öl",
+    "ﬁsh ligature",
+    "Ǆemal",
+    "ΣΟΦΙΑ σοφίας",
+    "café_au_lait 1984",
+    "C++ primer",
+    "In",
+    "A And A The",
+    "  ",
+    "",
+]
+
+
+
+## ------------------------------------------------------------------------
+## FIXTURES
+
+def add_edge_titles(db_path, titles=EDGE_TITLES):
+    cnnx = sqlite3.connect(db_path)
+    cnnx.executemany('INSERT INTO books (title, sort) VALUES (?, ?)', [(t, t) for t in titles])
+    cnnx.commit()
+    cnnx.close()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def cache_dir(tmp_path_factory):
+    # NB: sidecar indices go to the user cache dir
+    path = tmp_path_factory.mktemp('cache')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('XDG_CACHE_HOME', str(path))
+        yield path
+
+
+@pytest.fixture(scope='session')
+def synth_library(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp('library') / 'metadata.db')
+    generate(db_path, NB_BOOKS)
+    add_edge_titles(db_path)
+    return db_path
+
+
+@pytest.fixture
+def archive_stub():
+    # NB: local stand-in for archive.org, w/ per test request stats
+    server = start_stub_server(nb_docs=NB_ARCHIVE_DOCS)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+## `ArchiveOrgApi` HTTP client against a local stub: connection reuse, retries, timeouts and response cache.
+
+import pytest
+import requests
+
+from archive_stub import start_stub_server, doc_matches
+
+from dynix_ng.library.backend.archive import ArchiveOrgApi
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+QUERIES = ['WAR', 'CAT?', 'GONE WIND', 'STARS']
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def title_where(backend, user_query):
+    return recall.recall_to_db_dialect(backend, ['title'], recall.user_query_to_recall(user_query))
+
+
+def expected_count(server, where):
+    return sum(1 for d in server.stub['docs'] if doc_matches(d, where))
+
+
+def search(backend, user_query):
+    # NB: same requests as the UI: a count, then the 1st page of results
+    where = title_where(backend, user_query)
+    count = backend.item_list(fetch_format='count', where=where)
+    items = backend.item_list(fetch_mode='all', fetch_format='k_v', where=where, limit=8, summary=True)
+    return (count, items)
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_search(archive_stub):
+    backend = ArchiveOrgApi(url_prefix=archive_stub.url_prefix, cache=False)
+    for user_query in QUERIES:
+        where = title_where(backend, user_query)
+        (count, items) = search(backend, user_query)
+        assert count == expected_count(archive_stub, where)
+        assert len(items) == min(count, 8)
+        for item in items.values():
+            assert isinstance(item['authors'], list)
+    backend.close()
+
+
+def test_connection_reuse(archive_stub):
+    backend = ArchiveOrgApi(url_prefix=archive_stub.url_prefix, cache=False)
+    for user_query in QUERIES:
+        search(backend, user_query)
+    stats = archive_stub.stub['stats']
+    assert stats['requests'] == 2 * len(QUERIES)
+    assert stats['connections'] == 1
+    backend.close()
+
+
+def test_gzip(archive_stub):
+    backend = ArchiveOrgApi(url_prefix=archive_stub.url_prefix, cache=False)
+    assert 'gzip' in backend.http.headers['Accept-Encoding']
+    where = title_where(backend, 'THE')
+    raw_res = backend.search_raw(where, nb_items=50, returned_fields=backend.SUMMARY_RETURNED_FIELDS)
+    assert len(raw_res['response']['docs']) == 50
+    # NB: way less than the JSON itself
+    assert archive_stub.stub['stats']['bytes_sent'] < len(repr(raw_res)) / 2
+    backend.close()
+
+
+def test_retries():
+    # NB: every 3rd request answered w/ a 503
+    server = start_stub_server(nb_docs=100, fail_every=3)
+    backend = ArchiveOrgApi(url_prefix=server.url_prefix, backoff_factor=0, cache=False)
+    for user_query in QUERIES:
+        where = title_where(backend, user_query)
+        (count, _) = search(backend, user_query)
+        assert count == expected_count(server, where)
+    assert server.stub['stats']['failures'] > 0
+    backend.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_retries_exhausted():
+    server = start_stub_server(nb_docs=100, fail_every=1)
+    backend = ArchiveOrgApi(url_prefix=server.url_prefix, max_retries=2, backoff_factor=0, cache=False)
+    with pytest.raises(requests.HTTPError):
+        search(backend, 'WAR')
+    # NB: 1st try + retries
+    assert server.stub['stats']['requests'] == 3
+    backend.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_read_timeout():
+    server = start_stub_server(nb_docs=100, latency=0.5)
+    backend = ArchiveOrgApi(url_prefix=server.url_prefix, timeout=(1, 0.1), max_retries=0, cache=False)
+    with pytest.raises(requests.RequestException):
+        search(backend, 'WAR')
+    backend.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_cache(archive_stub, tmp_path):
+    cache_path = str(tmp_path / 'responses.db')
+    backend = ArchiveOrgApi(url_prefix=archive_stub.url_prefix, cache_path=cache_path)
+    res = search(backend, 'WAR')
+    assert archive_stub.stub['stats']['requests'] == 2
+    assert search(backend, 'WAR') == res
+    assert archive_stub.stub['stats']['requests'] == 2
+    backend.close()
+
+    # NB: as after a restart
+    backend = ArchiveOrgApi(url_prefix=archive_stub.url_prefix, cache_path=cache_path)
+    assert search(backend, 'WAR') == res
+    assert archive_stub.stub['stats']['requests'] == 2
+    backend.close()
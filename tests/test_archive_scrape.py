@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+## `ArchiveOrgApi.item_stream()` against a local stub serving a multi-page corpus through the scrape API cursor.
+
+import math
+import time
+
+from archive_stub import doc_matches
+
+from dynix_ng.library.backend.archive import ArchiveOrgApi
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+## NB: less than the real API accepts, for the stub corpus to span several pages
+PAGE_SIZE = 20
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def make_backend(server):
+    return ArchiveOrgApi(url_prefix=server.url_prefix, scrape_url_prefix=server.scrape_url_prefix, cache=False)
+
+
+def title_where(backend, user_query):
+    return recall.recall_to_db_dialect(backend, ['title'], recall.user_query_to_recall(user_query))
+
+
+def expected_ids(server, where):
+    return [d['identifier'] for d in server.stub['docs'] if doc_matches(d, where)]
+
+
+def wait_for_requests(server, nb_requests, timeout=5):
+    deadline = time.monotonic() + timeout
+    while server.stub['stats']['requests'] < nb_requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.stub['stats']['requests']
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_stream_all_pages(archive_stub):
+    backend = make_backend(archive_stub)
+    where = title_where(backend, 'THE')
+    expected = expected_ids(archive_stub, where)
+    assert len(expected) > 3 * PAGE_SIZE
+
+    items = list(backend.item_stream(where, summary=True, page_size=PAGE_SIZE))
+    assert [item['item_id'] for item in items] == expected
+    # NB: no cursor on the last page
+    assert archive_stub.stub['stats']['requests'] == math.ceil(len(expected) / PAGE_SIZE)
+    backend.close()
+
+
+def test_stream_normalized_items(archive_stub):
+    backend = make_backend(archive_stub)
+    where = title_where(backend, 'WAR')
+    for item in backend.item_stream(where, summary=True, page_size=PAGE_SIZE):
+        assert isinstance(item['authors'], list)
+        assert item['name'] != 'unknown'
+        assert 'WAR' in item['name'].upper().split()
+    backend.close()
+
+
+def test_stream_empty(archive_stub):
+    backend = make_backend(archive_stub)
+    assert list(backend.item_stream(title_where(backend, 'ZYZZYVA'), page_size=PAGE_SIZE)) == []
+    assert archive_stub.stub['stats']['requests'] == 1
+    backend.close()
+
+
+def test_stream_reads_ahead(archive_stub):
+    backend = make_backend(archive_stub)
+    stream = backend.item_stream(title_where(backend, 'THE'), summary=True, page_size=PAGE_SIZE)
+    next(stream)
+    # NB: 2nd page requested while the 1st one gets consumed
+    assert wait_for_requests(archive_stub, 2) == 2
+    stream.close()
+    backend.close()
+
+
+def test_stream_abandoned(archive_stub):
+    backend = make_backend(archive_stub)
+    stream = backend.item_stream(title_where(backend, 'THE'), summary=True, page_size=PAGE_SIZE)
+    for _ in range(PAGE_SIZE + 1):
+        next(stream)
+    stream.close()
+    # NB: at most the page after the one being consumed
+    time.sleep(0.2)
+    assert archive_stub.stub['stats']['requests'] <= 3
+    backend.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+## Federated counts: a slow backend doesn't hold the others'.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dynix_ng.library.backend.federated import FederatedBackend, COUNT_WORKERS_PER_BACKEND
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+class CountingBackend():
+
+    def __init__(self, count, is_released=None):
+        self.count = count
+        self.is_released = is_released
+
+    def item_list(self, fetch_mode='iter', fetch_format='v', where=None, **kwargs):
+        if self.is_released is not None:
+            self.is_released.wait(10)
+        return self.count
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_count_not_held_by_slow_backend():
+    is_released = threading.Event()
+    db = FederatedBackend({'local': CountingBackend(3), 'remote': CountingBackend(5, is_released)})
+    try:
+        # NB: sessions waiting on the remote backend, as many as its workers
+        with ThreadPoolExecutor(max_workers=COUNT_WORKERS_PER_BACKEND) as sessions:
+            stuck = [sessions.submit(db.item_list, fetch_format='count', where={'remote': ''})
+                     for _ in range(COUNT_WORKERS_PER_BACKEND)]
+
+            assert db.item_list(fetch_format='count', where={'local': ''}) == 3
+
+            is_released.set()
+            assert [f.result() for f in stuck] == [5] * COUNT_WORKERS_PER_BACKEND
+    finally:
+        is_released.set()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+## Sidecar indices that fail to sync are only bypassed until the next `refresh()` retries them.
+
+import os
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+from dynix_ng.library.backend.calibre import CalibreDb, INDEX_SYNC_EXECUTOR
+import dynix_ng.library.index.bitmap as bitmap
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## FIXTURES
+
+@pytest.fixture
+def library(synth_library, tmp_path):
+    # NB: a copy, as it gets modified
+    db_path = str(tmp_path / 'metadata.db')
+    shutil.copy(synth_library, db_path)
+    return db_path
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def rename_book(db_path, book_id, title):
+    cnnx = sqlite3.connect(db_path)
+    cnnx.execute("UPDATE books SET title = ?, last_modified = '2100-01-01 00:00:00+00:00' WHERE id = ?",
+                 (title, book_id))
+    cnnx.commit()
+    cnnx.close()
+    # NB: for the change to be seen even w/ a coarse mtime resolution
+    st = os.stat(db_path)
+    os.utime(db_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+
+def title_where(db, query_terms):
+    return recall.recall_to_db_dialect(db, ['title'], query_terms)
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_initial_sync_in_background(library):
+    # NB: holds the sync worker, as the indices of a small library get built in no time
+    is_released = threading.Event()
+    INDEX_SYNC_EXECUTOR.submit(is_released.wait, 10)
+    try:
+        db = CalibreDb(library)
+        assert not db.fts_index.is_current and not db.token_index.is_current
+        where = title_where(db, ['WAR'])
+        assert 'calibre_' not in where
+        nb_matches = len(db.item_ids(where=where))
+    finally:
+        is_released.set()
+
+    db.sync_indices()
+    where = title_where(db, ['WAR'])
+    assert 'calibre_tokens' in where
+    assert len(db.item_ids(where=where)) == nb_matches
+    db.close()
+
+
+@pytest.mark.parametrize('index_attr, schema_name, db_kwargs', [
+    ('fts_index', 'calibre_fts', {'token_index': False}),
+    ('token_index', 'calibre_tokens', {'fts_index': False}),
+])
+def test_failed_sync_gets_retried(library, index_attr, schema_name, db_kwargs):
+    db = CalibreDb(library, **db_kwargs)
+    index = getattr(db, index_attr)
+    assert index is not None
+    db.sync_indices()
+    assert schema_name in title_where(db, ['WAR'])
+
+    def failing_sync():
+        raise sqlite3.OperationalError('database is locked')
+    index.sync = failing_sync
+
+    rename_book(library, 1, 'Zyzzyva')
+    db.sync_indices()
+    # NB: still there, but bypassed as it lacks the change
+    assert getattr(db, index_attr) is index
+    assert schema_name not in title_where(db, ['ZYZZYVA'])
+    assert len(db.item_ids(where=title_where(db, ['ZYZZYVA']))) == 1
+
+    del index.sync
+    db.sync_indices()
+    assert schema_name in title_where(db, ['ZYZZYVA'])
+    assert len(db.item_ids(where=title_where(db, ['ZYZZYVA']))) == 1
+    db.close()
+
+
+@pytest.mark.parametrize('index_attr, schema_name, db_kwargs', [
+    ('fts_index', 'calibre_fts', {'token_index': False}),
+    ('token_index', 'calibre_tokens', {'fts_index': False}),
+])
+def test_author_rename_gets_synced(library, index_attr, schema_name, db_kwargs):
+    db = CalibreDb(library, **db_kwargs)
+    db.sync_indices()
+    regexp_db = CalibreDb(library, fts_index=False, token_index=False)
+
+    # NB: w/o `books.last_modified` changing, nor the length of the name
+    cnnx = sqlite3.connect(library)
+    cnnx.execute("UPDATE authors SET name = 'Mark Twein' WHERE name = 'Mark Twain'")
+    cnnx.commit()
+    cnnx.close()
+    st = os.stat(library)
+    os.utime(library, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+    db.sync_indices()
+    for term in ['TWEIN', 'TWAIN', 'MARK']:
+        where = recall.recall_to_db_dialect(db, ['author'], [term])
+        assert schema_name in where
+        assert db.item_ids(where=where) \
+            == regexp_db.item_ids(where=recall.recall_to_sql(['author'], [term], regexp_db.BACKEND_DIALECT))
+    assert db.item_ids(where=recall.recall_to_db_dialect(db, ['author'], ['TWEIN']))
+    regexp_db.close()
+    db.close()
+
+
+def test_bitmap_index_rebuilt_in_background(library):
+    if not bitmap.is_available():
+        pytest.skip('numpy not available')
+    db = CalibreDb(library, fts_index=False, token_index=False, bitmap_index=True)
+    db.sync_indices()
+    index = db.bitmap_index
+    assert db.bitmap_index_covers(['title'])
+
+    rename_book(library, 1, 'Zyzzyva')
+    is_released = threading.Event()
+    INDEX_SYNC_EXECUTOR.submit(is_released.wait, 10)
+    try:
+        assert db.refresh()
+        # NB: bypassed until rebuilt, as it lacks the change
+        assert not db.bitmap_index_covers(['title'])
+        assert len(db.term_item_ids('title', 'ZYZZYVA')) == 1
+        where = title_where(db, ['ZYZZYVA'])
+        assert db.item_list(fetch_mode='first', fetch_format='count', where=where) == 1
+    finally:
+        is_released.set()
+
+    db.sync_indices()
+    assert db.bitmap_index is not index
+    assert db.bitmap_index_covers(['title'])
+    assert len(db.term_item_ids('title', 'ZYZZYVA')) == 1
+    db.close()
+
+
+def test_token_index_current_once_terms_loaded(library, monkeypatch):
+    db = CalibreDb(library, fts_index=False)
+    db.sync_indices()
+    index = db.token_index
+    load_terms = index.load_terms
+    is_current_while_loading = []
+
+    def spied_load_terms():
+        is_current_while_loading.append(index.is_current)
+        return load_terms()
+    monkeypatch.setattr(index, 'load_terms', spied_load_terms)
+
+    rename_book(library, 1, 'Zyzzyva')
+    db.refresh()
+    db.sync_indices()
+    assert is_current_while_loading == [False]
+    assert index.is_current
+    assert index.terms.expand('title', 'zyzz')[0] == ['zyzzyva']
+    db.close()
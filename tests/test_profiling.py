@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+## Profiling spans: kept per search, so that concurrent sessions don't reset or mix up each other's.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import dynix_ng.utils.profiling as profiling
+
+
+
+## ------------------------------------------------------------------------
+## FIXTURES
+
+@pytest.fixture
+def enabled():
+    was_enabled = profiling.enabled
+    profiling.enabled = True
+    yield
+    profiling.enabled = was_enabled
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_sessions_keep_their_spans(enabled):
+    has_counted = threading.Event()
+    has_restarted = threading.Event()
+    breakdowns = {}
+
+    def counting_session():
+        profiling.new_scope()
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            for _ in range(2):
+                # NB: e.g. the count worker
+                worker.submit(profiling.in_scope(profiling.record), 'calibre.item_ids', 0.25).result()
+        has_counted.set()
+        has_restarted.wait(10)
+        breakdowns['counting'] = profiling.breakdown()
+
+    def restarting_session():
+        has_counted.wait(10)
+        # NB: e.g. a new search, w/ the overlay on
+        profiling.new_scope()
+        profiling.reset()
+        breakdowns['restarting'] = profiling.breakdown()
+        has_restarted.set()
+
+    sessions = [threading.Thread(target=counting_session), threading.Thread(target=restarting_session)]
+    for t in sessions:
+        t.start()
+    for t in sessions:
+        t.join()
+
+    assert breakdowns == {'counting': [('ids', 2, 0.5)], 'restarting': []}
+
+
+def test_worker_records_in_caller_scope(enabled):
+    def session():
+        scope = profiling.new_scope()
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            worker.submit(profiling.in_scope(profiling.record), 'archive.scrape_raw', 0.5).result()
+            # NB: w/o a scope
+            worker.submit(profiling.record, 'archive.scrape_raw', 0.5).result()
+        return (scope, profiling.breakdown())
+
+    with ThreadPoolExecutor(max_workers=1) as session_thread:
+        (scope, breakdown) = session_thread.submit(session).result()
+
+    assert scope == {'archive.scrape_raw': [1, 0.5]}
+    assert breakdown == [('http', 1, 0.5)]
+    assert profiling.spans['archive.scrape_raw'][0] >= 1
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+## ResultSet: items read back as appended, whichever way their columns end up being stored.
+
+from array import array
+
+from dynix_ng.library.result_set import ResultSet
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+CALIBRE_ITEMS = [
+    {'item_id': 1, 'name': 'Huckleberry Finn', 'authors': ['Mark Twain'],
+     'pub_date': '1884-12-10 00:00:00+00:00', 'in_lib_date': '2021-03-04 18:22:01+00:00'},
+    # NB: Calibre's "undefined" date
+    {'item_id': 2, 'name': 'Anna Karenina', 'authors': ['Leo Tolstoy', 'Constance Garnett'],
+     'pub_date': '0101-01-01 00:00:00+00:00', 'in_lib_date': None},
+    {'item_id': 3, 'name': 'Tom Sawyer', 'authors': ['Mark Twain'],
+     'pub_date': '1876-06-09 00:00:00+00:00', 'in_lib_date': '2021-03-04 18:22:05+00:00',
+     'series': 'Adventures'},
+]
+
+ARCHIVE_ITEMS = [
+    {'item_id': 'tomsawyer00twai', 'name': 'Tom Sawyer', 'pub_date': '1920-01-01T00:00:00Z'},
+    {'item_id': 'huckfinn00twai', 'name': 'Huckleberry Finn', 'pub_date': '????'},
+]
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_round_trip_w_arrays():
+    result_set = ResultSet()
+    result_set.extend(CALIBRE_ITEMS)
+
+    expected = [dict({'series': None}, **item) for item in CALIBRE_ITEMS]
+    assert list(result_set) == expected
+    assert isinstance(result_set.item_ids, array)
+    assert result_set.columns['pub_date'].typecode == 'q'
+    assert result_set.columns['in_lib_date'].typecode == 'q'
+    assert result_set.columns['name'].typecode == 'i'
+
+
+def test_round_trip_w_fallbacks():
+    result_set = ResultSet()
+    result_set.extend(ARCHIVE_ITEMS)
+    # NB: not hashable
+    result_set.append({'item_id': 'x', 'name': 'X', 'pub_date': None, 'extra': {'a': 1}})
+
+    assert list(result_set)[:2] == [dict(item, extra=None) for item in ARCHIVE_ITEMS]
+    assert result_set[2]['extra'] == {'a': 1}
+    assert isinstance(result_set.item_ids, list)
+    assert result_set.columns['pub_date'].typecode == 'i'
+    assert isinstance(result_set.columns['extra'], list)
+
+
+def test_round_trip_w_spill():
+    result_set = ResultSet(memory_budget=0)
+    result_set.extend(CALIBRE_ITEMS)
+
+    assert result_set.spill_start is not None
+    assert result_set.window(0, 10) == CALIBRE_ITEMS
+    result_set.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+## Recall counts: REGEXP path vs FTS5, token and bitmap indices, which must all match the same items.
+
+import random
+import sqlite3
+
+import pytest
+
+from dynix_ng.library.backend.calibre import CalibreDb, BOOK_SEARCH_FIELDS
+import dynix_ng.library.index.bitmap as bitmap
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+ALL_COLUMNS = ['author', 'publisher', 'title', 'tag', 'series']
+
+QUERIES = [
+    (['title'], ['WAR']),
+    (['title'], ['GONE', 'WIND']),
+    (['title'], ['THE']),
+    # NB: plurals
+    (['title'], ['CATS']),
+    (['title'], ['STARS']),
+    (['title'], ['S']),
+    (['title'], ['SS']),
+    # NB: apostrophes
+    (['title'], ["CAT'S"]),
+    (['title'], ["CATS'"]),
+    (['title'], ["CAT'S'"]),
+    (['title'], ["O'BRIEN'S"]),
+    (['title'], ["DON'T"]),
+    (['title'], ["X'S"]),
+    (['title'], ["'S"]),
+    (['author'], ["O'BRIEN"]),
+    (['author'], ["O'BRIENS"]),
+    # NB: truncation
+    (['title'], ['COMPUT?']),
+    (['title'], ['CAT?']),
+    (['title'], ["CAT'?"]),
+    (['title'], ['C?']),
+    (['title'], ['S?']),
+    (['title'], ['CA?', 'HAT']),
+    (['tag'], ['SCIENCE', 'FICT?']),
+    (ALL_COLUMNS, ['COMPUT?']),
+    (ALL_COLUMNS, ['MARK', 'TWAIN']),
+    (ALL_COLUMNS, ['CATS', 'TALES']),
+    # NB: case folding outside of ASCII
+    (['title'], ['ISTANBUL']),
+    (['title'], ['İSTANBUL']),
+    (['title'], ['KEY']),
+    (['title'], ['SMITH']),
+    (['title'], ['MISSISSIPPI']),
+    (['title'], ['STRASSE']),
+    (['title'], ['STRAßE']),
+    (['title'], ['FISH']),
+    (['title'], ['ΣΟΦΙΑΣ']),
+    (['title'], ['CAFÉ_AU_LAIT']),
+    (['title'], ['1984']),
+    (['title'], ['C']),
+]
+
+NB_RANDOM_QUERIES = 500
+
+RANDOM_COLUMNS = [['title'], ['author'], ['publisher'], ['tag'], ['series'], ALL_COLUMNS]
+
+
+
+## ------------------------------------------------------------------------
+## FIXTURES
+
+@pytest.fixture(scope='module')
+def regexp_db(synth_library):
+    db = CalibreDb(synth_library, fts_index=False, token_index=False)
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def fts_db(synth_library):
+    db = CalibreDb(synth_library, token_index=False)
+    if db.fts_index is None:
+        pytest.skip('FTS5 not available')
+    db.sync_indices()
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def token_db(synth_library):
+    # NB: uncapped, for `?` to expand to all the tokens REGEXP matches
+    db = CalibreDb(synth_library, fts_index=False, max_expansions=None)
+    assert db.token_index is not None
+    db.sync_indices()
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def bitmap_db(synth_library):
+    if not bitmap.is_available():
+        pytest.skip('numpy not available')
+    db = CalibreDb(synth_library, fts_index=False, token_index=False, bitmap_index=True, max_expansions=None)
+    db.sync_indices()
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def random_queries(regexp_db):
+    # NB: from the library's own vocabulary, w/ the suffixes the recall rules treat specially
+    words = set()
+    with regexp_db.pool.connection() as cnnx:
+        for expr in BOOK_SEARCH_FIELDS.values():
+            for (v,) in cnnx.execute('SELECT ' + expr + ' FROM books AS b'):
+                if v:
+                    words.update(recall.WORD_RX.findall(v.upper()))
+    words = sorted(words)
+
+    rnd = random.Random(3)
+    def random_term():
+        w = rnd.choice(words)
+        r = rnd.random()
+        if r < 0.2:
+            return w[:rnd.randint(1, len(w))] + '?'
+        elif r < 0.35:
+            return w.rstrip('S') + 'S'
+        elif r < 0.45:
+            return w + "'S"
+        elif r < 0.5:
+            return w + "S'"
+        elif r < 0.55:
+            return w.split("'")[-1]
+        return w
+
+    return [(rnd.choice(RANDOM_COLUMNS), [random_term() for _ in range(rnd.choice([1, 1, 2, 3]))])
+            for _ in range(NB_RANDOM_QUERIES)]
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def regexp_ids(db, columns, query_terms):
+    return db.item_ids(where=recall.recall_to_sql(columns, query_terms, db.BACKEND_DIALECT))
+
+
+def index_ids(db, columns, query_terms):
+    return db.item_ids(where=recall.recall_to_db_dialect(db, columns, query_terms))
+
+
+def bitmap_ids(db, columns, query_terms):
+    matches = db.bitmap_index.recall_matches(columns, query_terms)
+    if matches is None:
+        return None
+    return frozenset(int(i) for i in matches.item_ids())
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+@pytest.mark.parametrize('columns, query_terms', QUERIES)
+def test_fts_matches_regexp(regexp_db, fts_db, columns, query_terms):
+    assert index_ids(fts_db, columns, query_terms) == regexp_ids(regexp_db, columns, query_terms)
+
+
+@pytest.mark.parametrize('columns, query_terms', QUERIES)
+def test_tokens_match_regexp(regexp_db, token_db, columns, query_terms):
+    assert index_ids(token_db, columns, query_terms) == regexp_ids(regexp_db, columns, query_terms)
+
+
+@pytest.mark.parametrize('columns, query_terms', QUERIES)
+def test_bitmap_matches_regexp(regexp_db, bitmap_db, columns, query_terms):
+    ids = bitmap_ids(bitmap_db, columns, query_terms)
+    if ids is not None:
+        assert ids == regexp_ids(regexp_db, columns, query_terms)
+
+
+@pytest.mark.parametrize('columns, query_terms', QUERIES)
+def test_bitmap_counts_match_regexp(regexp_db, bitmap_db, columns, query_terms, monkeypatch):
+    recall_matches = bitmap_db.bitmap_index.recall_matches
+    calls = []
+    def spy(*args):
+        calls.append(args)
+        return recall_matches(*args)
+    monkeypatch.setattr(bitmap_db.bitmap_index, 'recall_matches', spy)
+
+    where = recall.recall_to_db_dialect(bitmap_db, columns, query_terms)
+    count = bitmap_db.item_list(fetch_mode='first', fetch_format='count', where=where)
+    assert count == len(regexp_ids(regexp_db, columns, query_terms))
+    assert calls
+
+
+def test_indices_get_used(fts_db, token_db, bitmap_db):
+    # NB: or the tests above would only compare REGEXP w/ itself
+    assert 'calibre_fts' in recall.recall_to_db_dialect(fts_db, ['title'], ["CAT'S"])
+    assert 'calibre_tokens' in recall.recall_to_db_dialect(token_db, ALL_COLUMNS, ['COMPUT?'])
+    assert bitmap_ids(bitmap_db, ['title'], ['CATS']) is not None
+
+
+def test_random_queries(regexp_db, fts_db, token_db, bitmap_db, random_queries):
+    for (columns, query_terms) in random_queries:
+        expected = regexp_ids(regexp_db, columns, query_terms)
+        assert index_ids(fts_db, columns, query_terms) == expected, (columns, query_terms)
+        assert index_ids(token_db, columns, query_terms) == expected, (columns, query_terms)
+        ids = bitmap_ids(bitmap_db, columns, query_terms)
+        assert ids is None or ids == expected, (columns, query_terms)
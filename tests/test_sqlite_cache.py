@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+## SqliteCache: its running byte total, as entries get put, replaced and evicted, possibly by another process.
+
+import json
+
+from dynix_ng.utils.cache import SqliteCache
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def summed_size(cache):
+    return cache.cnnx.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+
+
+## ------------------------------------------------------------------------
+## TESTS
+
+def test_nbytes_tracks_puts(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.db'), max_bytes=1000)
+    cache.put('a', 'x' * 100)
+    cache.put('b', 'x' * 200)
+    # NB: replaced
+    cache.put('a', 'x' * 10)
+    assert cache.nbytes() == summed_size(cache) == 2 * len(json.dumps('')) + 210
+
+    # NB: evicts 'b', the least recently accessed
+    cache.get('a')
+    cache.put('c', 'x' * 900)
+    assert cache.get('b') is None
+    assert cache.nbytes() == summed_size(cache) <= 1000
+
+    cache.clear()
+    assert cache.nbytes() == 0
+    cache.close()
+
+
+def test_nbytes_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SqliteCache(path, max_bytes=1000)
+    other_cache = SqliteCache(path, max_bytes=1000)
+    cache.put('a', 'x' * 600)
+    other_cache.put('b', 'x' * 600)
+
+    assert cache.get('a') is None
+    assert cache.nbytes() == other_cache.nbytes() == summed_size(cache) <= 1000
+    cache.close()
+    other_cache.close()
+
+
+def test_nbytes_of_existing_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SqliteCache(path)
+    cache.put('a', 'x' * 100)
+    # NB: as created before the running total
+    cache.cnnx.execute('DROP TABLE totals')
+    cache.close()
+
+    cache = SqliteCache(path)
+    assert cache.nbytes() == summed_size(cache) == 102
+    cache.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+## `?` truncation: expansion by the term dictionary, its `max_expansions` cap, and the fallbacks.
+
+import pytest
+
+from dynix_ng.library.backend.calibre import CalibreDb
+from dynix_ng.library.index.terms import TermDictionary
+import dynix_ng.library.index.bitmap as bitmap
+import dynix_ng.utils.query.recall as recall
+
+
+
+## ------------------------------------------------------------------------
+## CONF
+
+TITLE_TOKENS = ['dogs', 'cat', 'zebra', "cat's", 'catalog', 'category', 'cathedral', 'cats', 'dog']
+
+
+
+## ------------------------------------------------------------------------
+## FIXTURES
+
+@pytest.fixture
+def terms():
+    return TermDictionary.from_tokens({'title': TITLE_TOKENS, 'author': ['twain', 'tolstoy']}, max_expansions=3)
+
+
+@pytest.fixture(scope='module')
+def regexp_db(synth_library):
+    db = CalibreDb(synth_library, fts_index=False, token_index=False)
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def capped_db(synth_library):
+    db = CalibreDb(synth_library, fts_index=False, max_expansions=4)
+    assert db.token_index is not None
+    db.sync_indices()
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope='module')
+def uncapped_db(synth_library):
+    db = CalibreDb(synth_library, fts_index=False, max_expansions=None)
+    assert db.token_index is not None
+    db.sync_indices()
+    yield db
+    db.close()
+
+
+
+## ------------------------------------------------------------------------
+## HELPERS
+
+def recall_ids(db, columns, query_terms):
+    return db.item_ids(where=recall.recall_to_db_dialect(db, columns, query_terms))
+
+
+def regexp_ids(db, columns, query_terms):
+    return db.item_ids(where=recall.recall_to_sql(columns, query_terms, db.BACKEND_DIALECT))
+
+
+
+## ------------------------------------------------------------------------
+## TESTS: DICTIONARY
+
+def test_from_tokens_sorts_and_dedups():
+    terms = TermDictionary.from_tokens({'title': ['b', 'a', 'b', 'c']})
+    assert terms.terms == {'title': ['a', 'b', 'c']}
+    assert len(terms) == 3
+    assert terms.covers(['title'])
+    assert not terms.covers(['title', 'author'])
+
+
+def test_prefix_range(terms):
+    vocabulary = terms.terms['title']
+    (start, end) = terms.prefix_range('title', 'cat')
+    assert vocabulary[start:end] == ['cat', "cat's", 'catalog', 'category', 'cathedral', 'cats']
+    (start, end) = terms.prefix_range('title', 'dog')
+    assert vocabulary[start:end] == ['dog', 'dogs']
+    assert terms.prefix_range('title', 'cow') == terms.prefix_range('title', 'cox')
+    (start, end) = terms.prefix_range('title', 'zz')
+    assert start == end
+
+
+def test_expand_under_cap(terms):
+    assert terms.expand('title', 'dog') == (['dog', 'dogs'], False)
+    assert terms.expand('title', 'cate') == (['category'], False)
+    assert terms.expand('title', 'cow') == ([], False)
+    assert not terms.is_capped('title', 'dog')
+
+
+def test_expand_at_cap(terms):
+    # NB: exactly `max_expansions` is not capped
+    assert terms.expand('title', "cat'") == (["cat's"], False)
+    assert terms.expand('title', 'cata') == (['catalog'], False)
+    terms = TermDictionary.from_tokens({'title': TITLE_TOKENS}, max_expansions=2)
+    assert terms.expand('title', 'dog') == (['dog', 'dogs'], False)
+    assert not terms.is_capped('title', 'dog')
+
+
+def test_expand_over_cap(terms):
+    # NB: the 1st ones, in alphabetical order
+    assert terms.expand('title', 'cat') == (['cat', "cat's", 'catalog'], True)
+    assert terms.expand('title', 'c') == (['cat', "cat's", 'catalog'], True)
+    assert terms.is_capped('title', 'cat')
+    assert not terms.is_capped('author', 't')
+
+
+def test_expand_uncapped():
+    terms = TermDictionary.from_tokens({'title': TITLE_TOKENS}, max_expansions=None)
+    assert terms.expand('title', 'cat') == (['cat', "cat's", 'catalog', 'category', 'cathedral', 'cats'], False)
+    assert not terms.is_capped('title', 'c')
+
+
+
+## ------------------------------------------------------------------------
+## TESTS: BACKEND
+
+@pytest.mark.parametrize('query_terms', [['COMPUT?'], ['CAT?'], ['S?'], ['A?', 'THE'], ['Z?']])
+def test_uncapped_expansion_matches_regexp(regexp_db, uncapped_db, query_terms):
+    assert 'calibre_tokens' in recall.recall_to_db_dialect(uncapped_db, ['title'], query_terms)
+    assert recall_ids(uncapped_db, ['title'], query_terms) == regexp_ids(regexp_db, ['title'], query_terms)
+    assert not uncapped_db.expansion_is_capped(['title'], query_terms[0])
+
+
+def test_capped_expansion(regexp_db, capped_db, uncapped_db):
+    columns = ['author', 'publisher', 'title', 'tag', 'series']
+    # NB: "C?" expands to many more tokens than `max_expansions`, "COMPUTE?" to less
+    assert capped_db.expansion_is_capped(columns, 'C?')
+    assert capped_db.expansion_is_capped(['title'], 'C?')
+    assert not capped_db.expansion_is_capped(columns, 'COMPUTE?')
+    assert not uncapped_db.expansion_is_capped(columns, 'C?')
+
+    capped = recall_ids(capped_db, columns, ['C?'])
+    uncapped = recall_ids(uncapped_db, columns, ['C?'])
+    assert capped < uncapped
+    assert uncapped == regexp_ids(regexp_db, columns, ['C?'])
+    assert recall_ids(capped_db, columns, ['COMPUTE?']) == regexp_ids(regexp_db, columns, ['COMPUTE?'])
+
+
+def test_capped_expansion_gets_first_tokens(capped_db):
+    terms = capped_db.token_index.terms
+    (tokens, is_capped) = terms.expand('title', 'c')
+    assert is_capped
+    assert tokens == terms.terms['title'][slice(*terms.prefix_range('title', 'c'))][:4]
+
+
+def test_untruncated_terms_are_never_capped(capped_db):
+    assert not capped_db.expansion_is_capped(['title'], 'CAT')
+    assert not capped_db.expansion_is_capped(['title'], 'CATS')
+    assert not capped_db.expansion_is_capped(['title'], "CAT'S")
+
+
+@pytest.mark.parametrize('query_terms', [['C?T'], ['?'], ['CA?S'], ['C?', 'C?T']])
+def test_inner_truncation_falls_back_to_regexp(regexp_db, capped_db, query_terms):
+    # NB: not expressible as a token prefix, so not capped either
+    assert recall.recall_to_tokens(query_terms) is None
+    assert 'calibre_tokens' not in recall.recall_to_db_dialect(capped_db, ['title'], query_terms)
+    assert recall_ids(capped_db, ['title'], query_terms) == regexp_ids(regexp_db, ['title'], query_terms)
+    assert not capped_db.expansion_is_capped(['title'], query_terms[-1])
+
+
+def test_expansion_not_capped_wo_token_index(regexp_db):
+    assert not regexp_db.expansion_is_capped(['title'], 'C?')
+
+
+def test_bitmap_index_shares_cap(synth_library, capped_db):
+    if not bitmap.is_available():
+        pytest.skip('numpy not available')
+    db = CalibreDb(synth_library, fts_index=False, token_index=False, bitmap_index=True, max_expansions=4)
+    db.sync_indices()
+    try:
+        assert db.expansion_is_capped(['title'], 'C?')
+        assert frozenset(int(i) for i in db.bitmap_index.recall_matches(['title'], ['C?']).item_ids()) \
+            == recall_ids(capped_db, ['title'], ['C?'])
+    finally:
+        db.close()